@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time `evapro lims2evapro` and `evapro cron` offline, per stage and end to end.
+
+The LIMS databases are synthetic SQLite files behind a pymysql-compatible
+shim (fakelims.py) and annoeva is replaced by fake_annoeva.py, so no MySQL
+server, network access or annoeva install is needed.
+
+Usage:
+    python benchmarks/bench_sync.py [--bills 20000] [--latency 0.02] [--jobs 4] [--rounds 2] [--json out.json]
+
+Round 1 starts from an empty syncproject.db; later rounds rerun the sync on
+the same database and measure the incremental path. Run it where evapro is
+importable, e.g. after `poetry install`.
+"""
+
+import argparse
+import contextlib
+import getpass
+import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import yaml
+
+from evapro.config.settings import Config
+from evapro.db.lims import LimsSession
+from evapro.db.update_db import lims2evaproDB, update_project_workdir, update_project_user
+from evapro.dispatch.cron import add_project2annoeva
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakelims import FakeLims  # noqa: E402
+
+FAKE_ANNOEVA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_annoeva.py')
+
+def bench_conf(workdir: str, fake: FakeLims, latency: float, fail_rate: float, jobs: int, mode: str) -> Config:
+    """evapro configuration pointing at files under workdir"""
+    annoevaconf = os.path.join(workdir, 'evaconf.yaml')
+    with open(annoevaconf, 'w') as f:
+        yaml.safe_dump({'autoconf': {p: {} for p in fake.autoconf_products()}}, f)
+    annoeva = f"{sys.executable} {FAKE_ANNOEVA} --latency {latency} --fail-rate {fail_rate}"
+    return Config.from_dict({
+        'syncproject': os.path.join(workdir, 'syncproject.db'),
+        'syn_lims_time': '2024-12-31 00:00:00',
+        'annoevaconf': annoevaconf,
+        'annoeva': annoeva,
+        'annoeva_jobs': jobs,
+        'annoeva_timeout': 60,
+        'annoeva_mode': mode,
+        'lims_chunk_size': 500,
+        'lims_query_workers': 2,
+        'lims_stream_chunk_size': 5000,
+        'lims_cache_ttl': 86400,
+        'sqlite': {'journal_mode': 'WAL', 'busy_timeout': 30000, 'synchronous': 'NORMAL'},
+        'cloud_message_info': {'db': 'cloud_message_info'},
+        'lims3': {'db': 'lims3'},
+        'ADuser': {},
+    })
+
+def count_rows(dbpath: str) -> dict:
+    with sqlite3.connect(dbpath) as conn:
+        total, pending, added = conn.execute("""
+            SELECT COUNT(*),
+                   SUM(isadd2annoeva = 'N' AND workdir != ''),
+                   SUM(isadd2annoeva = 'Y')
+            FROM all_ana_projects
+        """).fetchone()
+    return {'projects': total, 'pending': pending or 0, 'added': added or 0}
+
+def timed(func, *args, quiet: bool = True, **kwargs) -> float:
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+        func(*args, **kwargs)
+    return time.perf_counter() - start
+
+def run_round(conf: Config, fake: FakeLims, quiet: bool) -> dict:
+    """One `evapro lims2evapro` followed by one `evapro cron`"""
+    stages = {}
+    start = time.perf_counter()
+    with LimsSession(conf, connect=fake.connect) as session:
+        stages['lims2evaproDB'] = timed(lims2evaproDB, session, conf, quiet=quiet)
+        stages['update_project_workdir'] = timed(update_project_workdir, session, conf, quiet=quiet)
+        stages['update_project_user'] = timed(update_project_user, session, conf, quiet=quiet)
+    stages['lims2evapro'] = time.perf_counter() - start
+    stages['cron'] = timed(add_project2annoeva, conf=conf, quiet=quiet)
+    stages['total'] = stages['lims2evapro'] + stages['cron']
+    return stages
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--bills', type=int, default=20_000, help='rows in the fake tb_info_sequence_bill')
+    parser.add_argument('--users', type=int, default=20, help='distinct analysis users, one of them is the current user')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per fake annoeva call')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of fake annoeva calls that fail')
+    parser.add_argument('--jobs', type=int, default=4, help='annoeva_jobs')
+    parser.add_argument('--mode', default='subprocess', choices=['subprocess', 'helper', 'auto'], help='annoeva_mode')
+    parser.add_argument('--rounds', type=int, default=2, help='sync rounds on the same database')
+    parser.add_argument('--json', metavar='PATH', help='also write the timings as JSON')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the stages')
+    args = parser.parse_args()
+
+    # cron 只登记当前用户的项目
+    users = [getpass.getuser()] + [f'user{i}' for i in range(1, args.users)]
+
+    with tempfile.TemporaryDirectory(prefix='evapro-bench-') as workdir:
+        fake = FakeLims(os.path.join(workdir, 'lims'))
+        start = time.perf_counter()
+        fake.build(args.bills, users)
+        print(f"fake LIMS: {args.bills} bills, {args.users} users, built in {time.perf_counter() - start:.2f}s")
+        conf = bench_conf(workdir, fake, args.latency, args.fail_rate, args.jobs, args.mode)
+
+        report = {'params': vars(args), 'rounds': []}
+        print(f"{'round':>5}  {'stage':<24}{'seconds':>10}")
+        for n in range(1, args.rounds + 1):
+            stages = run_round(conf, fake, quiet=not args.verbose)
+            rows = count_rows(conf.syncproject)
+            report['rounds'].append({'round': n, 'seconds': stages, 'rows': rows})
+            for stage, seconds in stages.items():
+                print(f"{n:>5}  {stage:<24}{seconds:>10.3f}")
+            print(f"{n:>5}  {'rows':<24}{json.dumps(rows)}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark evapro.db.transform.build_allpro_records on synthetic LIMS bills.
+
+Usage:
+    python benchmarks/bench_transform.py [--sizes 10000 100000 1000000] [--repeat 3]
+
+Run it where evapro is importable, e.g. after `poetry install`.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+from pandas import DataFrame, Timestamp, to_timedelta
+
+from evapro.db.transform import build_allpro_records
+
+def synthetic_bills(n: int, n_products: int = 500, seed: int = 0) -> tuple:
+    """Build n bills, a product map and a workdir map covering about half of them.
+
+    Returns:
+        tuple: (bills, product_map, paths, autoflow_products)
+    """
+    rng = np.random.default_rng(seed)
+    start = Timestamp('2025-01-01')
+    minutes = to_timedelta(np.sort(rng.integers(0, 365 * 24 * 60, n)), unit='min')
+    codes = np.char.add('P', np.arange(n).astype(str))
+    parents = rng.integers(0, n_products, n)
+    children = rng.integers(0, 3, n)
+
+    bills = DataFrame({
+        'create_date': start + minutes,
+        'info_date': start + minutes + to_timedelta(1, unit='h'),
+        'project_code': codes,
+        'task_name': 'task',
+        'info_user_id': np.char.add('user', (parents % 50).astype(str)),
+        'product_ID': np.char.add(np.char.add(parents.astype(str), '-'), children.astype(str)),
+    })
+
+    # 90% 的产品编号有对应的产品类型
+    ids = [f'{p}-{c}' for p in range(int(n_products * 0.9)) for c in range(3)]
+    product_map = DataFrame({'PRODUCT': [f'prod{i % 40}' for i in range(len(ids))]}, index=ids)
+    product_map.index.name = 'PRODUCT_LIMS_ID'
+    paths = {code: f'/work/{code}' for code in codes[::2]}
+    autoflow_products = {f'prod{i}' for i in range(0, 40, 2)}
+    return bills, product_map, paths, autoflow_products
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3, help='runs per size, the fastest is reported')
+    args = parser.parse_args()
+
+    print(f"{'rows':>10}{'records':>10}{'unmatched':>11}{'seconds':>10}{'rows/s':>12}")
+    for n in args.sizes:
+        data = synthetic_bills(n)
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            records, unmatched = build_allpro_records(*data)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{n:>10}{records.shape[0]:>10}{unmatched.shape[0]:>11}{best:>10.3f}{n / best:>12.0f}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stand-in for the annoeva executable used by the benchmarks.
+
+Usage:
+    python benchmarks/fake_annoeva.py [--latency 0.05] [--fail-rate 0] addproject -p PROID -t PTYPE -d WORKDIR
+
+Sleeps for --latency seconds and exits 0, or 1 for about --fail-rate of the
+projects (chosen by a hash of the project id, so reruns fail the same ones).
+"""
+
+import argparse
+import sys
+import time
+import zlib
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per addproject call')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of projects that fail')
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('addproject')
+    add.add_argument('-p', dest='proid', required=True)
+    add.add_argument('-t', dest='ptype', required=True)
+    add.add_argument('-d', dest='workdir', required=True)
+    args = parser.parse_args(argv)
+
+    time.sleep(args.latency)
+    if zlib.crc32(args.proid.encode()) % 10000 < args.fail_rate * 10000:
+        print(f"fake annoeva: refused {args.proid}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A pymysql-compatible stand-in for the LIMS MySQL databases, backed by SQLite.
+
+Every LIMS database (lims3, cloud_message_info) is a file `<root>/<db>.db`.
+Pass `FakeLims(root).connect` as the connect argument of LimsSession to run
+the lims2evapro stages without network access.
+"""
+
+import datetime
+import os
+import sqlite3
+from typing import Sequence
+
+import numpy as np
+
+class Cursor:
+    """The subset of the pymysql cursor API evapro uses."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._cur = conn.cursor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    @property
+    def rowcount(self) -> int:
+        return self._cur.rowcount
+
+    def execute(self, query: str, args: Sequence = None) -> int:
+        if query.strip().upper().startswith('CHECKSUM TABLE'):
+            raise sqlite3.OperationalError('CHECKSUM TABLE is not supported')
+        self._cur.execute(query.replace('%s', '?'), tuple(args or ()))
+        return self._cur.rowcount
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchmany(self, size: int = 1):
+        return self._cur.fetchmany(size)
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def close(self) -> None:
+        self._cur.close()
+
+class Connection:
+    """The subset of the pymysql connection API evapro uses."""
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False,
+                                     detect_types=sqlite3.PARSE_DECLTYPES)
+
+    def cursor(self, cursorclass=None) -> Cursor:
+        # SSCursor 与普通游标在 sqlite 中没有区别
+        return Cursor(self._conn)
+
+    def ping(self, reconnect: bool = True) -> None:
+        self._conn.execute('SELECT 1')
+
+    def commit(self) -> None:
+        self._conn.commit()
+
+    def rollback(self) -> None:
+        self._conn.rollback()
+
+    def close(self) -> None:
+        self._conn.close()
+
+class FakeLims:
+    """Synthetic LIMS databases under root.
+
+    Args:
+        root (str): Directory holding lims3.db and cloud_message_info.db
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, db: str) -> str:
+        return os.path.join(self.root, f"{db}.db")
+
+    def connect(self, **params) -> Connection:
+        """pymysql.connect() replacement, only the db parameter is used."""
+        path = self.path(params['db'])
+        if not os.path.exists(path):
+            raise sqlite3.OperationalError(f"unknown database {params['db']!r}")
+        return Connection(path)
+
+    def build(self, n_bills: int, users: Sequence[str], n_products: int = 200,
+              backup_ratio: float = 0.5, start: str = '2025-01-01', seed: int = 0) -> None:
+        """Create the LIMS tables filled with synthetic rows.
+
+        Args:
+            n_bills (int): Rows in tb_info_sequence_bill
+            users (Sequence[str]): info_user_id values, assigned round robin
+            n_products (int): Number of product parent ids
+            backup_ratio (float): Share of bills with a project_online_backup_info row
+            start (str): info_date of the oldest bill
+            seed (int): Random seed
+        """
+        os.makedirs(self.root, exist_ok=True)
+        rng = np.random.default_rng(seed)
+        t0 = datetime.datetime.fromisoformat(start)
+
+        with sqlite3.connect(self.path('lims3')) as conn:
+            conn.execute('DROP TABLE IF EXISTS tb_info_sequence_bill')
+            conn.execute("""
+                CREATE TABLE tb_info_sequence_bill (
+                    create_date timestamp, info_date timestamp, project_code text,
+                    product_parent_id integer, product_id integer, task_name text,
+                    info_user_id text, ANALYSIS_TYPE integer
+                )""")
+            minutes = np.sort(rng.integers(0, 365 * 24 * 60, n_bills))
+            parents = rng.integers(0, n_products, n_bills)
+            children = rng.integers(0, 3, n_bills)
+            conn.executemany(
+                'INSERT INTO tb_info_sequence_bill VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    (t0 + datetime.timedelta(minutes=int(m)),
+                     t0 + datetime.timedelta(minutes=int(m) + 60),
+                     f'P{i:08d}', int(parents[i]), int(children[i]), 'task',
+                     users[i % len(users)], 1 if i % 17 else 2)
+                    for i, m in enumerate(minutes)
+                )
+            )
+            conn.execute('CREATE INDEX idx_bill_info_date ON tb_info_sequence_bill(info_date)')
+            conn.execute('CREATE INDEX idx_bill_project_code ON tb_info_sequence_bill(project_code)')
+
+        with sqlite3.connect(self.path('cloud_message_info')) as conn:
+            conn.execute('DROP TABLE IF EXISTS project_online_product_type')
+            conn.execute('DROP TABLE IF EXISTS project_online_backup_info')
+            conn.execute('CREATE TABLE project_online_product_type (PRODUCT_LIMS_ID text, introduction text)')
+            conn.execute("""
+                CREATE TABLE project_online_backup_info (
+                    SUB_PROJECT_ID text, PATHWAY text, MISSION_END_DATE text
+                )""")
+            # 90% 的产品编号有对应的产品类型, 一个类型包含同一父编号下的多个子编号
+            conn.executemany(
+                'INSERT INTO project_online_product_type VALUES (?, ?)',
+                ((', '.join(f'{p}-{c}' for c in range(3)), f'prod{p % 40}')
+                 for p in range(int(n_products * 0.9)))
+            )
+            step = max(1, round(1 / backup_ratio)) if backup_ratio > 0 else 0
+            if step:
+                # evapro cron 只添加 workdir 存在的项目
+                workdirs = [(f'P{i:08d}', os.path.join(self.root, 'work', f'P{i:08d}'))
+                            for i in range(0, n_bills, step)]
+                for _, workdir in workdirs:
+                    os.makedirs(workdir, exist_ok=True)
+                conn.executemany(
+                    'INSERT INTO project_online_backup_info VALUES (?, ?, ?)',
+                    ((proid, workdir, '2025-01-01') for proid, workdir in workdirs)
+                )
+            conn.execute('CREATE INDEX idx_backup_sub_project ON project_online_backup_info(SUB_PROJECT_ID)')
+
+    def autoconf_products(self) -> list:
+        """Product types to list in the fake annoeva evaconf.yaml"""
+        return [f'prod{i}' for i in range(0, 40, 2)]
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Measure the import cost of every evapro subcommand with ``python -X importtime``.
+
+Each subcommand is mapped to the modules its body imports, so the numbers
+cover the CLI entry point plus what the command really loads. Keep
+SUBCOMMAND_IMPORTS in sync with evapro/scripts/evaproject.py.
+
+Usage:
+    python benchmarks/importtime.py [--repeat 5] [--top 5] [subcommand ...]
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+SUBCOMMAND_IMPORTS: Dict[str, List[str]] = {
+    "conf": [],
+    "install-cron": ["evapro.config"],
+    "init": ["evapro.db.database", "evapro.config"],
+    "cron": ["evapro.dispatch.cron"],
+    "lims2evapro": ["evapro.db.update_db"],
+    "daemon": ["evapro.dispatch.daemon"],
+    "stats": ["evapro.db.runmetrics"],
+    "ls": ["evapro.db.query", "evapro.db.connection", "evapro.dispatch.accounts"],
+    "export": ["evapro.db.export", "evapro.db.connection"],
+}
+
+def measure(modules: List[str]) -> Tuple[float, float, List[Tuple[int, str]]]:
+    """Import the CLI and modules in a fresh interpreter.
+
+    Returns:
+        tuple: (wall time ms, summed self import time ms, [(self us, module)])
+    """
+    code = "; ".join(["import evapro.scripts.evaproject"] + [f"import {m}" for m in modules])
+    start = time.perf_counter()
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    wall = (time.perf_counter() - start) * 1000
+    if p.returncode != 0:
+        raise RuntimeError(p.stderr.strip().splitlines()[-1])
+
+    entries = []
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|", 2)
+        entries.append((int(self_us), name.strip()))
+    return wall, sum(us for us, _ in entries) / 1000, entries
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("subcommands", nargs="*", default=list(SUBCOMMAND_IMPORTS))
+    parser.add_argument("--repeat", type=int, default=5, help="runs per subcommand, the fastest is reported")
+    parser.add_argument("--top", type=int, default=5, help="number of slowest modules to list")
+    args = parser.parse_args()
+
+    print(f"{'subcommand':<14}{'wall ms':>10}{'import ms':>12}  slowest modules (self ms)")
+    for cmd in args.subcommands:
+        runs = [measure(SUBCOMMAND_IMPORTS[cmd]) for _ in range(args.repeat)]
+        wall, total, entries = min(runs, key=lambda r: r[1])
+        slowest = ", ".join(f"{name} {us / 1000:.1f}" for us, name in sorted(entries, reverse=True)[:args.top])
+        print(f"{cmd:<14}{wall:>10.1f}{total:>12.1f}  {slowest}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,15 @@
 """Evapro - Automated add projects to annoeva Workflow Monitoring System
 """
 
-from evapro.scripts.evaproject import main
-
 __author__ = "Zan Yuan <yfinddream@gmail.com>"
 __license__ = "MIT"
 
 __all__ = ["main"]
 
+
+def __getattr__(name):
+    # 延迟导入 CLI, import evapro.db 等子模块时不加载 click
+    if name == "main":
+        from evapro.scripts.evaproject import main
+        return main
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
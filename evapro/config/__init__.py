@@ -2,3 +2,8 @@ from .conf import (
     cronlist,
     set_dbpath
 )
+from .settings import (
+    Config,
+    ConfigError,
+    load_config
+)
@@ -1,11 +1,10 @@
 from dataclasses import dataclass
 import subprocess
-import importlib.resources
 from pathlib import Path
 import os
 from pathlib import Path
 import yaml
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 def get_evapro_path() -> str:
     try:
@@ -20,35 +19,27 @@ def get_evapro_path() -> str:
 class cronlist(object):
     """Manage cron jobs for evapro.
     """
-    cronnode: str = None
-    program: str = None
+    program: str = ""
     def __post_init__(self):
         self.program = get_evapro_path()
 
-    def add_cron(self):
-        confpath = importlib.resources.path("evapro.config", "evapro.yaml")
-        with confpath as default_config:
-            conf = _get_yaml_data(default_config)
-            import socket
-            if 'cronnode' not in conf:
-                conf['cronnode'] = socket.gethostname()
-                with open(default_config, 'w', encoding='utf-8') as f:
-                    yaml.safe_dump(conf, f, allow_unicode=True, sort_keys=False)
-            else:
-                if conf['cronnode'] != socket.gethostname():
-                    print(f"当前主机名与配置文件中的主机名不匹配: {socket.gethostname()} != {conf['cronnode']}\n请更换节点")
-                    return
+    def add_cron(self, command: str = 'cron', schedule: str = '0 */3 * * *'):
+        """Add `evapro <command>` to the crontab of the current account once.
 
+        Args:
+            command (str): evapro subcommand to schedule
+            schedule (str): crontab time fields
+        """
         p = subprocess.Popen('crontab -l', shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         stdoutput, _ = p.communicate()
         crontable = str(stdoutput,'utf-8').split('\n')
         need_addcron = 1
         for line in crontable:
-            if line.find(f'{os.path.basename(self.program)} cron'.format()) > 0:
+            if line.find(f'{os.path.basename(self.program)} {command}') > 0:
                 need_addcron = 0
         if need_addcron == 1:
-            #run cron project per 2 hours
-            line = f'0 */3 * * * {self.program} cron'
+            #run cron project per 3 hours
+            line = f'{schedule} {self.program} {command}'
             crontable.append(line)
 
             pipe = os.popen('crontab', 'w')
@@ -59,37 +50,33 @@ class cronlist(object):
             pipe.flush()
             pipe.close()
 
-def get_dbpath() -> Path:
+def get_dbpath() -> Optional[str]:
     """Get syncdbpath.db path
     """
-    confpath = importlib.resources.path("evapro.config", "evapro.yaml")
-    if os.path.isfile(confpath):
-        with confpath as default_config:
-            conf = _get_yaml_data(default_config)
-            if 'syncproject' in conf:
-                if os.path.isfile(conf['syncproject']):
-                    return conf['syncproject']
-                else:
-                    print(f"指定的数据库路径不存在: {confpath}")
-                    return None
+    from .settings import load_config
+
+    dbpath = load_config().syncproject
+    if os.path.isfile(dbpath):
+        return dbpath
+    print(f"指定的数据库路径不存在: {dbpath}")
+    return None
 
 def set_dbpath(syncdbdir: str) -> None:
     """Set syncdbpath.db path
     """
-    confpath = importlib.resources.path("evapro.config", "evapro.yaml")
-    
+    from .settings import package_config_path
+
+    # EVAPRO_CONFIG 指定了配置文件时修改该文件
+    confpath = package_config_path()
     try:
-        with confpath as default_config:
-            conf = _get_yaml_data(default_config)
-            # 初始化autoconf节点如果不存在
-            conf['syncproject'] = f'{syncdbdir}/syncproject.db'
-            # 保存修改后的配置
-            with open(default_config, 'w', encoding='utf-8') as f:
-                yaml.safe_dump(conf, f, allow_unicode=True, sort_keys=False)
-            
-            print(f'请修改配置文件中的lims数据库配置\n{str(confpath)}')
-            ###########
-            #return Path(default_confi
+        conf = _get_yaml_data(confpath)
+        # 初始化autoconf节点如果不存在
+        conf['syncproject'] = f'{syncdbdir}/syncproject.db'
+        # 保存修改后的配置
+        with open(confpath, 'w', encoding='utf-8') as f:
+            yaml.safe_dump(conf, f, allow_unicode=True, sort_keys=False)
+
+        print(f'请修改配置文件中的lims数据库配置\n{str(confpath)}')
     except PermissionError as e:
         print(f"权限不足无法修改配置文件: {e.filename}")
     except Exception as e:
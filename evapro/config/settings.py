@@ -0,0 +1,299 @@
+"""
+Typed, validated and memoized evapro configuration.
+
+The configuration is read from, in increasing priority:
+
+1. evapro.yaml shipped in this package, or the file named by EVAPRO_CONFIG
+2. the user-level file named by EVAPRO_USER_CONFIG, by default
+   ~/.config/evapro/evapro.yaml, when it exists
+3. EVAPRO_<KEY> environment variables, e.g. EVAPRO_ANNOEVA_JOBS=8 or
+   EVAPRO_LIMS3__PASSWD=secret for a key inside a section
+
+load_config() parses the files once per process and again only when one of
+their mtimes changes.
+"""
+
+import dataclasses
+import importlib.resources
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple, Union
+
+import yaml
+
+from .conf import _get_yaml_data
+
+CONFIG_ENV = "EVAPRO_CONFIG"
+USER_CONFIG_ENV = "EVAPRO_USER_CONFIG"
+USER_CONFIG_PATH = "~/.config/evapro/evapro.yaml"
+ENV_PREFIX = "EVAPRO_"
+
+# 各个命令必需的配置项
+REQUIRED_KEYS = ("syncproject", "annoeva", "annoevaconf")
+LIMS_KEYS = ("syn_lims_time", "lims3", "cloud_message_info")
+
+ANNOEVA_MODES = ("subprocess", "inprocess", "helper", "auto")
+
+class ConfigError(ValueError):
+    """Raised for a missing or invalid configuration value."""
+
+@dataclass(frozen=True)
+class Config(Mapping):
+    """evapro.yaml as a typed object.
+
+    Known keys are attributes with the types below. The object is also a
+    read-only mapping over the merged data, so conf['key'] and conf.get()
+    keep working for sections such as lims3 and for unknown keys.
+
+    Attributes:
+        sources (Tuple[str, ...]): Files the configuration was merged from
+        overrides (Tuple[str, ...]): Environment variables that were applied
+    """
+    syncproject: str
+    annoeva: str
+    annoevaconf: str
+    syn_lims_time: Optional[str] = None
+    lims_chunk_size: int = 500
+    lims_query_workers: int = 1
+    lims_stream_chunk_size: int = 5000
+    lims_cache_ttl: float = 86400.0
+    sync_lease_ttl: float = 300.0
+    annoeva_jobs: int = 1
+    annoeva_timeout: Optional[float] = None
+    annoeva_mode: str = "subprocess"
+    annoeva_python: Optional[str] = None
+    dispatch_command_prefix: Optional[str] = None
+    dispatch_claim_ttl: float = 3600.0
+    cron_user_workers: int = 4
+    daemon_poll_interval: float = 2.0
+    daemon_rescan_interval: float = 600.0
+    daemon_retry_delay: float = 1800.0
+    workdir_probe_timeout: float = 5.0
+    workdir_probe_workers: int = 16
+    workdir_retry_interval: float = 3600.0
+    metrics_textfile_dir: Optional[str] = None
+    metrics_keep_runs: int = 1000
+    sqlite: Dict[str, Any] = field(default_factory=dict)
+    lims3: Dict[str, Any] = field(default_factory=dict)
+    cloud_message_info: Dict[str, Any] = field(default_factory=dict)
+    ADuser: Dict[str, str] = field(default_factory=dict)
+    sources: Tuple[str, ...] = ()
+    overrides: Tuple[str, ...] = ()
+    raw: Dict[str, Any] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any], sources: Tuple[str, ...] = (), overrides: Tuple[str, ...] = ()) -> "Config":
+        """Build and validate a Config from parsed YAML data.
+
+        Raises:
+            ConfigError: If a required key is missing or a value has the wrong type
+        """
+        missing = [key for key in REQUIRED_KEYS if not data.get(key)]
+        if missing:
+            raise ConfigError(f"missing required config keys: {', '.join(missing)} ({', '.join(sources) or 'dict'})")
+
+        values = {}
+        for f in dataclasses.fields(cls):
+            if f.name in ("sources", "overrides", "raw") or f.name not in data or data[f.name] is None:
+                continue
+            values[f.name] = _coerce(f.name, f.type, data[f.name])
+        if values.get("annoeva_mode", "subprocess") not in ANNOEVA_MODES:
+            raise ConfigError(f"annoeva_mode must be one of {', '.join(ANNOEVA_MODES)}, got {values['annoeva_mode']!r}")
+        for key in ("lims_chunk_size", "lims_query_workers", "lims_stream_chunk_size", "annoeva_jobs",
+                    "cron_user_workers", "metrics_keep_runs", "workdir_probe_workers"):
+            if key in values and values[key] < 1:
+                raise ConfigError(f"{key} must be at least 1, got {values[key]}")
+        for key in ("workdir_probe_timeout", "sync_lease_ttl", "dispatch_claim_ttl"):
+            if key in values and values[key] <= 0:
+                raise ConfigError(f"{key} must be positive, got {values[key]}")
+        values["syncproject"] = os.path.expanduser(values["syncproject"])
+
+        raw = dict(data)
+        raw.update(values)
+        return cls(**values, sources=tuple(sources), overrides=tuple(overrides), raw=raw)
+
+    def require(self, *keys: str) -> "Config":
+        """Check that keys needed by one command are set, return self."""
+        missing = [key for key in keys if not self.raw.get(key)]
+        if missing:
+            raise ConfigError(f"missing config keys: {', '.join(missing)} ({', '.join(self.sources) or 'dict'})")
+        return self
+
+    def reload(self) -> "Config":
+        """Return the current configuration of the same sources, self when unchanged."""
+        if not self.sources:
+            return self
+        return load_config()
+
+    def __getitem__(self, key: str) -> Any:
+        return self.raw[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.raw)
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+def _coerce(key: str, annotation: Any, value: Any) -> Any:
+    """Convert a YAML value to the annotated field type."""
+    if getattr(annotation, "__origin__", None) is Union:
+        # Optional[X]
+        annotation = annotation.__args__[0]
+    kind = getattr(annotation, "__origin__", annotation)
+    if kind is dict:
+        if not isinstance(value, Mapping):
+            raise ConfigError(f"{key} must be a mapping, got {value!r}")
+        return dict(value)
+    if kind in (int, float):
+        try:
+            return kind(value)
+        except (TypeError, ValueError):
+            raise ConfigError(f"{key} must be a number, got {value!r}") from None
+    if kind is str:
+        if isinstance(value, (Mapping, list)):
+            raise ConfigError(f"{key} must be a string, got {value!r}")
+        # syn_lims_time 等时间在 YAML 中会被解析为 datetime
+        return str(value)
+    return value
+
+def package_config_path(environ: Optional[Mapping[str, str]] = None) -> str:
+    """Path of the main evapro.yaml, EVAPRO_CONFIG or the file shipped in the package."""
+    environ = os.environ if environ is None else environ
+    if environ.get(CONFIG_ENV):
+        return os.path.expanduser(environ[CONFIG_ENV])
+    with importlib.resources.path("evapro.config", "evapro.yaml") as path:
+        return str(path)
+
+def user_config_path(environ: Optional[Mapping[str, str]] = None) -> str:
+    """Path of the optional user-level evapro.yaml."""
+    environ = os.environ if environ is None else environ
+    return os.path.expanduser(environ.get(USER_CONFIG_ENV) or USER_CONFIG_PATH)
+
+def _merge(base: dict, extra: Mapping) -> dict:
+    """Merge extra into base, sections (mappings) are merged key by key."""
+    merged = dict(base)
+    for key, value in extra.items():
+        if isinstance(value, Mapping) and isinstance(merged.get(key), Mapping):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def _known_keys(data: Mapping) -> Dict[str, str]:
+    """Lower-cased name -> name of the keys environment variables may set."""
+    names = [f.name for f in dataclasses.fields(Config) if f.name not in ("sources", "overrides", "raw")]
+    names += [str(k) for k in data]
+    return {name.lower(): name for name in names}
+
+def _field_type(key: str) -> Any:
+    """Annotation of the Config field key without Optional, None if key is not a field."""
+    f = Config.__dataclass_fields__.get(key)
+    if f is None or key in ("sources", "overrides", "raw"):
+        return None
+    annotation: Any = f.type
+    if getattr(annotation, "__origin__", None) is Union:
+        annotation = annotation.__args__[0]
+    return annotation
+
+def _env_value(name: str, key: str, text: str) -> Any:
+    """Convert the text of one EVAPRO_<KEY> variable for the top-level key it sets.
+
+    Only a typed Config field (a number, or a whole section as a YAML
+    mapping) is parsed as YAML; str fields and keys unknown to Config keep
+    the raw string, so e.g. an account 0123 stays "0123".
+    """
+    annotation = _field_type(key)
+    if annotation is None:
+        return text
+    if text == "":
+        return None
+    if annotation is str:
+        return text
+    try:
+        return _coerce(key, annotation, yaml.safe_load(text))
+    except yaml.YAMLError as e:
+        raise ConfigError(f"invalid value of {name}: {getattr(e, 'problem', None) or e}") from None
+    except ConfigError as e:
+        raise ConfigError(f"invalid value of {name}: {e}") from None
+
+def _env_overrides(data: dict, environ: Mapping[str, str]) -> Tuple[dict, List[str]]:
+    """Apply EVAPRO_<KEY> and EVAPRO_<SECTION>__<KEY> variables.
+
+    Only Config fields and keys of the loaded files are overridden, so
+    unrelated EVAPRO_* variables are ignored. Values of typed Config fields
+    are converted to the field type, all other values are kept as strings.
+
+    Raises:
+        ConfigError: If the value of a typed field is invalid
+    """
+    applied = []
+    known = _known_keys(data)
+    for name, text in sorted(environ.items()):
+        if not name.startswith(ENV_PREFIX) or name in (CONFIG_ENV, USER_CONFIG_ENV):
+            continue
+        parts = name[len(ENV_PREFIX):].split("__")
+        # 配置项名称不区分大小写, 例如 EVAPRO_ADUSER__ZHANGSAN
+        top = known.get(parts[0].lower())
+        if top is None or not all(parts):
+            continue
+        section = len(parts) > 1
+        kind = _field_type(top)
+        kind = getattr(kind, "__origin__", kind)
+        if section and (kind not in (None, dict) or data.get(top) is not None and not isinstance(data.get(top), Mapping)):
+            continue
+        # 节内的值(如 lims3 的密码)始终按字符串使用
+        value = text if section else _env_value(name, top, text)
+
+        target = data = dict(data)
+        for i, part in enumerate(parts):
+            key = top if i == 0 else next((k for k in target if str(k).lower() == part.lower()), part.lower())
+            if i == len(parts) - 1:
+                target[key] = value
+            else:
+                target[key] = dict(target.get(key) or {})
+                target = target[key]
+        applied.append(name)
+    return data, applied
+
+_lock = threading.Lock()
+_cache: Dict[tuple, Tuple[tuple, Config]] = {}
+
+def _mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def load_config(environ: Optional[Mapping[str, str]] = None) -> Config:
+    """Return the merged, validated configuration.
+
+    The files are parsed again only when their mtimes or the EVAPRO_*
+    environment variables changed since the last call.
+
+    Raises:
+        ConfigError: If a required key is missing or a value is invalid
+        FileNotFoundError: If the main config file does not exist
+    """
+    environ = os.environ if environ is None else environ
+    main_path = package_config_path(environ)
+    user_path = user_config_path(environ)
+    env_items = tuple(sorted((k, v) for k, v in environ.items() if k.startswith(ENV_PREFIX)))
+    key = (main_path, user_path, env_items)
+    stamp = (_mtime(main_path), _mtime(user_path))
+
+    with _lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        data = _get_yaml_data(main_path) or {}
+        sources = [main_path]
+        if stamp[1] is not None and os.path.abspath(user_path) != os.path.abspath(main_path):
+            data = _merge(data, _get_yaml_data(user_path) or {})
+            sources.append(user_path)
+        data, applied = _env_overrides(data, environ)
+        config = Config.from_dict(data, tuple(sources), tuple(applied))
+        _cache.clear()
+        _cache[key] = (stamp, config)
+        return config
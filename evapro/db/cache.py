@@ -0,0 +1,92 @@
+"""
+Local cache of rarely changing LIMS/annoeva lookups, stored in syncproject.db.
+
+An entry younger than its TTL is used as is. An older entry is revalidated
+with a cheap probe (a table checksum, a row count, a file mtime) and only
+reloaded when the probe result differs from the one stored with it.
+"""
+
+import json
+import time
+from typing import Any, Callable, List, Optional
+
+from .database import SQLiteDB
+
+# 缓存默认有效期(秒), 过期后先用 probe 检查数据是否变化
+DEFAULT_TTL = 86400
+
+class LimsCache:
+    """Read and write entries of the lims_cache table.
+
+    Attributes:
+        db (SQLiteDB): Opened syncproject.db, migrated to schema v3 or later
+    """
+
+    def __init__(self, db: SQLiteDB):
+        self.db = db
+
+    def get(self, name: str) -> Optional[tuple]:
+        """Return (checksum, fetched_at, payload) of an entry, None if missing."""
+        row = self.db.cur.execute(
+            "SELECT checksum, fetched_at, payload FROM lims_cache WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def put(self, name: str, checksum: Optional[str], payload: Any) -> None:
+        """Store an entry, replacing the previous one."""
+        self.db.transaction(lambda cur: cur.execute(
+            "INSERT OR REPLACE INTO lims_cache (name, checksum, fetched_at, payload) VALUES (?,?,?,?)",
+            (name, checksum, time.time(), json.dumps(payload, ensure_ascii=False))
+        ))
+
+    def touch(self, name: str) -> None:
+        """Mark an entry as freshly validated."""
+        self.db.transaction(lambda cur: cur.execute(
+            "UPDATE lims_cache SET fetched_at = ? WHERE name = ?", (time.time(), name)
+        ))
+
+    def clear(self, name: Optional[str] = None) -> int:
+        """Delete one entry, or all of them when name is None.
+
+        Returns:
+            int: Number of deleted entries
+        """
+        if name is None:
+            return self.db.transaction(lambda cur: cur.execute("DELETE FROM lims_cache").rowcount)
+        return self.db.transaction(lambda cur: cur.execute("DELETE FROM lims_cache WHERE name = ?", (name,)).rowcount)
+
+    def list(self) -> List[tuple]:
+        """Return (name, checksum, fetched_at) of all entries."""
+        return self.db.cur.execute("SELECT name, checksum, fetched_at FROM lims_cache ORDER BY name").fetchall()
+
+    def cached(self, name: str, probe: Callable[[], Optional[str]], load: Callable[[], Any],
+               ttl: float = DEFAULT_TTL, refresh: bool = False) -> Any:
+        """Return the payload of name, reloading it only when it changed.
+
+        Args:
+            name (str): Cache entry name
+            probe: Cheap callable returning a checksum of the source, None if unknown
+            load: Callable fetching the JSON-serializable payload from the source
+            ttl (float): Seconds an entry is trusted without probing
+            refresh (bool): Reload even if the entry is fresh
+
+        Returns:
+            The cached or freshly loaded payload
+        """
+        entry = None if refresh else self.get(name)
+        if entry is not None:
+            checksum, fetched_at, payload = entry
+            if time.time() - fetched_at < ttl:
+                return payload
+            new_checksum = probe()
+            if new_checksum is not None and new_checksum == checksum:
+                self.touch(name)
+                return payload
+        else:
+            new_checksum = probe()
+
+        payload = load()
+        self.put(name, new_checksum, payload)
+        return payload
@@ -0,0 +1,254 @@
+"""
+Connection tuning and multi-user write coordination for syncproject.db.
+
+Many users' `evapro cron` and the admin's `evapro lims2evapro` write the same
+database. Every connection gets a busy timeout, and every write transaction
+is retried with jittered exponential backoff when SQLite reports the
+database as locked. WAL is used where it is safe; on network filesystems
+(NFS, Lustre, ...) the shared-memory index WAL relies on does not work
+across hosts, so the rollback journal is used instead and writers are
+serialized through a lock file next to the database.
+"""
+
+import os
+import random
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Mapping, Optional, TypeVar
+from urllib.parse import quote
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - windows
+    fcntl = None  # type: ignore[assignment]
+
+T = TypeVar("T")
+
+# 这些文件系统上多台主机无法共享 WAL 的 -shm 内存映射文件
+WAL_UNSAFE_FSTYPES = {
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "lustre", "gpfs", "beegfs",
+    "ceph", "fuse.sshfs", "fuse.glusterfs", "fuse.cephfs", "9p",
+}
+
+def filesystem_type(path: str) -> Optional[str]:
+    """Return the filesystem type of the mount containing path.
+
+    Args:
+        path (str): Any path, it does not need to exist
+
+    Returns:
+        str: fstype from /proc/mounts, None when it cannot be determined
+    """
+    path = os.path.realpath(os.path.expanduser(path))
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    try:
+        with open("/proc/mounts", "r", encoding="utf-8") as f:
+            mounts = [line.split()[1:3] for line in f if len(line.split()) >= 3]
+    except OSError:
+        return None
+
+    best, fstype = "", None
+    for mountpoint, mtype in mounts:
+        mountpoint = mountpoint.replace("\\040", " ")
+        if (path == mountpoint or path.startswith(mountpoint.rstrip("/") + "/")) and len(mountpoint) >= len(best):
+            best, fstype = mountpoint, mtype
+    return fstype
+
+def wal_is_safe(path: str) -> bool:
+    """Return False if path lives on a filesystem where WAL must not be used."""
+    return filesystem_type(path) not in WAL_UNSAFE_FSTYPES
+
+def is_locked_error(e: Exception) -> bool:
+    """Return True for SQLite errors caused by another writer holding the lock."""
+    msg = str(e).lower()
+    return isinstance(e, sqlite3.OperationalError) and ("locked" in msg or "busy" in msg)
+
+def retry_locked(func: Callable[[], T], retries: int = 5, base_delay: float = 0.2) -> T:
+    """Call func, retrying with jittered exponential backoff while the database is locked.
+
+    Args:
+        func: Callable running one complete write transaction
+        retries (int): Number of retries after the first attempt
+        base_delay (float): Delay in seconds before the first retry
+
+    Returns:
+        The return value of func
+
+    Raises:
+        sqlite3.OperationalError: If the database is still locked after all retries
+    """
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except sqlite3.OperationalError as e:
+            if not is_locked_error(e) or attempt >= retries:
+                raise
+            time.sleep(base_delay * (2 ** attempt) * random.uniform(0.5, 1.5))
+            attempt += 1
+
+class _ProcessLock:
+    """The lock file of one path, shared by every WriterLock of this process.
+
+    POSIX record locks belong to the process, not to a file descriptor: a
+    second lockf() on the same file succeeds at once, and closing any
+    descriptor of the file drops the lock. Threads of the process are
+    therefore serialized by an RLock, and the file is opened and locked by
+    the first holder and unlocked and closed by the last one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rlock = threading.RLock()
+        self.fd: Optional[int] = None
+        self.holders = 0
+
+    def acquire(self) -> None:
+        self.rlock.acquire()
+        try:
+            if self.holders == 0:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+                try:
+                    # 所有用户的 cron 都要能加锁, 创建者负责放开权限
+                    os.fchmod(fd, 0o666)
+                except OSError:
+                    pass
+                try:
+                    fcntl.lockf(fd, fcntl.LOCK_EX)
+                except BaseException:
+                    os.close(fd)
+                    raise
+                self.fd = fd
+            self.holders += 1
+        except BaseException:
+            self.rlock.release()
+            raise
+
+    def release(self) -> None:
+        try:
+            self.holders -= 1
+            if self.holders == 0:
+                fd, self.fd = self.fd, None
+                assert fd is not None
+                try:
+                    fcntl.lockf(fd, fcntl.LOCK_UN)
+                finally:
+                    os.close(fd)
+        finally:
+            self.rlock.release()
+
+# 每个锁文件在进程内只有一个 _ProcessLock
+_process_locks: Dict[str, _ProcessLock] = {}
+_process_locks_guard = threading.Lock()
+
+def _process_lock(path: str) -> _ProcessLock:
+    key = os.path.realpath(path)
+    with _process_locks_guard:
+        lock = _process_locks.get(key)
+        if lock is None:
+            lock = _process_locks[key] = _ProcessLock(key)
+        return lock
+
+class WriterLock:
+    """Exclusive, re-entrant lock file serializing writers across processes and hosts.
+
+    Uses POSIX record locks (fcntl.lockf), which NFS forwards to the server's
+    lock manager. All WriterLocks of one path in a process share a single
+    lock, so separate connections of the same process (the sync and its
+    lease renewal thread, metrics, the daemon) also exclude each other.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = _process_lock(path)
+
+    def __enter__(self) -> "WriterLock":
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._lock.release()
+
+@dataclass
+class ConnectionTuning:
+    """SQLite connection settings, read from the `sqlite` section of evapro.yaml.
+
+    Attributes:
+        journal_mode (str): Journal mode to use where WAL is safe [WAL|DELETE|TRUNCATE]
+        busy_timeout (int): Milliseconds to wait for a lock before failing
+        synchronous (str): PRAGMA synchronous level [OFF|NORMAL|FULL]
+        cache_size (int): PRAGMA cache_size, negative values are KiB
+        lock_file (str): Serialize writers through <db>.lock [auto|always|never],
+            auto uses it only where WAL is unsafe
+        write_retries (int): Retries of a locked write transaction
+        retry_base_delay (float): Seconds before the first retry
+    """
+    journal_mode: str = "WAL"
+    busy_timeout: int = 30000
+    synchronous: str = "NORMAL"
+    cache_size: int = -16000
+    lock_file: str = "auto"
+    write_retries: int = 5
+    retry_base_delay: float = 0.2
+
+    @classmethod
+    def from_conf(cls, conf: Mapping[str, Any]) -> "ConnectionTuning":
+        """Build the settings from the loaded evapro.yaml data."""
+        section = conf.get("sqlite") or {}
+        return cls(**{k: v for k, v in section.items() if k in cls.__dataclass_fields__})
+
+    def apply(self, conn: sqlite3.Connection, dbpath: str) -> bool:
+        """Apply the pragmas to a new connection.
+
+        Args:
+            conn (sqlite3.Connection): Connection to tune
+            dbpath (str): Database path, used to detect the filesystem
+
+        Returns:
+            bool: True if writers must hold the lock file
+        """
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        conn.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+
+        journal_mode = self.journal_mode.upper()
+        if journal_mode not in ("WAL", "DELETE", "TRUNCATE", "PERSIST"):
+            raise ValueError(f"Invalid sqlite journal_mode: {self.journal_mode}")
+        if self.synchronous.upper() not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+            raise ValueError(f"Invalid sqlite synchronous: {self.synchronous}")
+        wal_safe = wal_is_safe(dbpath)
+        if journal_mode == "WAL" and not wal_safe:
+            journal_mode = "DELETE"
+        try:
+            conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+        except sqlite3.OperationalError as e:
+            # 切换 journal 模式需要独占数据库, 其他进程正在使用时保持原模式
+            if not is_locked_error(e):
+                raise
+        conn.execute(f"PRAGMA synchronous = {self.synchronous.upper()}")
+
+        if self.lock_file == "always":
+            return fcntl is not None
+        if self.lock_file == "never":
+            return False
+        return fcntl is not None and not wal_safe
+
+def connect_readonly(dbpath: str, tuning: Optional[ConnectionTuning] = None) -> sqlite3.Connection:
+    """Open the database for reading only.
+
+    The connection never takes the write lock or changes the journal mode,
+    and query_only guards against accidental writes. Readers of a WAL
+    database do not block writers.
+
+    Raises:
+        sqlite3.OperationalError: If the database file cannot be opened
+    """
+    tuning = tuning or ConnectionTuning()
+    path = os.path.abspath(os.path.expanduser(dbpath))
+    conn = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True, check_same_thread=False)
+    conn.execute(f"PRAGMA busy_timeout = {int(tuning.busy_timeout)}")
+    conn.execute(f"PRAGMA cache_size = {int(tuning.cache_size)}")
+    conn.execute("PRAGMA query_only = 1")
+    return conn
@@ -1,8 +1,62 @@
 import os
+import time
 import sqlite3
 import getpass
+import contextlib
 from dataclasses import dataclass, field
-from pandas import read_sql, DataFrame
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, TypeVar
+
+from .connection import ConnectionTuning, WriterLock, retry_locked
+from evapro import metrics
+
+T = TypeVar("T")
+
+# insert order of all_ana_projects records used by the bulk insert path
+ALLPRO_COLUMNS = ("user", "proid", "create_date", "info_date", "ptype", "isautoflow", "workdir")
+
+# columns update_many() may change, per table; proid and id are never updated
+UPDATABLE_COLUMNS = {
+    "projects": ("user", "ptype", "workdir", "dirstat", "info", "data", "autoconf", "conf_stde",
+                 "worksh", "pid", "p_args", "stime", "etime", "pstat", "run_num"),
+    "all_ana_projects": ("user", "create_date", "info_date", "ptype", "isautoflow", "workdir", "isadd2annoeva"),
+}
+
+# sqlite allows at most 999 bound parameters per statement on older builds
+SQLITE_MAX_VARS = 900
+
+CRT_PROJECTS_SQL = """
+create table if not exists projects(
+id integer primary key autoincrement unique not null,
+user text,
+proid text unique not null,
+ptype text,
+workdir text,
+dirstat text,
+info text,
+data text,
+autoconf text,
+conf_stde text,
+worksh text,
+pid integer,
+p_args text,
+stime text,
+etime text,
+pstat text,
+run_num integer
+);"""
+
+CRT_ALLPRO_SQL = """
+create table if not exists all_ana_projects(
+id integer primary key autoincrement unique not null,
+user text,
+proid text unique not null,
+create_date text,
+info_date text,
+ptype text,
+isautoflow text,
+workdir text,
+isadd2annoeva text
+);"""
 
 @dataclass
 class SQLiteDB:
@@ -11,13 +65,16 @@ class SQLiteDB:
     
     Attributes:
         dbpath (str): Path to the SQLite database file
+        tuning (ConnectionTuning): Journal mode, busy timeout and write retry settings
         conn (sqlite3.Connection): Database connection object
         cur (sqlite3.Cursor): Database cursor object
     """
 
     dbpath: str
+    tuning: ConnectionTuning = field(default_factory=ConnectionTuning)
     conn: sqlite3.Connection = field(init=False)
     cur: sqlite3.Cursor = field(init=False)
+    writer_lock: Optional[WriterLock] = field(init=False, default=None)
 
     def __post_init__(self):
         # 确保数据库目录存在
@@ -30,9 +87,42 @@ class SQLiteDB:
             check_same_thread=False,
             detect_types=sqlite3.PARSE_DECLTYPES
         )
-        #self.conn.execute('PRAGMA journal_mode=WAL')  # 启用写入日志模式
+        # WAL 不安全的文件系统(NFS等)上改用回滚日志, 并通过锁文件排队写入
+        if self.tuning.apply(self.conn, self.dbpath):
+            self.writer_lock = WriterLock(f"{os.path.expanduser(self.dbpath)}.lock")
         self.cur = self.conn.cursor()
 
+    def transaction(self, func: Callable[[sqlite3.Cursor], T]) -> T:
+        """Run func(cur) as one write transaction.
+
+        The transaction starts with BEGIN IMMEDIATE while holding the writer
+        lock file (when one is used), and is retried with jittered backoff
+        while another process holds the database lock.
+
+        Args:
+            func: Callable doing the writes with the given cursor
+
+        Returns:
+            The return value of func
+        """
+        def attempt():
+            with self.writer_lock or contextlib.nullcontext():
+                try:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                    result = func(self.cur)
+                    self.conn.commit()
+                    return result
+                except BaseException:
+                    self.conn.rollback()
+                    raise
+
+        # 包含等待写锁的时间
+        start = time.perf_counter()
+        try:
+            return retry_locked(attempt, self.tuning.write_retries, self.tuning.retry_base_delay)
+        finally:
+            metrics.observe('sqlite.transaction', time.perf_counter() - start)
+
     def crt_tb_sql(self) -> None:
         """Create the projects table in the database if it doesn't exist.
 
@@ -56,30 +146,8 @@ class SQLiteDB:
         pstat: project status, work.sh execute status [run|done|err|-], default: -
         run_num: project re-run number
         """
-        crt_tb_sql_c = """
-        create table if not exists projects(
-        id integer primary key autoincrement unique not null,
-        user text,
-        proid text unique not null,
-        ptype text,
-        workdir text,
-        dirstat text,
-        info text,
-        data text,
-        autoconf text,
-        conf_stde text,
-        worksh text,
-        pid integer,
-        p_args text,
-        stime text,
-        etime text,
-        pstat text,
-        run_num integer
-        );"""
-
         try:
-            self.cur.execute(crt_tb_sql_c)
-            self.conn.commit()
+            self.transaction(lambda cur: cur.execute(CRT_PROJECTS_SQL))
         except sqlite3.Error as e:
             print(f"创建 projects 数据库表失败: {str(e)}")
             raise
@@ -95,28 +163,27 @@ class SQLiteDB:
         ptype: project product type
         isautoflow: is flow line product type, [Y|N]
         workdir: workdir path
-        isadd2annoeva: is add to annoeva monitor, [Y|N]
-        """
-        crt_allpro_tb_sql_c = """
-        create table if not exists all_ana_projects(
-        id integer primary key autoincrement unique not null,
-        user text,
-        proid text unique not null,
-        create_date text,
-        info_date text,
-        ptype text,
-        isautoflow text,
-        workdir text,
-        isadd2annoeva text
-        );"""
-
+        isadd2annoeva: is add to annoeva monitor, [Y|N|P], P while a dispatcher registers it
+        """
         try:
-            self.cur.execute(crt_allpro_tb_sql_c)
-            self.conn.commit()
+            self.transaction(lambda cur: cur.execute(CRT_ALLPRO_SQL))
         except sqlite3.Error as e:
             print(f"创建 all_ana_projects 数据库表失败: {str(e)}")
             raise
 
+    def migrate(self, target: Optional[int] = None) -> List[int]:
+        """Upgrade the database schema in place, see evapro.db.migrations.
+
+        Args:
+            target (int): Schema version to stop at, default the latest
+
+        Returns:
+            List[int]: Versions applied by this call
+        """
+        from .migrations import migrate
+        with self.writer_lock or contextlib.nullcontext():
+            return retry_locked(lambda: migrate(self.conn, target), self.tuning.write_retries, self.tuning.retry_base_delay)
+
     def insert_tb_sql(self, user: str, proid: str, ptype: str) -> None:
         """Insert a new project record into the database.
         
@@ -126,8 +193,7 @@ class SQLiteDB:
             ptype (str): Project type
         """
         insert_sql = "insert into projects (user, proid, ptype, workdir, dirstat, info, data, autoconf, pstat, run_num) values (?,?,?,?,?,?,?,?,?,?)"
-        self.cur.execute(insert_sql, (user, proid, ptype, '', 'N', 'N', 'N', 'N', '-', 0))
-        self.conn.commit()
+        self.transaction(lambda cur: cur.execute(insert_sql, (user, proid, ptype, '', 'N', 'N', 'N', 'N', '-', 0)))
 
     def insert_allpro_tb_sql(self, user: str, proid: str, create_date: str, info_date: str, ptype: str, isautoflow: str, workdir: str) -> None:
         """Insert a new all_ana_projects record into the database.
@@ -143,8 +209,222 @@ class SQLiteDB:
             
         """
         insert_sql = "insert into all_ana_projects (user, proid, create_date, info_date, ptype, isautoflow, workdir, isadd2annoeva) values (?,?,?,?,?,?,?,?)"
-        self.cur.execute(insert_sql, (user, proid, create_date, info_date, ptype, isautoflow, workdir, 'N'))
-        self.conn.commit()
+        self.transaction(lambda cur: cur.execute(insert_sql, (user, proid, create_date, info_date, ptype, isautoflow, workdir, 'N')))
+
+    def insert_allpro_many(self, records: Iterable[Any], on_conflict: str = "ignore") -> Dict[str, int]:
+        """Insert many all_ana_projects records in a single transaction.
+
+        Args:
+            records: DataFrame, or iterable of dicts/tuples, with the columns
+                user, proid, create_date, info_date, ptype, isautoflow, workdir
+            on_conflict (str): What to do when proid already exists.
+                "ignore" keeps the stored row, "update" refreshes the LIMS fields
+                of projects which have not been added to annoeva yet
+
+        Returns:
+            Dict[str, int]: Number of inserted, updated and skipped records
+
+        Raises:
+            ValueError: If on_conflict is not "ignore" or "update"
+        """
+        if on_conflict not in ("ignore", "update"):
+            raise ValueError(f"Invalid on_conflict: {on_conflict}")
+
+        if hasattr(records, "to_dict"):
+            # pandas DataFrame
+            records = records.to_dict("records")
+        rows = [
+            tuple(rec.get(col) for col in ALLPRO_COLUMNS) if isinstance(rec, dict) else tuple(rec)
+            for rec in records
+        ]
+        counts = {"inserted": 0, "updated": 0, "skipped": 0}
+        if not rows:
+            return counts
+        total = len(rows)
+        if on_conflict == "update":
+            # 同一批中重复的 proid 只写最后一条, 否则后一条会把同一批新增的项目算作更新
+            rows = list({rec[1]: rec for rec in rows}.values())
+
+        insert_sql = """
+        insert into all_ana_projects (user, proid, create_date, info_date, ptype, isautoflow, workdir, isadd2annoeva)
+        values (?,?,?,?,?,?,?,'N')
+        """
+        if on_conflict == "ignore":
+            insert_sql += "on conflict(proid) do nothing"
+        else:
+            # 已加入 annoeva 的项目不再改动; 空 workdir/user 不覆盖已有值
+            insert_sql += """
+        on conflict(proid) do update set
+            user = coalesce(nullif(excluded.user, ''), all_ana_projects.user),
+            create_date = excluded.create_date,
+            info_date = excluded.info_date,
+            ptype = excluded.ptype,
+            isautoflow = excluded.isautoflow,
+            workdir = case when excluded.workdir != '' then excluded.workdir else all_ana_projects.workdir end
+        where all_ana_projects.isadd2annoeva = 'N' and (
+            coalesce(nullif(excluded.user, ''), all_ana_projects.user) is not all_ana_projects.user
+            or excluded.create_date is not all_ana_projects.create_date
+            or excluded.info_date is not all_ana_projects.info_date
+            or excluded.ptype is not all_ana_projects.ptype
+            or excluded.isautoflow is not all_ana_projects.isautoflow
+            or (excluded.workdir != '' and excluded.workdir is not all_ana_projects.workdir)
+        )"""
+
+        def write(cur):
+            new_proids = set(rec[1] for rec in rows)
+            if on_conflict == "update":
+                new_proids -= self._existing_proids(new_proids)
+            before = self.conn.total_changes
+            cur.executemany(insert_sql, rows)
+            return self.conn.total_changes - before, len(new_proids)
+
+        try:
+            changes, new = self.transaction(write)
+        except sqlite3.Error as e:
+            print(f"批量写入 all_ana_projects 失败: {str(e)}")
+            raise
+
+        metrics.count('sqlite.rows_upserted', len(rows))
+        counts["inserted"] = changes if on_conflict == "ignore" else new
+        counts["updated"] = changes - counts["inserted"]
+        counts["skipped"] = total - changes
+        return counts
+
+    def _existing_proids(self, proids: Iterable[str]) -> set:
+        """Return the subset of proids already stored in all_ana_projects."""
+        proids = list(proids)
+        existing: set = set()
+        for i in range(0, len(proids), SQLITE_MAX_VARS):
+            chunk = proids[i:i + SQLITE_MAX_VARS]
+            query = f"SELECT proid FROM all_ana_projects WHERE proid IN ({','.join('?' * len(chunk))})"
+            existing.update(row[0] for row in self.cur.execute(query, chunk))
+        return existing
+
+    def update_many(self, updates: Mapping[str, Mapping[str, Any]], table: str = "all_ana_projects") -> int:
+        """Update many project records in a single transaction.
+
+        Column names are checked against UPDATABLE_COLUMNS and all values are
+        bound as parameters. Records changing the same set of columns share
+        one executemany call.
+
+        Args:
+            updates: Mapping of proid -> {column: value}
+            table (str): projects or all_ana_projects
+
+        Returns:
+            int: Number of rows changed
+
+        Raises:
+            ValueError: If table or a column name is not allowed
+        """
+        if table not in UPDATABLE_COLUMNS:
+            raise ValueError(f"Invalid table name: {table}")
+
+        groups: Dict[tuple, list] = {}
+        for proid, values in updates.items():
+            if not values:
+                continue
+            columns = tuple(sorted(values))
+            for col in columns:
+                if col not in UPDATABLE_COLUMNS[table]:
+                    raise ValueError(f"Invalid column name: {col}")
+            groups.setdefault(columns, []).append(tuple(values[col] for col in columns) + (proid,))
+        if not groups:
+            return 0
+
+        def write(cur):
+            before = self.conn.total_changes
+            for columns, rows in groups.items():
+                assignments = ", ".join(f"{col} = ?" for col in columns)
+                cur.executemany(f"update {table} set {assignments} where proid = ?", rows)
+            return self.conn.total_changes - before
+
+        try:
+            changed = self.transaction(write)
+        except sqlite3.Error as e:
+            print(f"批量更新 {table} 失败: {str(e)}")
+            raise
+        metrics.count('sqlite.rows_updated', changed)
+        return changed
+
+    def claim_projects(self, proids: Iterable[str]) -> List[str]:
+        """Claim pending all_ana_projects records before registering them to annoeva.
+
+        A record is claimed (isadd2annoeva 'N' -> 'P') only while it is still
+        pending, so dispatchers running at the same time (evapro cron of
+        several users, cron --all-users, daemons on several nodes) never
+        register the same project twice. Claimed records must be passed to
+        finish_claims() afterwards.
+
+        Args:
+            proids: Project IDs to claim
+
+        Returns:
+            List[str]: Project IDs claimed by this call, in input order
+        """
+        proids = list(proids)
+        if not proids:
+            return []
+        now = time.time()
+
+        def write(cur):
+            claimed = []
+            for proid in proids:
+                cur.execute(
+                    "update all_ana_projects set isadd2annoeva = 'P', claimed_at = ? "
+                    "where proid = ? and isadd2annoeva = 'N'", (now, proid)
+                )
+                if cur.rowcount == 1:
+                    claimed.append(proid)
+            return claimed
+
+        claimed = self.transaction(write)
+        metrics.count('sqlite.rows_claimed', len(claimed))
+        return claimed
+
+    def finish_claims(self, added: Iterable[str], released: Iterable[str] = ()) -> int:
+        """Mark claimed records as added ('Y'), or give them back ('N') for the next run.
+
+        Args:
+            added: Project IDs registered to annoeva
+            released: Claimed project IDs which were not registered
+
+        Returns:
+            int: Number of rows changed
+        """
+        added_rows = [(proid,) for proid in added]
+        released_rows = [(proid,) for proid in released]
+        if not added_rows and not released_rows:
+            return 0
+
+        def write(cur):
+            before = self.conn.total_changes
+            cur.executemany("update all_ana_projects set isadd2annoeva = 'Y', claimed_at = null where proid = ?", added_rows)
+            # 认领已过期并被其他进程重新认领的项目不再改动
+            cur.executemany(
+                "update all_ana_projects set isadd2annoeva = 'N', claimed_at = null "
+                "where proid = ? and isadd2annoeva = 'P'", released_rows
+            )
+            return self.conn.total_changes - before
+
+        try:
+            changed = self.transaction(write)
+        except sqlite3.Error as e:
+            print(f"更新 all_ana_projects 添加状态失败: {str(e)}")
+            raise
+        metrics.count('sqlite.rows_updated', changed)
+        return changed
+
+    def release_stale_claims(self, ttl: float) -> int:
+        """Give back claims older than ttl seconds, left behind by a dispatcher that died.
+
+        Returns:
+            int: Number of released records
+        """
+        return self.transaction(lambda cur: cur.execute(
+            "update all_ana_projects set isadd2annoeva = 'N', claimed_at = null "
+            "where isadd2annoeva = 'P' and claimed_at < ?", (time.time() - ttl,)
+        ).rowcount)
 
     def update_tb_value_sql(self, proid: str, name: str, value: str, table: str="projects") -> None:
         """Update a specific field value for a project record.
@@ -154,34 +434,62 @@ class SQLiteDB:
             name (str): Field name to update
             value (str): New value to set
             table (str): Table name (default: "projects")
+
+        Raises:
+            ValueError: If table or name is not an updatable column
         """
-        update_sql = f"update '{table}' set '{name}'='{value}' where proid='{proid}'"
-        self.cur.execute(update_sql)
-        self.conn.commit()
+        self.update_many({proid: {name: value}}, table=table)
+
+    def iter_rows(self, query: str, params: Sequence[Any] = (), arraysize: int = 500) -> Iterator[sqlite3.Row]:
+        """Run a query and yield its rows one by one.
+
+        Rows are fetched arraysize at a time on a dedicated cursor, so large
+        results are never held in memory at once.
 
-    def query_record(self, key: str, value: str) -> DataFrame:
+        Args:
+            query (str): SQL query
+            params: Bound query parameters
+            arraysize (int): Number of rows fetched per round trip
+
+        Yields:
+            sqlite3.Row: Row supporting access by column name and index
+        """
+        cur = self.conn.cursor()
+        cur.row_factory = sqlite3.Row
+        try:
+            cur.execute(query, params)
+            while True:
+                rows = cur.fetchmany(arraysize)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cur.close()
+
+    def query_record(self, key: str, value: str, table: str = "projects") -> List[sqlite3.Row]:
         """Query project records matching the given key-value pair.
         
         Args:
             key (str): Column name to query
             value (str): Value to match
+            table (str): projects or all_ana_projects
             
         Returns:
-            DataFrame: Pandas DataFrame containing matching records
+            List[sqlite3.Row]: Matching records
             
         Raises:
-            ValueError: If key is not a valid column name
+            ValueError: If table or key is not a valid name
         """
-        valid_columns = ['id', 'user', 'proid', 'ptype', 'workdir', 'dirstat', 
-                        'info', 'data', 'autoconf', 'conf_stde', 'worksh', 
-                        'pid', 'p_args', 'stime', 'etime', 'pstat', 'run_num']
-                        
-        if key not in valid_columns:
+        from .query import TABLE_COLUMNS
+
+        if table not in TABLE_COLUMNS:
+            raise ValueError(f"Invalid table: {table}")
+        if key not in TABLE_COLUMNS[table]:
             raise ValueError(f"Invalid column name: {key}")
-            
-        query = "SELECT * FROM projects WHERE ? = ?"
-        df = read_sql(query, con=self.conn, params=(key, value))
-        return df
+
+        # 列名不能作为参数绑定, 校验后拼接到语句中
+        query = f"SELECT * FROM {table} WHERE {key} = ?"
+        return list(self.iter_rows(query, (value,)))
     
     def delete_project(self, projectid: str) -> None:
         """Delete a project record and stop any running processes.
@@ -195,16 +503,13 @@ class SQLiteDB:
         try:
             username = getpass.getuser()
             query = "SELECT * FROM projects WHERE proid = ? AND user = ?"
-            df = read_sql(query, con=self.conn, params=(projectid, username))
-            if df.shape[0] == 0:
+            if next(self.iter_rows(query, (projectid, username)), None) is None:
                 print(f"project {projectid} not found or not owned by {username}")
                 return
            
-            self.cur.execute("DELETE FROM projects WHERE proid = ?", (projectid,))            
-            self.conn.commit()
+            self.transaction(lambda cur: cur.execute("DELETE FROM projects WHERE proid = ?", (projectid,)))
         except sqlite3.Error as e:
             print(f"Database error: {e}")
-            self.conn.rollback()
             raise
 
     def close_db(self) -> None:
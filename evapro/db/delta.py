@@ -0,0 +1,146 @@
+"""
+Delta planning for the LIMS -> all_ana_projects sync.
+
+The projects already in all_ana_projects are loaded once per sync as
+proid -> hash of the fields LIMS can change. Every chunk of transformed
+bills is then split into new, changed and unchanged rows with index
+lookups and hash comparisons, so only the delta is written and projects
+already added to annoeva are not looked up in LIMS again.
+"""
+
+import sqlite3
+from dataclasses import dataclass, field
+
+from pandas import DataFrame, Index, Series, concat
+from pandas.util import hash_pandas_object
+
+from .database import ALLPRO_COLUMNS
+
+# 同步时可能被 lims 修改的字段, 与 insert_allpro_many(on_conflict="update") 更新的字段一致
+MUTABLE_COLUMNS = ('user', 'create_date', 'info_date', 'ptype', 'isautoflow', 'workdir')
+
+def row_hash(records: DataFrame) -> Series:
+    """uint64 hash of the mutable fields of every row."""
+    if records.empty:
+        return Series([], dtype='uint64')
+    return hash_pandas_object(records[list(MUTABLE_COLUMNS)], index=False)
+
+def _concat(a: DataFrame, b: DataFrame) -> DataFrame:
+    if a.empty:
+        return b.reset_index(drop=True)
+    if b.empty:
+        return a
+    return concat([a, b], ignore_index=True)
+
+@dataclass
+class SyncPlan:
+    """What one sync would write to all_ana_projects.
+
+    Attributes:
+        new (DataFrame): Records of projects not in all_ana_projects yet
+        changed (DataFrame): Records of stored projects whose fields differ
+        unchanged (int): Bills matching the stored project
+        locked (int): Bills of projects already added to annoeva, never updated
+        duplicates (int): Bills repeating a proid of the same chunk
+    """
+    new: DataFrame = field(default_factory=lambda: DataFrame(columns=list(ALLPRO_COLUMNS)))
+    changed: DataFrame = field(default_factory=lambda: DataFrame(columns=list(ALLPRO_COLUMNS)))
+    unchanged: int = 0
+    locked: int = 0
+    duplicates: int = 0
+
+    @property
+    def writes(self) -> DataFrame:
+        """Records to upsert, new ones first."""
+        return _concat(self.new, self.changed)
+
+    @property
+    def skipped(self) -> int:
+        return self.unchanged + self.locked + self.duplicates
+
+    def merge(self, other: "SyncPlan") -> "SyncPlan":
+        """Combine the plans of two chunks."""
+        return SyncPlan(
+            _concat(self.new, other.new),
+            _concat(self.changed, other.changed),
+            self.unchanged + other.unchanged,
+            self.locked + other.locked,
+            self.duplicates + other.duplicates,
+        )
+
+class KnownProjects:
+    """proid -> hash of the stored mutable fields, held in memory during a sync.
+
+    Attributes:
+        table (DataFrame): Indexed by proid, with user, workdir, hash and
+            locked (already added to annoeva) columns
+    """
+
+    def __init__(self, table: DataFrame):
+        self.table = table
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection) -> "KnownProjects":
+        """Read all stored projects with a single query, conn may be read-only."""
+        rows = conn.execute(
+            f"SELECT proid, {', '.join(MUTABLE_COLUMNS)}, isadd2annoeva FROM all_ana_projects"
+        ).fetchall()
+        stored = DataFrame(rows, columns=['proid', *MUTABLE_COLUMNS, 'isadd2annoeva'], dtype=object)
+        return cls(cls._entries(stored, stored['isadd2annoeva'] == 'Y'))
+
+    @staticmethod
+    def _entries(records: DataFrame, locked: Series) -> DataFrame:
+        return DataFrame({
+            'user': records['user'].to_numpy(dtype=object),
+            'workdir': records['workdir'].to_numpy(dtype=object),
+            'hash': row_hash(records).to_numpy(),
+            'locked': locked.to_numpy(dtype=bool),
+        }, index=Index(records['proid'].to_numpy(dtype=object), name='proid'))
+
+    def __len__(self) -> int:
+        return self.table.shape[0]
+
+    def is_locked(self, proids) -> Series:
+        """Boolean mask of the proids already added to annoeva, in the order of proids."""
+        locked = self.table.index[self.table['locked'].to_numpy(dtype=bool)]
+        return Series(Index(proids).isin(locked), dtype=bool)
+
+    def plan(self, records: DataFrame) -> SyncPlan:
+        """Split transformed records into new, changed and unchanged ones.
+
+        A stored project counts as unchanged when the record would not
+        change it: like the upsert, an empty user or workdir keeps the
+        stored value.
+        """
+        unique = records.drop_duplicates('proid', keep='last')
+        duplicates = records.shape[0] - unique.shape[0]
+
+        pos = self.table.index.get_indexer(Index(unique['proid']))
+        known = pos >= 0
+        locked = known.copy()
+        locked[known] = self.table['locked'].to_numpy()[pos[known]]
+        new = unique[~known]
+
+        stored = unique[known & ~locked].copy()
+        stored_pos = pos[known & ~locked]
+        # Series.where 的 other 按位置对应
+        stored['user'] = stored['user'].where(stored['user'].notna() & (stored['user'] != ''),
+                                              self.table['user'].to_numpy()[stored_pos])
+        stored['workdir'] = stored['workdir'].where(stored['workdir'] != '', self.table['workdir'].to_numpy()[stored_pos])
+        same = row_hash(stored).to_numpy() == self.table['hash'].to_numpy()[stored_pos]
+
+        return SyncPlan(
+            new=new.reset_index(drop=True),
+            changed=stored[~same].reset_index(drop=True),
+            unchanged=int(same.sum()),
+            locked=int(locked.sum()),
+            duplicates=duplicates,
+        )
+
+    def remember(self, plan: SyncPlan) -> None:
+        """Record the written delta so that later chunks compare against it."""
+        writes = plan.writes
+        if writes.empty:
+            return
+        entries = self._entries(writes, Series(False, index=writes.index))
+        self.table = concat([self.table[~self.table.index.isin(entries.index)], entries])
@@ -0,0 +1,285 @@
+"""
+Snapshot export of syncproject.db to NDJSON, CSV or Parquet files.
+
+Dashboards and reports read the exported files instead of syncproject.db,
+so they never contend with lims2evapro and cron for its locks. All tables
+of one export come from the same consistent snapshot: a single read
+transaction where the database uses WAL (readers do not block writers
+there), otherwise a copy made with the SQLite backup API, which holds the
+read lock only for the time of the copy.
+
+Incremental exports continue from the watermarks (highest id, and highest
+info_date for all_ana_projects) of the previous export, kept in a sidecar
+JSON file in the output directory. Incremental files contain the rows
+inserted since then, plus all_ana_projects rows whose info_date moved
+forward; other in-place updates (e.g. isadd2annoeva, pstat) are only
+picked up by a full export.
+"""
+
+import contextlib
+import csv
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .connection import ConnectionTuning, connect_readonly
+from .query import TABLE_COLUMNS
+
+EXPORT_FORMATS = ("ndjson", "csv", "parquet")
+EXPORT_TABLES = ("all_ana_projects", "projects")
+SNAPSHOT_METHODS = ("auto", "transaction", "backup")
+WATERMARK_FILE = "evapro_export.watermark.json"
+
+# 其余列都是 text
+INTEGER_COLUMNS = {"id", "pid", "run_num"}
+
+@dataclass
+class Watermark:
+    """Position reached by the previous export of a table.
+
+    Attributes:
+        id (int): Highest id in the snapshot
+        info_date (str): Highest info_date in the snapshot, all_ana_projects only
+        exported_at (str): Time of the export
+        rows (int): Rows written by the export
+        path (str): File written by the export, None if there was nothing new
+    """
+    id: int = 0
+    info_date: Optional[str] = None
+    exported_at: Optional[str] = None
+    rows: int = 0
+    path: Optional[str] = None
+
+def load_watermarks(outdir: str) -> Dict[str, Watermark]:
+    """Read the watermarks of the previous export into outdir, empty if there was none."""
+    path = os.path.join(outdir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {table: Watermark(**{k: v for k, v in mark.items() if k in Watermark.__dataclass_fields__})
+            for table, mark in data.items()}
+
+def save_watermarks(outdir: str, marks: Dict[str, Watermark]) -> None:
+    """Replace the sidecar watermark file atomically."""
+    path = os.path.join(outdir, WATERMARK_FILE)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({table: asdict(mark) for table, mark in marks.items()}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def journal_mode(conn: sqlite3.Connection) -> str:
+    """Return the current journal mode of the database, in lower case."""
+    return conn.execute("PRAGMA journal_mode").fetchone()[0].lower()
+
+@contextlib.contextmanager
+def snapshot(dbpath: str, tuning: Optional[ConnectionTuning] = None, method: str = "auto") -> Iterator[sqlite3.Connection]:
+    """Yield a read-only connection on a consistent snapshot of the database.
+
+    Args:
+        dbpath (str): Path to syncproject.db
+        tuning (ConnectionTuning): Busy timeout and cache size of the connection
+        method (str): transaction (one read transaction), backup (a private copy
+            made with the backup API), or auto: transaction for WAL databases,
+            backup otherwise, where a long reader would block writers
+
+    Raises:
+        ValueError: If method is invalid
+        sqlite3.OperationalError: If the database cannot be opened
+    """
+    if method not in SNAPSHOT_METHODS:
+        raise ValueError(f"Invalid snapshot method: {method}")
+    conn = connect_readonly(dbpath, tuning)
+    try:
+        if method == "auto":
+            method = "transaction" if journal_mode(conn) == "wal" else "backup"
+        if method == "transaction":
+            conn.execute("BEGIN")
+            # 第一次读取时确定快照, 之后各表都从这个快照读取
+            conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+            try:
+                yield conn
+            finally:
+                conn.rollback()
+            return
+
+        tmpdir = tempfile.mkdtemp(prefix="evapro-export-")
+        copy = sqlite3.connect(os.path.join(tmpdir, "snapshot.db"), check_same_thread=False)
+        try:
+            # 一步复制完, 只在复制期间持有读锁
+            conn.backup(copy)
+            copy.execute("PRAGMA query_only = 1")
+            yield copy
+        finally:
+            copy.close()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    finally:
+        conn.close()
+
+def _iter_chunks(conn: sqlite3.Connection, table: str, columns: Sequence[str], mark: Optional[Watermark],
+                 chunk_size: int) -> Iterator[List[Tuple[Any, ...]]]:
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    params: List[Any] = []
+    if mark is not None:
+        query += " WHERE id > ?"
+        params.append(mark.id)
+        if table == "all_ana_projects" and mark.info_date:
+            query += " OR info_date > ?"
+            params.append(mark.info_date)
+    cur = conn.execute(query + " ORDER BY id", params)
+    try:
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cur.close()
+
+def _write_ndjson(path: str, columns: Sequence[str], chunks: Iterator[List[Tuple[Any, ...]]]) -> int:
+    n = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for rows in chunks:
+            f.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+            n += len(rows)
+    return n
+
+def _write_csv(path: str, columns: Sequence[str], chunks: Iterator[List[Tuple[Any, ...]]]) -> int:
+    n = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for rows in chunks:
+            writer.writerows(rows)
+            n += len(rows)
+    return n
+
+def _write_parquet(path: str, columns: Sequence[str], chunks: Iterator[List[Tuple[Any, ...]]]) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(c, pa.int64() if c in INTEGER_COLUMNS else pa.string()) for c in columns])
+    n = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in chunks:
+            # 每批写一个 row group, 内存占用与 chunk_size 成正比
+            arrays = [pa.array(list(values), type=schema.field(i).type) for i, values in enumerate(zip(*rows))]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            n += len(rows)
+    return n
+
+def _chain(first: List[Tuple[Any, ...]], rest: Iterator[List[Tuple[Any, ...]]]) -> Iterator[List[Tuple[Any, ...]]]:
+    yield first
+    yield from rest
+
+WRITERS = {"ndjson": _write_ndjson, "csv": _write_csv, "parquet": _write_parquet}
+
+def check_format(fmt: str) -> None:
+    """Raise ValueError if fmt is unknown or its optional dependency is missing."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid export format: {fmt}")
+    if fmt == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise ValueError("parquet export requires pyarrow: pip install pyarrow")
+
+def export_table(conn: sqlite3.Connection, outdir: str, table: str, fmt: str = "ndjson",
+                 since: Optional[Watermark] = None, chunk_size: int = 5000) -> Watermark:
+    """Stream one table of a snapshot to a file in outdir.
+
+    A full export writes <table>.<fmt>; an incremental export (since is
+    given) writes <table>.<timestamp>.<fmt>, and no file at all when there
+    is nothing new. Files are written under a temporary name and renamed,
+    so readers never see a partial file.
+
+    Args:
+        conn (sqlite3.Connection): Connection from snapshot()
+        outdir (str): Output directory, it must exist
+        table (str): projects or all_ana_projects
+        fmt (str): ndjson, csv or parquet
+        since (Watermark): Watermark of the previous export, None for a full export
+        chunk_size (int): Rows read and written per batch
+
+    Returns:
+        Watermark: Position of this export, to be saved for the next one
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Invalid table: {table}")
+    check_format(fmt)
+    now = datetime.datetime.now()
+    if table == "all_ana_projects":
+        max_id, max_info_date = conn.execute(f"SELECT max(id), max(info_date) FROM {table}").fetchone()
+    else:
+        max_id, max_info_date = conn.execute(f"SELECT max(id) FROM {table}").fetchone()[0], None
+    mark = Watermark(id=max_id or 0, info_date=max_info_date, exported_at=now.strftime('%Y-%m-%d %H:%M:%S'))
+    if since is not None:
+        # 快照中的最大值不会小于上一次的水位, 表被清空时保留原水位
+        mark.id = max(mark.id, since.id)
+        mark.info_date = max(filter(None, (mark.info_date, since.info_date)), default=None)
+
+    columns = TABLE_COLUMNS[table]
+    chunks = _iter_chunks(conn, table, columns, since, chunk_size)
+    if since is not None:
+        first = next(chunks, None)
+        if first is None:
+            return mark
+        chunks = _chain(first, chunks)
+        name = f"{table}.{now.strftime('%Y%m%dT%H%M%S')}.{fmt}"
+    else:
+        name = f"{table}.{fmt}"
+
+    path = os.path.join(outdir, name)
+    tmp = os.path.join(outdir, f".{name}.tmp")
+    try:
+        mark.rows = WRITERS[fmt](tmp, columns, chunks)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+    mark.path = path
+    return mark
+
+def export_snapshot(dbpath: str, outdir: str, tables: Sequence[str] = EXPORT_TABLES, fmt: str = "ndjson",
+                    incremental: bool = False, chunk_size: int = 5000, method: str = "auto",
+                    tuning: Optional[ConnectionTuning] = None) -> Dict[str, Watermark]:
+    """Export tables from one consistent snapshot and save the new watermarks.
+
+    Args:
+        dbpath (str): Path to syncproject.db
+        outdir (str): Output directory, created if needed; holds the watermark file
+        tables: Tables to export
+        fmt (str): ndjson, csv or parquet
+        incremental (bool): Only export rows after the saved watermarks; a
+            table without a watermark is exported from the beginning
+        chunk_size (int): Rows read and written per batch
+        method (str): Snapshot method, see snapshot()
+        tuning (ConnectionTuning): Connection settings of syncproject.db
+
+    Returns:
+        Dict[str, Watermark]: table -> watermark of this export
+    """
+    check_format(fmt)
+    invalid = [t for t in tables if t not in EXPORT_TABLES]
+    if invalid:
+        raise ValueError(f"Invalid table: {', '.join(invalid)}")
+    if chunk_size < 1:
+        raise ValueError(f"Invalid chunk size: {chunk_size}")
+    os.makedirs(outdir, exist_ok=True)
+
+    marks = load_watermarks(outdir)
+    exported = {}
+    with snapshot(dbpath, tuning, method) as conn:
+        for table in tables:
+            since = marks.get(table, Watermark()) if incremental else None
+            exported[table] = export_table(conn, outdir, table, fmt, since, chunk_size)
+    # 所有文件写完后才更新水位, 中途失败时下次从原水位重新导出
+    marks.update(exported)
+    save_watermarks(outdir, marks)
+    return exported
@@ -0,0 +1,170 @@
+"""
+Cluster-wide leases kept in the leases table of syncproject.db.
+
+A lease has one holder at a time and an expiry time. The holder renews it
+from a background thread while it works; when the holder dies, the lease
+expires and the next node takes it over. `evapro lims2evapro` holds the
+"lims2evapro" lease so that only one sync runs at a time, wherever it is
+started.
+
+Expiry times are Unix timestamps, so the nodes' clocks should be synced
+to well within the lease TTL.
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .connection import ConnectionTuning
+from .database import SQLiteDB
+
+class LeaseLost(RuntimeError):
+    """Raised when a lease expired or was taken over while it was held."""
+
+@dataclass
+class LeaseInfo:
+    """Current state of a lease row.
+
+    Attributes:
+        name (str): Lease name
+        holder (str): Unique id of the holding process
+        host (str): Host of the holding process
+        pid (int): Process id of the holder on its host
+        acquired_at (float): Unix time the holder took the lease
+        expires_at (float): Unix time the lease expires unless renewed
+    """
+    name: str
+    holder: str
+    host: str
+    pid: int
+    acquired_at: float
+    expires_at: float
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+@dataclass
+class Lease:
+    """A named lease held by this process.
+
+    Attributes:
+        dbpath (str): Path to syncproject.db
+        name (str): Lease name, one row per name
+        ttl (float): Seconds the lease stays valid without renewal
+        tuning (ConnectionTuning): Connection settings of syncproject.db
+        holder (str): Unique id of this process
+        lost (bool): True once a renewal found the lease gone
+    """
+    dbpath: str
+    name: str
+    ttl: float = 300.0
+    tuning: ConnectionTuning = field(default_factory=ConnectionTuning)
+    holder: str = field(default_factory=lambda: f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}")
+    lost: bool = field(init=False, default=False)
+    expires_at: float = field(init=False, default=0.0)
+    db: SQLiteDB = field(init=False, repr=False)
+    _stop: threading.Event = field(init=False, repr=False, default_factory=threading.Event)
+    _thread: Optional[threading.Thread] = field(init=False, repr=False, default=None)
+
+    def __post_init__(self):
+        # 单独的连接, 续约线程不会与同步过程中的事务冲突
+        self.db = SQLiteDB(dbpath=self.dbpath, tuning=self.tuning)
+        self.db.migrate()
+
+    def current(self) -> Optional[LeaseInfo]:
+        """Return the lease row, None if nobody ever held it."""
+        row = self.db.cur.execute(
+            "SELECT name, holder, host, pid, acquired_at, expires_at FROM leases WHERE name = ?", (self.name,)
+        ).fetchone()
+        return LeaseInfo(*row) if row else None
+
+    def acquire(self) -> bool:
+        """Take the lease if it is free, expired, or held by a dead process of this host.
+
+        Returns:
+            bool: True if this process holds the lease now
+        """
+        now = time.time()
+        host = socket.gethostname()
+        row = (self.name, self.holder, host, os.getpid(), now, now, now + self.ttl)
+        acquired = self.db.transaction(lambda cur: cur.execute("""
+            INSERT INTO leases (name, holder, host, pid, acquired_at, renewed_at, expires_at) VALUES (?,?,?,?,?,?,?)
+            ON CONFLICT(name) DO UPDATE SET
+                holder = excluded.holder, host = excluded.host, pid = excluded.pid,
+                acquired_at = excluded.acquired_at, renewed_at = excluded.renewed_at, expires_at = excluded.expires_at
+            WHERE leases.expires_at <= excluded.acquired_at OR leases.holder = excluded.holder
+        """, row).rowcount == 1)
+        if not acquired:
+            # 同一节点上持有者进程已经退出时不必等到过期
+            info = self.current()
+            if info and info.host == host and not _pid_alive(info.pid):
+                acquired = self.db.transaction(lambda cur: cur.execute("""
+                    UPDATE leases SET holder = ?, host = ?, pid = ?, acquired_at = ?, renewed_at = ?, expires_at = ?
+                    WHERE name = ? AND holder = ?
+                """, (*row[1:], self.name, info.holder)).rowcount == 1)
+        if acquired:
+            self.expires_at = now + self.ttl
+            self.lost = False
+        return acquired
+
+    def renew(self) -> bool:
+        """Extend the lease by ttl seconds, False if it is no longer ours."""
+        now = time.time()
+        renewed = self.db.transaction(lambda cur: cur.execute(
+            "UPDATE leases SET renewed_at = ?, expires_at = ? WHERE name = ? AND holder = ?",
+            (now, now + self.ttl, self.name, self.holder)
+        ).rowcount == 1)
+        if renewed:
+            self.expires_at = now + self.ttl
+        return renewed
+
+    def release(self) -> None:
+        """Give the lease up so that the next run does not wait for the expiry."""
+        self.db.transaction(lambda cur: cur.execute(
+            "DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder)
+        ))
+
+    def ensure(self) -> None:
+        """Raise LeaseLost unless the lease is still held."""
+        if self.lost or time.time() >= self.expires_at:
+            self.lost = True
+            raise LeaseLost(f"lease {self.name} was lost, another process may have taken over")
+
+    def _keepalive(self) -> None:
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                if not self.renew():
+                    self.lost = True
+                    return
+            except Exception as e:
+                # 数据库暂时被锁时下次再续约, 真正过期由 ensure() 判断
+                print(f"续约 {self.name} 失败: {e}")
+
+    def __enter__(self) -> "Lease":
+        """Start renewing the lease in the background, it must be acquired already."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._keepalive, name=f"evapro-lease-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.release()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self.db.close_db()
@@ -0,0 +1,141 @@
+"""
+Pooled connections to the LIMS MySQL databases.
+
+One `evapro lims2evapro` run opens a LimsSession and hands it to every sync
+stage, so the TLS/auth handshake with the remote RDS happens once per run
+and database, not once per stage.
+"""
+
+import contextlib
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from evapro.config.settings import Config
+
+# 连接空闲超过这个秒数, 取出时先 ping 一次确认可用
+HEALTH_CHECK_INTERVAL = 30
+
+# 配置文件中的 lims 数据库
+LIMS_DATABASES = ("cloud_message_info", "lims3")
+
+def _pymysql_connect(**params):
+    import pymysql
+    return pymysql.connect(**params)
+
+class ConnectionPool:
+    """Small thread-safe pool of connections to one LIMS database.
+
+    Connections are opened lazily, at most size of them, and handed out by
+    connection(); callers block while all of them are in use. A connection
+    idle for longer than health_check_interval is pinged, and reconnected
+    if needed, before it is handed out. A connection whose user raised an
+    exception is closed instead of being reused.
+    """
+
+    def __init__(self, connect: Callable[[], Any], size: int = 1, health_check_interval: float = HEALTH_CHECK_INTERVAL):
+        self._connect = connect
+        self.size = max(1, size)
+        self.health_check_interval = health_check_interval
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        except BaseException:
+            self._discard(conn)
+            raise
+        self._idle.put((conn, time.monotonic()))
+
+    def _acquire(self):
+        try:
+            conn, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                return self._open()
+            conn, last_used = self._idle.get()
+
+        if time.monotonic() - last_used > self.health_check_interval:
+            try:
+                conn.ping(reconnect=True)
+            except Exception:
+                self._discard(conn)
+                with self._lock:
+                    self._created += 1
+                return self._open()
+        return conn
+
+    def _open(self):
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _discard(self, conn) -> None:
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+class LimsSession:
+    """Connection pools to every configured LIMS database for one sync run.
+
+    Attributes:
+        conf (Config): Configuration with the database sections
+        pool_size (int): Connections per database, default lims_query_workers
+    """
+
+    def __init__(self, conf: Config, connect: Optional[Callable[..., Any]] = None, pool_size: Optional[int] = None):
+        self.conf = conf
+        self.pool_size = pool_size or conf.lims_query_workers
+        self._connect = connect or _pymysql_connect
+        self._pools: Dict[str, ConnectionPool] = {}
+        self._lock = threading.Lock()
+
+    def pool(self, name: str) -> ConnectionPool:
+        """Return the pool of database name, creating it on first use.
+
+        Raises:
+            KeyError: If name is not configured in evapro.yaml
+        """
+        with self._lock:
+            if name not in self._pools:
+                params = self.conf[name]
+                self._pools[name] = ConnectionPool(lambda: self._connect(**params), size=self.pool_size)
+            return self._pools[name]
+
+    def connection(self, name: str):
+        """Check out one connection of database name, see ConnectionPool.connection."""
+        return self.pool(name).connection()
+
+    def close(self) -> None:
+        for pool in self._pools.values():
+            pool.close()
+        self._pools.clear()
+
+    def __enter__(self) -> "LimsSession":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,191 @@
+"""
+Versioned schema migrations for syncproject.db.
+
+The schema version is kept in ``PRAGMA user_version``. Every migration runs
+in its own transaction together with the version bump, so an interrupted
+upgrade leaves the database at the previous version. To change the schema,
+append a new ``(version, description, statements)`` entry to MIGRATIONS;
+never edit an entry that has been released.
+"""
+
+import sqlite3
+from typing import List, Optional, Sequence, Tuple
+
+from .database import CRT_PROJECTS_SQL, CRT_ALLPRO_SQL
+
+MIGRATIONS: List[Tuple[int, str, Sequence[str]]] = [
+    (1, "create projects and all_ana_projects tables", [
+        CRT_PROJECTS_SQL,
+        CRT_ALLPRO_SQL,
+    ]),
+    (2, "indexes for cron and LIMS sync lookups", [
+        # evapro cron: user = ? AND isadd2annoeva = 'N' AND workdir != '', covering proid/ptype/workdir
+        """create index if not exists idx_allpro_pending
+        on all_ana_projects(user, isadd2annoeva, workdir, proid, ptype) where isadd2annoeva = 'N'""",
+        # update_project_workdir: workdir = ''
+        """create index if not exists idx_allpro_no_workdir
+        on all_ana_projects(proid) where workdir = ''""",
+        # update_project_user: user IS NULL
+        """create index if not exists idx_allpro_no_user
+        on all_ana_projects(proid) where user is null""",
+    ]),
+    (3, "lims_cache table for product type and autoflow lookups", [
+        """create table if not exists lims_cache(
+        name text primary key not null,
+        checksum text,
+        fetched_at real not null,
+        payload text not null
+        )""",
+    ]),
+    (4, "sync_state, sync_runs and sync_checkpoints tables", [
+        """create table if not exists sync_state(
+        source text primary key not null,
+        watermark text,
+        updated_at text
+        )""",
+        """create table if not exists sync_runs(
+        id integer primary key autoincrement unique not null,
+        source text not null,
+        started_at text not null,
+        finished_at text,
+        duration real,
+        status text not null,
+        host text,
+        window_start text,
+        window_end text,
+        resumed_from text,
+        rows_fetched integer not null default 0,
+        inserted integer not null default 0,
+        updated integer not null default 0,
+        skipped integer not null default 0,
+        error text
+        )""",
+        """create index if not exists idx_sync_runs_source
+        on sync_runs(source, window_start, status)""",
+        """create table if not exists sync_checkpoints(
+        run_id integer not null,
+        chunk integer not null,
+        last_info_date text,
+        rows integer,
+        committed_at text,
+        primary key (run_id, chunk)
+        )""",
+    ]),
+    (5, "run_metrics table", [
+        """create table if not exists run_metrics(
+        id integer primary key autoincrement unique not null,
+        command text not null,
+        host text,
+        started_at text not null,
+        finished_at text,
+        duration real,
+        status text not null,
+        error text,
+        metrics text
+        )""",
+        """create index if not exists idx_run_metrics_command
+        on run_metrics(command, id)""",
+    ]),
+    (6, "dispatch_log table", [
+        """create table if not exists dispatch_log(
+        id integer primary key autoincrement unique not null,
+        run_at text not null,
+        host text,
+        account text not null,
+        user text,
+        pending integer not null default 0,
+        added integer not null default 0,
+        failed integer not null default 0,
+        elapsed real,
+        error text
+        )""",
+        """create index if not exists idx_dispatch_log_account
+        on dispatch_log(account, run_at)""",
+    ]),
+    (7, "workdir_status table", [
+        """create table if not exists workdir_status(
+        path text primary key not null,
+        ready integer not null,
+        error text,
+        checked_at text not null,
+        elapsed real
+        )""",
+        """create index if not exists idx_workdir_status_checked
+        on workdir_status(ready, checked_at)""",
+    ]),
+    (8, "leases table", [
+        """create table if not exists leases(
+        name text primary key not null,
+        holder text not null,
+        host text,
+        pid integer,
+        acquired_at real not null,
+        renewed_at real not null,
+        expires_at real not null
+        )""",
+    ]),
+    (9, "indexes for evapro ls keyset pagination", [
+        # 按 id 翻页: 每个过滤条件后面带上 id, 不需要排序
+        """create index if not exists idx_allpro_user_id
+        on all_ana_projects(user, id)""",
+        """create index if not exists idx_allpro_pending_id
+        on all_ana_projects(user, id) where isadd2annoeva = 'N'""",
+        """create index if not exists idx_allpro_ptype_id
+        on all_ana_projects(ptype, id)""",
+        """create index if not exists idx_allpro_info_date
+        on all_ana_projects(info_date)""",
+        """create index if not exists idx_projects_user_id
+        on projects(user, id)""",
+        """create index if not exists idx_projects_ptype_id
+        on projects(ptype, id)""",
+    ]),
+    (10, "claimed_at column for dispatch claims", [
+        # isadd2annoeva = 'P': 某个 cron/daemon 正在添加, claimed_at 是认领时间
+        "alter table all_ana_projects add column claimed_at real",
+        """create index if not exists idx_allpro_claimed
+        on all_ana_projects(claimed_at) where isadd2annoeva = 'P'""",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    """Return the schema version stored in PRAGMA user_version."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn: sqlite3.Connection, target: Optional[int] = None) -> List[int]:
+    """Apply all pending migrations up to target.
+
+    Args:
+        conn (sqlite3.Connection): Connection to syncproject.db
+        target (int): Schema version to stop at, default the latest
+
+    Returns:
+        List[int]: Versions applied by this call
+
+    Raises:
+        sqlite3.Error: If a migration fails, it is rolled back
+    """
+    target = LATEST_VERSION if target is None else target
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version > target or version <= schema_version(conn):
+            continue
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # 拿到写锁后再检查一次, 其他进程可能刚完成同一迁移
+            if schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {version:d}")
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"数据库迁移 v{version} ({description}) 失败: {str(e)}")
+            raise
+        applied.append(version)
+    if applied:
+        conn.execute("PRAGMA optimize")
+    return applied
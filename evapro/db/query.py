@@ -0,0 +1,159 @@
+"""
+Read-only project queries over the projects and all_ana_projects tables.
+
+Filters are validated and bound as parameters, and results are read with
+keyset pagination (``id > last_id ORDER BY id LIMIT n``). Each page is a
+short query of its own, so long listings never hold a read transaction
+open against the writers of syncproject.db and every page costs the same
+whatever its offset. This module is used by `evapro ls` and must not
+import pandas.
+"""
+
+import datetime
+import sqlite3
+from dataclasses import dataclass
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+# 每张表可查询的列
+TABLE_COLUMNS = {
+    "projects": ("id", "user", "proid", "ptype", "workdir", "dirstat", "info", "data", "autoconf", "conf_stde",
+                 "worksh", "pid", "p_args", "stime", "etime", "pstat", "run_num"),
+    "all_ana_projects": ("id", "user", "proid", "create_date", "info_date", "ptype", "isautoflow", "workdir",
+                         "isadd2annoeva"),
+}
+
+SINCE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S')
+
+def parse_since(value: str) -> str:
+    """Normalize a YYYY-MM-DD[ HH:MM:SS] date to the format stored in info_date.
+
+    Raises:
+        ValueError: If value is not a date in one of these formats
+    """
+    for fmt in SINCE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value.strip(), fmt).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid date: {value!r}, expected YYYY-MM-DD or 'YYYY-MM-DD HH:MM:SS'")
+
+@dataclass
+class ProjectFilter:
+    """Conditions of a project listing, all optional and combined with AND.
+
+    Attributes:
+        table (str): projects (annoeva monitoring) or all_ana_projects (synced from LIMS)
+        user (str): LIMS analysis user
+        ptype (str): Product type
+        proid (str): Project id prefix
+        pending (bool): Only projects not added to annoeva yet, all_ana_projects only
+        since (str): Only projects with info_date at or after this date, all_ana_projects only
+    """
+    table: str = "all_ana_projects"
+    user: Optional[str] = None
+    ptype: Optional[str] = None
+    proid: Optional[str] = None
+    pending: bool = False
+    since: Optional[str] = None
+
+    def __post_init__(self):
+        if self.table not in TABLE_COLUMNS:
+            raise ValueError(f"Invalid table: {self.table}")
+        if self.table != "all_ana_projects" and (self.pending or self.since):
+            raise ValueError("pending and since only apply to all_ana_projects")
+        if self.since:
+            self.since = parse_since(self.since)
+
+    def where(self) -> Tuple[List[str], List[Any]]:
+        """SQL conditions and their parameters."""
+        conditions, params = [], []
+        if self.user is not None:
+            conditions.append("user = ?")
+            params.append(self.user)
+        if self.ptype is not None:
+            conditions.append("ptype = ?")
+            params.append(self.ptype)
+        if self.proid:
+            # 前缀匹配改写为范围查询, 可以使用 proid 的唯一索引
+            conditions.append("proid >= ? AND proid < ?")
+            params += [self.proid, self.proid[:-1] + chr(ord(self.proid[-1]) + 1)]
+        if self.pending:
+            conditions.append("isadd2annoeva = 'N'")
+        if self.since:
+            conditions.append("info_date >= ?")
+            params.append(self.since)
+        return conditions, params
+
+def _columns(table: str, columns: Optional[Sequence[str]]) -> List[str]:
+    valid = TABLE_COLUMNS[table]
+    columns = list(columns or valid)
+    invalid = [c for c in columns if c not in valid]
+    if invalid:
+        raise ValueError(f"Invalid column name: {', '.join(invalid)}")
+    if "id" not in columns:
+        # 翻页需要 id
+        columns.insert(0, "id")
+    return columns
+
+def fetch_page(conn: sqlite3.Connection, flt: ProjectFilter, columns: Optional[Sequence[str]] = None,
+               after: Optional[int] = None, size: int = 500, newest_first: bool = False) -> Tuple[List[sqlite3.Row], Optional[int]]:
+    """Read one page of matching projects.
+
+    Args:
+        conn (sqlite3.Connection): Connection to syncproject.db
+        flt (ProjectFilter): Conditions
+        columns: Columns to return, all by default; id is always included
+        after (int): Cursor returned with the previous page, None for the first page
+        size (int): Maximum number of rows
+        newest_first (bool): Order by descending id instead of ascending
+
+    Returns:
+        tuple: (rows, cursor of the next page or None after the last page)
+
+    Raises:
+        ValueError: If a column name or the page size is invalid
+    """
+    if size < 1:
+        raise ValueError(f"Invalid page size: {size}")
+    conditions, params = flt.where()
+    if after is not None:
+        conditions.append("id < ?" if newest_first else "id > ?")
+        params.append(after)
+    query = f"SELECT {', '.join(_columns(flt.table, columns))} FROM {flt.table}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += f" ORDER BY id {'DESC' if newest_first else 'ASC'} LIMIT ?"
+    params.append(size)
+
+    cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
+    try:
+        rows = cur.execute(query, params).fetchall()
+    finally:
+        cur.close()
+    cursor = rows[-1]["id"] if len(rows) == size else None
+    return rows, cursor
+
+def iter_projects(conn: sqlite3.Connection, flt: ProjectFilter, columns: Optional[Sequence[str]] = None,
+                  page_size: int = 500, limit: Optional[int] = None, newest_first: bool = False) -> Iterator[sqlite3.Row]:
+    """Yield matching projects page by page.
+
+    Args:
+        conn (sqlite3.Connection): Connection to syncproject.db
+        flt (ProjectFilter): Conditions
+        columns: Columns to return, all by default; id is always included
+        page_size (int): Rows read per query
+        limit (int): Stop after this many rows, None for all
+        newest_first (bool): Order by descending id instead of ascending
+
+    Yields:
+        sqlite3.Row: Row supporting access by column name and index
+    """
+    after, seen = None, 0
+    while limit is None or seen < limit:
+        size = page_size if limit is None else min(page_size, limit - seen)
+        rows, after = fetch_page(conn, flt, columns, after=after, size=size, newest_first=newest_first)
+        yield from rows
+        seen += len(rows)
+        if after is None:
+            break
@@ -0,0 +1,62 @@
+"""
+Per-run timing and row metrics kept in the run_metrics table of syncproject.db.
+
+Timers, counters and latency histograms of a run are stored together as one
+JSON document, see evapro.metrics for how they are collected.
+"""
+
+import json
+from typing import Any, List, Optional, cast
+
+from .database import SQLiteDB
+from evapro.metrics import RunMetrics
+
+class RunMetricsStore:
+    """Read and write run_metrics rows.
+
+    Attributes:
+        db (SQLiteDB): Opened syncproject.db, migrated to schema v5 or later
+    """
+
+    def __init__(self, db: SQLiteDB):
+        self.db = db
+
+    def save(self, m: RunMetrics) -> int:
+        """Store a finished run and return its id."""
+        return cast(int, self.db.transaction(lambda cur: cur.execute(
+            "INSERT INTO run_metrics (command, host, started_at, finished_at, duration, status, error, metrics) "
+            "VALUES (?,?,?,?,?,?,?,?)",
+            (m.command, m.host, m.started_at, m.finished_at, m.duration, m.status, m.error,
+             json.dumps(m.to_dict(), separators=(',', ':')))
+        ).lastrowid))
+
+    def recent(self, n: int = 10, command: Optional[str] = None) -> List[RunMetrics]:
+        """Return the last n runs, newest first, optionally of one command only."""
+        query = "SELECT command, host, started_at, finished_at, duration, status, error, metrics FROM run_metrics"
+        params: List[Any] = []
+        if command:
+            query += " WHERE command = ?"
+            params.append(command)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(n)
+
+        runs = []
+        for command, host, started_at, finished_at, duration, status, error, data in self.db.cur.execute(query, params).fetchall():
+            m = RunMetrics(command=command, started_at=started_at, finished_at=finished_at,
+                           duration=duration or 0.0, status=status, error=error, host=host)
+            runs.append(m.load_dict(json.loads(data or '{}')))
+        return runs
+
+    def prune(self, keep: int, command: Optional[str] = None) -> int:
+        """Delete all but the newest keep runs of command, or of every command, return the number deleted."""
+        def write(cur):
+            commands = [command] if command else [row[0] for row in cur.execute("SELECT DISTINCT command FROM run_metrics").fetchall()]
+            deleted = 0
+            for name in commands:
+                deleted += cur.execute(
+                    "DELETE FROM run_metrics WHERE command = ? AND id NOT IN "
+                    "(SELECT id FROM run_metrics WHERE command = ? ORDER BY id DESC LIMIT ?)",
+                    (name, name, keep)
+                ).rowcount
+            return deleted
+        return self.db.transaction(write)
@@ -0,0 +1,120 @@
+"""
+Persistent LIMS sync state kept in syncproject.db.
+
+sync_state holds one watermark per source, sync_runs the history of every
+run with its window, duration and row counts, and sync_checkpoints the
+last committed chunk of each run. Bills are streamed in info_date order,
+so a run that died partway through resumes from the last checkpoint of the
+same window instead of fetching the whole window again.
+"""
+
+import datetime
+import socket
+import sqlite3
+import time
+from typing import Dict, Optional, cast
+
+from .database import SQLiteDB
+
+def _now() -> str:
+    return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def read_watermark(conn: sqlite3.Connection, source: str) -> Optional[str]:
+    """Return the watermark of source, None if it was never synced."""
+    row = conn.execute("SELECT watermark FROM sync_state WHERE source = ?", (source,)).fetchone()
+    return row[0] if row else None
+
+def read_resume_point(conn: sqlite3.Connection, source: str, window_start: str) -> Optional[str]:
+    """Return where an interrupted sync of the same window stopped.
+
+    Args:
+        conn (sqlite3.Connection): Connection to syncproject.db, read-only is enough
+        source (str): Sync source name
+        window_start (str): Current watermark of source
+
+    Returns:
+        str: info_date of the last committed chunk of unfinished runs
+        starting at window_start, None if there is nothing to resume
+    """
+    row = conn.execute("""
+        SELECT MAX(c.last_info_date) FROM sync_checkpoints c
+        JOIN sync_runs r ON r.id = c.run_id
+        WHERE r.source = ? AND r.window_start = ? AND r.status != 'done'
+    """, (source, window_start)).fetchone()
+    return row[0] if row else None
+
+class SyncState:
+    """Watermarks, run history and checkpoints of the LIMS sync.
+
+    Attributes:
+        db (SQLiteDB): Opened syncproject.db, migrated to schema v4 or later
+    """
+
+    def __init__(self, db: SQLiteDB):
+        self.db = db
+        self._started: Dict[int, float] = {}
+
+    def get_watermark(self, source: str) -> Optional[str]:
+        """Return the watermark of source, None if it was never synced."""
+        return read_watermark(self.db.conn, source)
+
+    def set_watermark(self, source: str, watermark: str) -> None:
+        self.db.transaction(lambda cur: self._set_watermark(cur, source, watermark))
+
+    @staticmethod
+    def _set_watermark(cur, source: str, watermark: str) -> None:
+        cur.execute(
+            "INSERT INTO sync_state (source, watermark, updated_at) VALUES (?,?,?) "
+            "ON CONFLICT(source) DO UPDATE SET watermark = excluded.watermark, updated_at = excluded.updated_at",
+            (source, watermark, _now())
+        )
+
+    def resume_point(self, source: str, window_start: str) -> Optional[str]:
+        """Return where an interrupted sync of the same window stopped, see read_resume_point()."""
+        return read_resume_point(self.db.conn, source, window_start)
+
+    def start_run(self, source: str, window_start: str, window_end: str, resumed_from: Optional[str] = None) -> int:
+        """Record the start of a run and return its id."""
+        run_id = cast(int, self.db.transaction(lambda cur: cur.execute(
+            "INSERT INTO sync_runs (source, started_at, status, host, window_start, window_end, resumed_from) "
+            "VALUES (?,?,'running',?,?,?,?)",
+            (source, _now(), socket.gethostname(), window_start, window_end, resumed_from)
+        ).lastrowid))
+        self._started[run_id] = time.monotonic()
+        return run_id
+
+    def checkpoint(self, run_id: int, chunk: int, last_info_date: str, rows: int, counts: Dict[str, int]) -> None:
+        """Record a committed chunk and add its row counts to the run."""
+        def write(cur):
+            cur.execute(
+                "INSERT OR REPLACE INTO sync_checkpoints (run_id, chunk, last_info_date, rows, committed_at) VALUES (?,?,?,?,?)",
+                (run_id, chunk, last_info_date, rows, _now())
+            )
+            cur.execute(
+                "UPDATE sync_runs SET rows_fetched = rows_fetched + ?, inserted = inserted + ?, "
+                "updated = updated + ?, skipped = skipped + ? WHERE id = ?",
+                (rows, counts.get('inserted', 0), counts.get('updated', 0), counts.get('skipped', 0), run_id)
+            )
+        self.db.transaction(write)
+
+    def finish_run(self, run_id: int, status: str, error: Optional[str] = None) -> None:
+        """Close a run; a successful run moves the source watermark to its window end.
+
+        Args:
+            run_id (int): Run id from start_run
+            status (str): done or failed
+            error (str): Error message of a failed run
+        """
+        duration = time.monotonic() - self._started.pop(run_id, time.monotonic())
+
+        def write(cur):
+            cur.execute(
+                "UPDATE sync_runs SET status = ?, finished_at = ?, duration = ?, error = ? WHERE id = ?",
+                (status, _now(), duration, error, run_id)
+            )
+            if status == 'done':
+                source, window_end = cur.execute(
+                    "SELECT source, window_end FROM sync_runs WHERE id = ?", (run_id,)
+                ).fetchone()
+                self._set_watermark(cur, source, window_end)
+        self.db.transaction(write)
@@ -0,0 +1,51 @@
+"""
+Pure transform from LIMS bills to all_ana_projects records.
+
+No database access happens here, so the step can be tested and
+benchmarked on synthetic DataFrames (see benchmarks/bench_transform.py).
+"""
+
+from typing import Iterable, Mapping, Tuple, Union
+
+from pandas import DataFrame, Series, to_datetime
+
+from .database import ALLPRO_COLUMNS
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def build_allpro_records(bills: DataFrame, product_map: DataFrame,
+                         paths: Union[Mapping[str, str], Series], autoflow_products: Iterable[str]) -> Tuple[DataFrame, DataFrame]:
+    """Join LIMS bills with product types and workdirs.
+
+    Args:
+        bills: Bills with create_date, info_date, project_code, info_user_id
+            and product_ID columns
+        product_map: DataFrame indexed by PRODUCT_LIMS_ID with a PRODUCT column
+        paths: project_code -> workdir mapping
+        autoflow_products: Product types annoeva can configure automatically
+
+    Returns:
+        tuple: (records with ALLPRO_COLUMNS, ready for SQLiteDB.insert_allpro_many,
+        bills whose product_ID has no product type)
+    """
+    merged = bills.merge(product_map[['PRODUCT']], how='left', left_on='product_ID', right_index=True)
+    matched = merged['PRODUCT'].notna().to_numpy()
+    unmatched = bills[~matched]
+    merged = merged[matched]
+
+    workdir = Series(paths, dtype=object, name='workdir')
+    workdir = workdir[~workdir.index.duplicated()]
+    merged = merged.merge(workdir, how='left', left_on='project_code', right_index=True)
+
+    records = DataFrame({
+        'user': merged['info_user_id'],
+        'proid': merged['project_code'],
+        'create_date': to_datetime(merged['create_date']).dt.strftime(DATE_FORMAT),
+        'info_date': to_datetime(merged['info_date']).dt.strftime(DATE_FORMAT),
+        'ptype': merged['PRODUCT'],
+        'isautoflow': merged['PRODUCT'].isin(list(autoflow_products)).map({True: 'Y', False: 'N'}),
+        'workdir': merged['workdir'].fillna(''),
+    }, columns=list(ALLPRO_COLUMNS))
+    # NaN/NaT 写入数据库时统一为 NULL
+    records = records.astype(object).where(records.notna(), None)
+    return records.reset_index(drop=True), unmatched
@@ -1,41 +1,140 @@
-import pymysql
+import os
+import time
 import datetime
-from datetime import timedelta
-import importlib.resources
-import yaml
-import subprocess
-import getpass
-from pandas import read_sql, DataFrame
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from pandas import read_sql, DataFrame, Series
+from evapro.config.conf import _get_yaml_data
+from evapro.config.settings import Config, LIMS_KEYS, load_config
 from evapro.db import SQLiteDB
+from evapro.db.connection import ConnectionTuning, connect_readonly
+from evapro.db.lims import ConnectionPool, LimsSession
+from evapro.db.cache import LimsCache, DEFAULT_TTL
+from evapro.db.delta import KnownProjects, SyncPlan
+from evapro.db.lease import Lease
+from evapro.db.migrations import LATEST_VERSION, schema_version
+from evapro.db.syncstate import SyncState, read_resume_point, read_watermark
+from evapro.db.transform import build_allpro_records
+from evapro import metrics
+
+# 每条 IN (...) 查询最多包含的项目数
+LIMS_CHUNK_SIZE = 500
+
+# lims_cache 中的缓存项
+PRODUCT_TYPE_CACHE = "product_type"
+AUTOFLOW_CACHE = "autoflow_products"
+
+# sync_state 中的同步来源
+LIMS_BILL_SOURCE = "tb_info_sequence_bill"
+
+# 流式读取 lims 任务单时每批处理的行数
+LIMS_STREAM_CHUNK_SIZE = 5000
+
+def _iter_chunks(items, size: int):
+    """Yield successive lists of at most size items."""
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def chunked_lookup(pool: ConnectionPool, query: str, keys, chunk_size: int = LIMS_CHUNK_SIZE, workers: int = 1, params=(),
+                   metric: str = 'lims.lookup') -> list:
+    """Run an IN (...) lookup for many keys in parameterized chunks.
+
+    Large key lists would otherwise exceed MySQL's max_allowed_packet and
+    take long to plan. With workers > 1 the chunks run concurrently on
+    separate connections of the pool.
 
-def _get_yaml_data(yaml_file: str) -> dict:
-    """Load and parse YAML configuration file.
-    
     Args:
-        yaml_file: Path to the YAML configuration file
-        
+        pool (ConnectionPool): Connections to the database to query
+        query (str): SQL with a {keys} placeholder inside IN (...); other
+            %s placeholders must come after it and are bound from params
+        keys: Values bound into the IN list
+        chunk_size (int): Number of keys per statement
+        workers (int): Number of chunks queried at the same time
+        params: Extra parameters bound after the keys of every chunk
+        metric (str): Latency histogram the chunk queries are recorded in
+
     Returns:
-        dict: Parsed YAML data
-        
-    Raises:
-        yaml.YAMLError: If the YAML file is malformed
-        FileNotFoundError: If the specified file does not exist
+        list: Rows of all chunks, in chunk order
     """
-    with open(yaml_file, "r", encoding="utf-8") as file:
-        return yaml.safe_load(file)
+    def run(chunk):
+        with pool.connection() as conn, conn.cursor() as cur:
+            start = time.perf_counter()
+            cur.execute(query.format(keys=','.join(['%s'] * len(chunk))), list(chunk) + list(params))
+            rows = list(cur.fetchall())
+            metrics.observe(metric, time.perf_counter() - start)
+            return rows
+
+    chunks = list(_iter_chunks(keys, chunk_size))
+    if workers <= 1 or len(chunks) <= 1:
+        results = [run(chunk) for chunk in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            results = list(executor.map(run, chunks))
+    return [row for rows in results for row in rows]
+
+def fetch_workdirs(pool: ConnectionPool, proids, chunk_size: int = LIMS_CHUNK_SIZE, workers: int = 1) -> dict:
+    """Resolve project workdirs from project_online_backup_info.
 
-def get_analysis_project(connection, now_date):
+    Only the given sub projects are queried, through chunked_lookup(), so
+    the filtering happens in MySQL instead of pandas. MISSION_END_DATE is
+    a business date rather than a modification time, so backup rows are
+    not filtered by date: a row written late with an old or NULL date must
+    still resolve its project.
+
+    Args:
+        pool (ConnectionPool): cloud_message_info connections
+        proids: sub project ids to resolve
+        chunk_size (int): number of ids bound into one IN (...) clause
+        workers (int): number of chunks queried at the same time
+
+    Returns:
+        dict: SUB_PROJECT_ID -> PATHWAY
     """
-    获取用户的分析项目数据
-    
+    query = "SELECT SUB_PROJECT_ID, PATHWAY FROM project_online_backup_info WHERE SUB_PROJECT_ID IN ({keys}) AND PATHWAY != ''"
+    paths: Dict[str, str] = {}
+    for sub_project_id, pathway in chunked_lookup(pool, query, proids, chunk_size, workers, metric='lims.backup_info'):
+        paths.setdefault(sub_project_id, pathway)
+    return paths
+
+def fetch_users(pool: ConnectionPool, proids, chunk_size: int = LIMS_CHUNK_SIZE, workers: int = 1) -> dict:
+    """Resolve the analysis user of projects from tb_info_sequence_bill.
+
+    Args:
+        pool (ConnectionPool): lims3 connections
+        proids: project codes to resolve
+        chunk_size (int): number of codes bound into one IN (...) clause
+        workers (int): number of chunks queried at the same time
+
+    Returns:
+        dict: project_code -> info_user_id
+    """
+    query = "SELECT project_code, info_user_id FROM tb_info_sequence_bill WHERE project_code IN ({keys}) AND info_user_id != ''"
+    users: Dict[str, str] = {}
+    for project_code, info_user_id in chunked_lookup(pool, query, proids, chunk_size, workers, metric='lims.bill_user'):
+        users.setdefault(project_code, info_user_id)
+    return users
+
+def iter_analysis_projects(connection, now_date, chunk_size: int = LIMS_STREAM_CHUNK_SIZE, inclusive: bool = False):
+    """
+    流式获取分析项目数据
+
+    使用服务端游标(SSCursor)逐批读取, 内存占用只与 chunk_size 有关, 与同步的时间窗口大小无关;
+    结果按 info_date 排序, 每批最后一行的 info_date 可以作为断点
+
     参数:
-        connection: 数据库连接对象
-        info_user_id: 用户ID
-        create_date: 创建日期阈值 (格式: 'YYYY-MM-DD HH:MM:SS')
-    
+        connection: lims3 数据库连接对象, 读取完成前不能在这个连接上执行其他查询
+        now_date: 只读取 info_date 大于这个时间的任务单 (格式: 'YYYY-MM-DD HH:MM:SS')
+        chunk_size: 每批读取的行数
+        inclusive: 为 True 时也读取 info_date 等于 now_date 的任务单 (从断点续传时使用)
+
     返回:
-        DataFrame 包含 project_code, product_ID, task_name
+        生成器, 每批产生一个 DataFrame, 包含 create_date, info_date, project_code, task_name, info_user_id, product_ID
     """
+    from pymysql.cursors import SSCursor
+
     query = """
         SELECT 
             create_date,
@@ -48,18 +147,35 @@ def get_analysis_project(connection, now_date):
         FROM 
             tb_info_sequence_bill 
         WHERE 
-            info_date > %s 
+            info_date {op} %s 
             AND ANALYSIS_TYPE = 1
-    """
-    
+        ORDER BY
+            info_date, project_code
+    """.format(op='>=' if inclusive else '>')
+
+    cur = connection.cursor(SSCursor)
     try:
-        df = read_sql(query, con=connection, params=(now_date,))
-        df['product_ID'] = df['product_parent_id'].astype(str) + "-" + df['product_id'].astype(str)
-        df.drop(['product_parent_id', 'product_id'], axis=1, inplace=True)
-        return df
+        start = time.perf_counter()
+        cur.execute(query, (now_date,))
+        metrics.observe('lims.bill_query', time.perf_counter() - start)
+        columns = [desc[0] for desc in cur.description]
+        while True:
+            start = time.perf_counter()
+            rows = cur.fetchmany(chunk_size)
+            metrics.observe('lims.bill_fetch', time.perf_counter() - start)
+            if not rows:
+                break
+            df = DataFrame(list(rows), columns=columns)
+            df['product_ID'] = df['product_parent_id'].astype("str") + "-" + df['product_id'].astype("str")
+            df.drop(['product_parent_id', 'product_id'], axis=1, inplace=True)
+            metrics.current().add_time('sync.fetch', time.perf_counter() - start)
+            metrics.count('lims.bills', len(rows))
+            yield df
     except Exception as e:
         print(f"查询出错: {e}")
-        return DataFrame()
+        raise
+    finally:
+        cur.close()
 
 def product_type(CONN):
     """Get product id and name from lims"""
@@ -75,164 +191,289 @@ def product_type(CONN):
     df.columns = ['PRODUCT']
     return df
 
-def update_project_workdir() -> None:
-    confpath = importlib.resources.path("evapro.config", "evapro.yaml")
-    with confpath as default_config:
-        conf = _get_yaml_data(default_config)
-        
-    tbj = SQLiteDB(dbpath=f"{conf['syncproject']}")
+def product_type_checksum(CONN) -> str:
+    """Cheap change probe of project_online_product_type
+
+    Uses CHECKSUM TABLE, or the row count where it is not supported.
+    """
+    with CONN.cursor() as cur:
+        try:
+            cur.execute('CHECKSUM TABLE project_online_product_type')
+            row = cur.fetchone()
+            if row and row[-1] is not None:
+                return f"checksum:{row[-1]}"
+        except Exception:
+            pass
+        cur.execute('SELECT COUNT(*) FROM project_online_product_type')
+        return f"count:{cur.fetchone()[0]}"
+
+def cached_product_type(cache: LimsCache, session: LimsSession, ttl: float = DEFAULT_TTL, refresh: bool = False) -> DataFrame:
+    """product_type() served from lims_cache
+
+    The table is downloaded again only when the cached copy is older than
+    ttl and its checksum changed.
+
+    Returns:
+        DataFrame indexed by PRODUCT_LIMS_ID with a PRODUCT column
+    """
+    def probe():
+        with session.connection('cloud_message_info') as conn:
+            return product_type_checksum(conn)
+
+    def load():
+        with session.connection('cloud_message_info') as conn:
+            return product_type(conn)['PRODUCT'].to_dict()
+
+    mapping = cache.cached(PRODUCT_TYPE_CACHE, probe, load, ttl=ttl, refresh=refresh)
+    df = DataFrame({'PRODUCT': Series(mapping, dtype=object)})
+    df.index.name = 'PRODUCT_LIMS_ID'
+    return df
+
+def cached_autoflow_products(cache: LimsCache, annoevaconf: str, refresh: bool = False) -> set:
+    """Product types with an autoconf entry in annoeva's evaconf.yaml
+
+    The YAML file is parsed again only when its mtime or size changed.
+    """
+    def probe():
+        st = os.stat(annoevaconf)
+        return f"{os.path.abspath(annoevaconf)}:{st.st_mtime_ns}:{st.st_size}"
+
+    def load():
+        return sorted(_get_yaml_data(annoevaconf)['autoconf'].keys())
+
+    return set(cache.cached(AUTOFLOW_CACHE, probe, load, ttl=0, refresh=refresh))
+
+@metrics.timer('stage.update_project_workdir')
+def update_project_workdir(session: Optional[LimsSession] = None, conf: Optional[Config] = None) -> None:
+    """Fill in the workdir of projects synced before their backup info existed.
+
+    Args:
+        session (LimsSession): Shared LIMS connections, a private one is
+            opened when None
+        conf (Config): Configuration, load_config() when None
+    """
+    if conf is None:
+        conf = load_config()
+    conf.require('cloud_message_info')
+    tbj = SQLiteDB(dbpath=conf.syncproject, tuning=ConnectionTuning.from_conf(conf))
+    tbj.migrate()
     query = "SELECT proid FROM all_ana_projects WHERE workdir = ''"
     df = read_sql(query, con=tbj.conn)
     if df.shape[0] == 0:
         tbj.close_db()
         return
 
-    conn = pymysql.connect(**conf['cloud_message_info'])
-    query = f"""SELECT SUB_PROJECT_ID, PATHWAY FROM project_online_backup_info WHERE PATHWAY != '' AND SUB_PROJECT_ID IN ({','.join([f"'{item}'" for item in df['proid']])})"""
-    path_df = read_sql(query, conn)
-    
-    for i, row in path_df.iterrows():
-        try:
-            update_sql = f"update all_ana_projects set workdir ='{row['PATHWAY']}' where proid='{row['SUB_PROJECT_ID']}'"
-            tbj.cur.execute(update_sql)
-            tbj.conn.commit()
-        except Exception as e:
-            print(f"Error updating workdir for project {row['SUB_PROJECT_ID']}: {e}")
-            continue
+    with contextlib.ExitStack() as stack:
+        if session is None:
+            session = stack.enter_context(LimsSession(conf))
+        paths = fetch_workdirs(
+            session.pool('cloud_message_info'), df['proid'],
+            chunk_size=conf.lims_chunk_size, workers=session.pool_size
+        )
+
+    tbj.update_many({proid: {'workdir': pathway} for proid, pathway in paths.items()})
+    metrics.count('sync.workdirs_filled', len(paths))
     tbj.close_db()
-    conn.close()
     
-def update_project_user() -> None:
-    confpath = importlib.resources.path("evapro.config", "evapro.yaml")
-    with confpath as default_config:
-        conf = _get_yaml_data(default_config)
-        
-    tbj = SQLiteDB(dbpath=f"{conf['syncproject']}")
+@metrics.timer('stage.update_project_user')
+def update_project_user(session: Optional[LimsSession] = None, conf: Optional[Config] = None) -> None:
+    """Fill in the analysis user of projects synced before LIMS assigned one.
+
+    Args:
+        session (LimsSession): Shared LIMS connections, a private one is
+            opened when None
+        conf (Config): Configuration, load_config() when None
+    """
+    if conf is None:
+        conf = load_config()
+    conf.require('lims3')
+    tbj = SQLiteDB(dbpath=conf.syncproject, tuning=ConnectionTuning.from_conf(conf))
+    tbj.migrate()
     query = "SELECT proid FROM all_ana_projects WHERE user IS NULL"
     df = read_sql(query, con=tbj.conn)
     if df.shape[0] == 0:
         tbj.close_db()
         return
 
-    conn = pymysql.connect(**conf['lims3'])
-    query = f"""SELECT project_code, info_user_id FROM tb_info_sequence_bill WHERE info_user_id != '' AND project_code IN ({','.join([f"'{item}'" for item in df['proid']])})"""
-    path_df = read_sql(query, conn)
-    
-    for i, row in path_df.iterrows():
-        try:
-            update_sql = f"update all_ana_projects set user ='{row['info_user_id']}' where proid='{row['project_code']}'"
-            tbj.cur.execute(update_sql)
-            tbj.conn.commit()
-        except Exception as e:
-            print(f"Error updating user for project {row['project_code']}: {e}")
-            continue
+    with contextlib.ExitStack() as stack:
+        if session is None:
+            session = stack.enter_context(LimsSession(conf))
+        users = fetch_users(
+            session.pool('lims3'), df['proid'],
+            chunk_size=conf.lims_chunk_size, workers=session.pool_size
+        )
+
+    tbj.update_many({proid: {'user': user} for proid, user in users.items()})
+    metrics.count('sync.users_filled', len(users))
     tbj.close_db()
-    conn.close()
 
-def lims2evaproDB() -> None:
-    """Sync data from LIMS to evapro database"""
+def _plan_chunk(df_ana_pro: DataFrame, pid_name: DataFrame, autoflow_products, session: LimsSession, conf: Config,
+                known: KnownProjects) -> tuple:
+    """Resolve workdirs, transform one chunk of LIMS bills and plan its delta.
+
+    Returns:
+        tuple: (SyncPlan of the chunk, number of bills without a product type)
+    """
+    # 已加入 annoeva 的项目不会再更新, 不用再查 workdir
+    lookup = df_ana_pro['product_ID'].isin(pid_name.index).to_numpy() & ~known.is_locked(df_ana_pro['project_code']).to_numpy()
+    with metrics.timer('sync.workdir_lookup'):
+        paths = fetch_workdirs(
+            session.pool('cloud_message_info'), df_ana_pro.loc[lookup, 'project_code'].unique(),
+            chunk_size=conf.lims_chunk_size, workers=session.pool_size
+        )
+    with metrics.timer('sync.transform'):
+        records, unmatched = build_allpro_records(df_ana_pro, pid_name, paths, autoflow_products)
+    with metrics.timer('sync.plan'):
+        plan = known.plan(records)
+    return plan, unmatched.shape[0]
+
+def _sync_chunk(df_ana_pro: DataFrame, pid_name: DataFrame, autoflow_products, session: LimsSession, conf: Config,
+                tbj: SQLiteDB, known: KnownProjects) -> dict:
+    """Plan one chunk of LIMS bills and upsert only its new and changed records.
+
+    Returns:
+        dict: inserted, updated, skipped and unmatched counts of the chunk
+    """
+    plan, unmatched = _plan_chunk(df_ana_pro, pid_name, autoflow_products, session, conf, known)
+    with metrics.timer('sync.write'):
+        counts = tbj.insert_allpro_many(plan.writes.itertuples(index=False, name=None), on_conflict="update")
+    known.remember(plan)
+    counts['skipped'] += plan.skipped
+    counts['unmatched'] = unmatched
+    return counts
+
+@metrics.timer('stage.lims2evaproDB')
+def lims2evaproDB(session: Optional[LimsSession] = None, conf: Optional[Config] = None, lease: Optional[Lease] = None) -> None:
+    """Sync data from LIMS to evapro database
+
+    Args:
+        session (LimsSession): Shared LIMS connections, a private one is
+            opened when None
+        conf (Config): Configuration, load_config() when None
+        lease (Lease): Sync lease held by the caller, checked before every
+            chunk is written
+
+    Raises:
+        LeaseLost: If lease expired or was taken over during the sync
+    """
+    stack = contextlib.ExitStack()
     try:
-        confpath = importlib.resources.path("evapro.config", "evapro.yaml")
-        with confpath as default_config:
-            conf = _get_yaml_data(default_config)
-
-        pre_syn_time = conf['syn_lims_time']
-        now = datetime.datetime.now()
-        now_str = now.strftime('%Y-%m-%d %H:%M:%S')
-
-        one_week_ago = now - timedelta(weeks=6)
-        one_week_ago_str = one_week_ago.strftime("%Y-%m-%d %H:%M:%S")
-
-        conn = pymysql.connect(**conf['cloud_message_info'])
-        conn_bill = pymysql.connect(**conf['lims3'])
-
-        df_ana_pro = get_analysis_project(conn_bill, pre_syn_time)
-        pid_name = product_type(conn)
-        
-        # ---
-        not_add_ana_df = df_ana_pro[df_ana_pro['product_ID'].isin(pid_name.index)==False]
-        not_add_ana_df.to_csv("~/not_add_ana_df.tsv", sep="\t")
-        # ---
-        
-        df_ana_pro = df_ana_pro[df_ana_pro['product_ID'].isin(pid_name.index)==True]
-        df_ana_pro['PRODUCT'] = pid_name.loc[df_ana_pro['product_ID'], "PRODUCT"].to_list()
-        df_ana_pro['workdir'] = ''
-
-        path_df = read_sql('SELECT SUB_PROJECT_ID, PATHWAY FROM project_online_backup_info where MISSION_END_DATE>"2025-04-01"', con=conn)
-        path_df.index = path_df['SUB_PROJECT_ID']
-        path_df = path_df.drop_duplicates('SUB_PROJECT_ID')
-        path_df = path_df[path_df['SUB_PROJECT_ID'].isin(df_ana_pro['project_code'])]
-
-        # ---
-        have_workdir_df = df_ana_pro[df_ana_pro['project_code'].isin(path_df['SUB_PROJECT_ID'])]
-        df_ana_pro.loc[have_workdir_df.index, 'workdir'] = path_df.loc[have_workdir_df['project_code'], "PATHWAY"].to_list()
-        # ---
-
-        annoeva_conf = _get_yaml_data(conf['annoevaconf'])
-        autoflow_products = annoeva_conf['autoconf'].keys()
-        tbj = SQLiteDB(dbpath=f"{conf['syncproject']}")
-
-        for i, row in df_ana_pro.iterrows():
-            create_date = row['create_date'].strftime('%Y-%m-%d %H:%M:%S')
-            info_date = row['info_date'].strftime('%Y-%m-%d %H:%M:%S')
-            try:
-                isautoflow = 'Y' if row['PRODUCT'] in autoflow_products else 'N'
-                tbj.insert_allpro_tb_sql(row['info_user_id'], row['project_code'], create_date, info_date, row['PRODUCT'], isautoflow, row['workdir'],)
-            except Exception as e:
-                print(f"Error inserting project {row['project_code']}: {e}")
-                continue
+        if conf is None:
+            conf = load_config()
+        conf.require(*LIMS_KEYS)
+        if session is None:
+            session = stack.enter_context(LimsSession(conf))
 
-        tbj.close_db()
-        conn.close()
-        conn_bill.close()
+        now_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        tbj = SQLiteDB(dbpath=conf.syncproject, tuning=ConnectionTuning.from_conf(conf))
+        # 出错(包括 LeaseLost)时也关闭连接, 不留下未结束的读事务
+        stack.callback(tbj.close_db)
+        tbj.migrate()
 
-        conf['syn_lims_time'] = now_str
-        with open(default_config, 'w', encoding='utf-8') as f:
-            yaml.safe_dump(conf, f, allow_unicode=True, sort_keys=False)
+        with metrics.timer('sync.load_known'):
+            known = KnownProjects.load(tbj.conn)
+
+        cache = LimsCache(tbj)
+        with metrics.timer('sync.product_type'):
+            pid_name = cached_product_type(cache, session, ttl=conf.lims_cache_ttl)
+            autoflow_products = cached_autoflow_products(cache, conf.annoevaconf)
+
+        # 同步进度保存在 syncproject.db; 配置文件中的 syn_lims_time 只作为第一次同步的起点
+        state = SyncState(tbj)
+        pre_syn_time = state.get_watermark(LIMS_BILL_SOURCE) or str(conf.syn_lims_time)
+        resume_from = state.resume_point(LIMS_BILL_SOURCE, pre_syn_time)
+        if resume_from:
+            print(f"从上次中断的位置继续同步: info_date >= {resume_from}")
+        run_id = state.start_run(LIMS_BILL_SOURCE, pre_syn_time, now_str, resumed_from=resume_from)
+
+        # 每批任务单依次完成产品类型映射、workdir 查询和写入, 峰值内存与同步窗口大小无关
+        counts = {"inserted": 0, "updated": 0, "skipped": 0, "unmatched": 0}
+        product_type_reloaded = False
+        try:
+            with session.connection('lims3') as conn_bill:
+                chunks = iter_analysis_projects(
+                    conn_bill, resume_from or pre_syn_time,
+                    conf.lims_stream_chunk_size, inclusive=resume_from is not None
+                )
+                with contextlib.closing(chunks):
+                    for n, df_ana_pro in enumerate(chunks):
+                        if lease is not None:
+                            lease.ensure()
+                        last_info_date = df_ana_pro['info_date'].max().strftime('%Y-%m-%d %H:%M:%S')
+                        if not product_type_reloaded and not df_ana_pro['product_ID'].isin(pid_name.index).all():
+                            # 缓存有效期内 lims 可能新增了产品类型; 水位越过这些任务单后不会再同步,
+                            # 丢弃之前本次运行重新加载一次
+                            with metrics.timer('sync.product_type'):
+                                pid_name = cached_product_type(cache, session, refresh=True)
+                            product_type_reloaded = True
+                        chunk_counts = _sync_chunk(df_ana_pro, pid_name, autoflow_products, session, conf, tbj, known)
+                        state.checkpoint(run_id, n, last_info_date, df_ana_pro.shape[0], chunk_counts)
+                        for key in counts:
+                            counts[key] += chunk_counts[key]
+        except BaseException as e:
+            state.finish_run(run_id, 'failed', error=str(e) or type(e).__name__)
+            raise
+        state.finish_run(run_id, 'done')
+        for key, n in counts.items():
+            metrics.count(f'sync.{key}', n)
+        print(f"同步完成: 新增 {counts['inserted']} 个项目, 更新 {counts['updated']} 个项目, 跳过 {counts['skipped']} 个项目, "
+              f"{counts['unmatched']} 个任务单的产品编号没有对应的产品类型")
 
     except Exception as e:
         print(f"Error in lims2evaproDB: {e}")
         raise
+    finally:
+        stack.close()
 
-def add_project2annoeva() -> None:
-    """Add projects to annoeva monitoring system"""
-    try:
-        confpath = importlib.resources.path("evapro.config", "evapro.yaml")
-        with confpath as default_config:
-            conf = _get_yaml_data(default_config)
-        pro_tbj = SQLiteDB(dbpath=f"{conf['syncproject']}")
-        ADuser = conf['ADuser']
-        
-        user = getpass.getuser()
-        if user in ADuser.keys():
-            user = ADuser[user]
-        
-        query = """
-            SELECT 
-                proid, 
-                ptype, 
-                workdir
-            FROM 
-                all_ana_projects 
-            WHERE 
-                `user` = ?
-                AND isadd2annoeva = 'N' 
-                AND workdir != ?
-        """
-        df = read_sql(query, con=pro_tbj.conn, params=(user, ''))
-        for i, row in df.iterrows():
-            try:
-                cmd = f"{conf['annoeva']} addproject -p {row['proid']} -t {row['ptype']} -d {row['workdir']}"
-                p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                stdo, stde = p.communicate()  
-                
-                pro_tbj.update_tb_value_sql(row['proid'], 'isadd2annoeva', 'Y', table='all_ana_projects')
-                # webhook 提醒
-            except Exception as e:
-                print(f"Error adding project {row['proid']}: {str(stde,'utf-8')}")
-                continue
-            
-        pro_tbj.close_db()
-    except Exception as e:
-        print(f"Error in add_project2annoeva: {e}")
-        raise
+def plan_lims2evaproDB(session: Optional[LimsSession] = None, conf: Optional[Config] = None) -> SyncPlan:
+    """Dry run of lims2evaproDB(): the delta the next sync would write.
+
+    Reads the same LIMS window as lims2evaproDB() but writes nothing, neither
+    projects nor sync progress nor cached product types.
+
+    Args:
+        session (LimsSession): Shared LIMS connections, a private one is
+            opened when None
+        conf (Config): Configuration, load_config() when None
+
+    Returns:
+        SyncPlan: New and changed records of the whole window
+
+    Raises:
+        RuntimeError: If syncproject.db has not been migrated to the latest schema
+    """
+    if conf is None:
+        conf = load_config()
+    conf.require(*LIMS_KEYS)
+    with contextlib.ExitStack() as stack:
+        if session is None:
+            session = stack.enter_context(LimsSession(conf))
+        # 只读连接: 不创建目录和数据库文件, 不修改 journal_mode, 也不执行迁移
+        conn_db = connect_readonly(conf.syncproject, ConnectionTuning.from_conf(conf))
+        stack.callback(conn_db.close)
+        version = schema_version(conn_db)
+        if version < LATEST_VERSION:
+            raise RuntimeError(f"syncproject.db is at schema v{version}, run `evapro db migrate` first")
+
+        known = KnownProjects.load(conn_db)
+        with session.connection('cloud_message_info') as conn:
+            pid_name = product_type(conn)
+        autoflow_products = set(_get_yaml_data(conf.annoevaconf)['autoconf'])
+
+        pre_syn_time = read_watermark(conn_db, LIMS_BILL_SOURCE) or str(conf.syn_lims_time)
+        resume_from = read_resume_point(conn_db, LIMS_BILL_SOURCE, pre_syn_time)
+
+        plan = SyncPlan()
+        with session.connection('lims3') as conn_bill:
+            chunks = iter_analysis_projects(
+                conn_bill, resume_from or pre_syn_time,
+                conf.lims_stream_chunk_size, inclusive=resume_from is not None
+            )
+            with contextlib.closing(chunks):
+                for df_ana_pro in chunks:
+                    chunk_plan, _ = _plan_chunk(df_ana_pro, pid_name, autoflow_products, session, conf, known)
+                    # 后面的批次与前面批次的结果比较
+                    known.remember(chunk_plan)
+                    plan = plan.merge(chunk_plan)
+    return plan
@@ -0,0 +1,43 @@
+"""
+Last known state of project workdirs, kept in the workdir_status table of
+syncproject.db so that unreachable paths are not stat'ed on every run.
+"""
+
+from typing import Dict, Iterable, Tuple
+
+from .database import SQLiteDB
+
+class WorkdirStatusStore:
+    """Read and write workdir_status rows.
+
+    Attributes:
+        db (SQLiteDB): Opened syncproject.db, migrated to schema v7 or later
+    """
+
+    def __init__(self, db: SQLiteDB):
+        self.db = db
+
+    def save(self, statuses: Iterable) -> int:
+        """Upsert WorkdirStatus results, return the number of rows written."""
+        rows = [(s.path, int(s.ready), s.error, s.checked_at, s.elapsed) for s in statuses]
+        if not rows:
+            return 0
+        self.db.transaction(lambda cur: cur.executemany("""
+            INSERT INTO workdir_status (path, ready, error, checked_at, elapsed) VALUES (?,?,?,?,?)
+            ON CONFLICT(path) DO UPDATE SET
+                ready = excluded.ready, error = excluded.error,
+                checked_at = excluded.checked_at, elapsed = excluded.elapsed
+        """, rows))
+        return len(rows)
+
+    def recent_failures(self, since: str) -> Dict[str, Tuple[str, str]]:
+        """Workdirs that were not ready when checked at or after since.
+
+        Returns:
+            Dict[str, Tuple[str, str]]: path -> (error, checked_at)
+        """
+        rows = self.db.cur.execute(
+            "SELECT path, error, checked_at FROM workdir_status WHERE ready = 0 AND checked_at >= ?", (since,)
+        ).fetchall()
+        return {path: (error, checked_at) for path, error, checked_at in rows}
+
@@ -0,0 +1,101 @@
+"""Long-lived annoeva registration helper.
+
+Run with annoeva's own interpreter. evapro writes one JSON request per line
+to stdin, ``{"batch": [[proid, ptype, workdir], ...]}``, and reads one JSON
+line per registered project from stdout followed by ``{"done": true}``.
+Only the standard library and annoeva's own click are used, so evapro does
+not need to be installed in annoeva's environment.
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import traceback
+
+PROTOCOL_VERSION = 1
+
+def load_cli():
+    """Load the annoeva click command group from its console script entry point.
+
+    Returns:
+        tuple: (click group, annoeva version)
+
+    Raises:
+        RuntimeError: If annoeva is not installed or its CLI is not compatible
+    """
+    from importlib.metadata import entry_points, version
+
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        eps = list(eps.select(group='console_scripts', name='annoeva'))
+    else:
+        eps = [ep for ep in eps.get('console_scripts', []) if ep.name == 'annoeva']
+    if not eps:
+        raise RuntimeError("annoeva console script not found")
+
+    cli = eps[0].load()
+    commands = getattr(cli, 'commands', None)
+    if not callable(getattr(cli, 'main', None)) or not commands or 'addproject' not in commands:
+        raise RuntimeError("annoeva CLI has no click 'addproject' command")
+    return cli, version('annoeva')
+
+def register(cli, proid: str, ptype: str, workdir: str):
+    """Run `annoeva addproject` inside the current interpreter.
+
+    Returns:
+        tuple: (exit code, captured stdout and stderr)
+    """
+    import click
+
+    out = io.StringIO()
+    returncode = 0
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+        try:
+            # standalone_mode=False 时 ctx.exit(n) 不抛 SystemExit, 退出码作为返回值
+            rv = cli.main(['addproject', '-p', proid, '-t', ptype, '-d', workdir],
+                          prog_name='annoeva', standalone_mode=False)
+            if isinstance(rv, int) and not isinstance(rv, bool) and rv != 0:
+                returncode = rv
+        except click.ClickException as e:
+            e.show()
+            returncode = e.exit_code or 1
+        except click.Abort:
+            print("Aborted!")
+            returncode = 1
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception:
+            traceback.print_exc()
+            returncode = 1
+    return returncode, out.getvalue().strip()
+
+def _send(stream, message: dict) -> None:
+    stream.write(json.dumps(message, ensure_ascii=False) + '\n')
+    stream.flush()
+
+def main() -> int:
+    # 协议只走原始 stdout, annoeva 自身的输出全部转到 stderr
+    proto = os.fdopen(os.dup(1), 'w', encoding='utf-8')
+    os.dup2(2, 1)
+
+    try:
+        cli, annoeva_version = load_cli()
+    except Exception as e:
+        _send(proto, {'ok': False, 'error': str(e)})
+        return 1
+    _send(proto, {'ok': True, 'protocol': PROTOCOL_VERSION, 'version': annoeva_version})
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        for proid, ptype, workdir in request['batch']:
+            returncode, output = register(cli, proid, ptype, workdir)
+            _send(proto, {'proid': proid, 'returncode': returncode, 'stderr': output})
+        _send(proto, {'done': True})
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
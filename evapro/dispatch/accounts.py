@@ -0,0 +1,40 @@
+"""
+Mapping between server accounts and the LIMS analysis users stored in
+all_ana_projects.user.
+
+Most accounts use their LIMS name; ADuser in evapro.yaml lists the ones that
+differ (server account -> LIMS user).
+"""
+
+import getpass
+import shlex
+from typing import Mapping, Optional
+
+from evapro.config.settings import Config
+
+def lims_user(account: str, aduser: Optional[Mapping[str, str]] = None) -> str:
+    """Return the LIMS user of a server account."""
+    return (aduser or {}).get(account, account)
+
+def owner_account(user: str, aduser: Optional[Mapping[str, str]] = None) -> str:
+    """Return the server account owning the projects of a LIMS user."""
+    for account, name in (aduser or {}).items():
+        if name == user:
+            return account
+    return user
+
+def annoeva_command(conf: Config, account: str) -> Optional[str]:
+    """annoeva command line registering projects for account.
+
+    The current account runs annoeva directly. Other accounts need
+    dispatch_command_prefix in evapro.yaml, e.g. ``sudo -n -H -u {account}``,
+    so that the projects land in that account's annoeva database.
+
+    Returns:
+        str: Command line, None if account cannot be served from here
+    """
+    if account == getpass.getuser():
+        return conf.annoeva
+    if not conf.dispatch_command_prefix:
+        return None
+    return f"{conf.dispatch_command_prefix.format(account=shlex.quote(account))} {conf.annoeva}"
@@ -0,0 +1,159 @@
+import json
+import os
+import queue
+import shlex
+import subprocess
+import threading
+import time
+from typing import IO, List, Optional, Sequence, Tuple, cast
+
+from . import _annoeva_helper
+from .runner import DispatchResult
+
+HELPER_PATH = os.path.abspath(_annoeva_helper.__file__)
+
+def annoeva_python(annoeva: str) -> List[str]:
+    """Guess the interpreter command of the annoeva console script.
+
+    The shebang of the script is used when present, otherwise the python
+    next to it in the same bin directory.
+    """
+    script = shlex.split(annoeva)[0]
+    try:
+        with open(script, 'r', encoding='utf-8', errors='replace') as f:
+            first = f.readline().strip()
+        if first.startswith('#!') and 'python' in first:
+            return shlex.split(first[2:])
+    except OSError:
+        pass
+    return [os.path.join(os.path.dirname(script), 'python')]
+
+class InProcessAnnoeva:
+    """Register projects by calling annoeva's CLI inside this interpreter.
+
+    Only works when annoeva is installed in the same environment as evapro.
+    Per-project timeouts cannot be enforced in this mode.
+    """
+
+    def __init__(self):
+        self.cli, self.version = _annoeva_helper.load_cli()
+
+    def register_batch(self, projects: Sequence[Tuple[str, str, str]], timeout: Optional[float] = None,
+                       results: Optional[List[DispatchResult]] = None) -> Tuple[List[DispatchResult], list]:
+        results = [] if results is None else results
+        for proid, ptype, workdir in projects:
+            start = time.monotonic()
+            returncode, output = _annoeva_helper.register(self.cli, proid, ptype, workdir)
+            results.append(DispatchResult(proid, returncode == 0, returncode, output, time.monotonic() - start))
+        return results, []
+
+    def close(self) -> None:
+        pass
+
+class AnnoevaHelper:
+    """One long-lived annoeva helper process speaking JSON lines over stdin/stdout.
+
+    Attributes:
+        python (List[str]): Interpreter command of annoeva's environment
+        proc (subprocess.Popen): Helper process
+        version (str): annoeva version reported by the helper
+    """
+
+    def __init__(self, python: List[str], startup_timeout: float = 120):
+        self.python = python
+        self.proc = subprocess.Popen(
+            python + ['-u', HELPER_PATH],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            text=True, encoding='utf-8'
+        )
+        # 以 PIPE 启动, stdin/stdout 一定存在
+        self._stdin = cast(IO[str], self.proc.stdin)
+        self._stdout = cast(IO[str], self.proc.stdout)
+        self._lines: queue.Queue = queue.Queue()
+        threading.Thread(target=self._reader, daemon=True).start()
+
+        hello = self._read(startup_timeout)
+        if not hello or not hello.get('ok') or hello.get('protocol') != _annoeva_helper.PROTOCOL_VERSION:
+            self.close()
+            raise RuntimeError((hello or {}).get('error', 'annoeva helper did not start'))
+        self.version = hello['version']
+
+    def _reader(self) -> None:
+        for line in self._stdout:
+            self._lines.put(line)
+        self._lines.put(None)
+
+    def _read(self, timeout: Optional[float]) -> Optional[dict]:
+        """Read one message, None on timeout or when the helper exited."""
+        try:
+            line = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return json.loads(line) if line else None
+
+    def register_batch(self, projects: Sequence[Tuple[str, str, str]], timeout: Optional[float] = None,
+                       results: Optional[List[DispatchResult]] = None) -> Tuple[List[DispatchResult], list]:
+        """Register a batch of projects with one request.
+
+        Args:
+            projects: (proid, ptype, workdir) tuples
+            timeout (float): Seconds to wait for each project
+            results (list): Results are appended here as they arrive
+
+        Returns:
+            tuple: (results, projects left unprocessed because the helper
+            timed out or died)
+        """
+        projects = list(projects)
+        results = [] if results is None else results
+        self._stdin.write(json.dumps({'batch': projects}, ensure_ascii=False) + '\n')
+        self._stdin.flush()
+
+        start = time.monotonic()
+        for i, (proid, ptype, workdir) in enumerate(projects):
+            msg = self._read(timeout)
+            if msg is None:
+                # 超时或进程退出: 当前项目记为失败, 剩余项目交给调用方处理
+                reason = f"timeout after {timeout}s" if self.proc.poll() is None else "annoeva helper exited"
+                results.append(DispatchResult(proid, False, None, reason, time.monotonic() - start))
+                self.proc.kill()
+                self.proc.wait()
+                return results, projects[i + 1:]
+            results.append(DispatchResult(proid, msg['returncode'] == 0, msg['returncode'], msg['stderr'], time.monotonic() - start))
+            start = time.monotonic()
+        self._read(timeout)
+        return results, []
+
+    def close(self) -> None:
+        if self.proc.poll() is None:
+            try:
+                self._stdin.close()
+                self.proc.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                self.proc.kill()
+                self.proc.wait()
+
+def open_bridge(annoeva: str, mode: str, python: Optional[str] = None):
+    """Open an annoeva integration for the given mode.
+
+    Args:
+        annoeva (str): annoeva program path
+        mode (str): inprocess, helper or auto (inprocess, then helper)
+        python (str): Interpreter of annoeva's environment for the helper,
+            guessed from the annoeva script when None
+
+    Returns:
+        InProcessAnnoeva or AnnoevaHelper, None if annoeva is not compatible
+    """
+    if mode in ('inprocess', 'auto'):
+        try:
+            return InProcessAnnoeva()
+        except Exception as e:
+            if mode == 'inprocess':
+                print(f"annoeva 无法在当前进程加载, 改用 subprocess 方式: {e}")
+                return None
+    try:
+        return AnnoevaHelper(shlex.split(python) if python else annoeva_python(annoeva))
+    except Exception as e:
+        print(f"annoeva helper 启动失败, 改用 subprocess 方式: {e}")
+        return None
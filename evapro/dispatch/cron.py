@@ -0,0 +1,285 @@
+"""
+Cron path: add pending projects to annoeva, for the current user or, with
+`evapro cron --all-users`, for every user in one run.
+
+This module is imported by `evapro cron` on every tick, so it must not
+import pandas or pymysql.
+"""
+
+import datetime
+import getpass
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from evapro.config.settings import Config, load_config
+from evapro.db import SQLiteDB
+from evapro.db.connection import ConnectionTuning
+from evapro import metrics
+from .accounts import annoeva_command, lims_user, owner_account
+from .probe import ready_projects
+from .runner import DispatchResult, dispatch_projects
+
+# 所有用户待添加的项目, 一次查询按用户分组
+PENDING_ALL_SQL = """
+    SELECT user, proid, ptype, workdir
+    FROM all_ana_projects
+    WHERE isadd2annoeva = 'N' AND workdir != '' AND user IS NOT NULL
+"""
+
+@dataclass
+class UserDispatch:
+    """Outcome of dispatching the pending projects of one account.
+
+    Attributes:
+        account (str): Server account annoeva ran as
+        user (str): LIMS user of the projects
+        projects (List[Tuple[str, str, str]]): (proid, ptype, workdir) to register
+        results (List[DispatchResult]): One result per dispatched project
+        error (str): Why the account was not served, None otherwise
+        elapsed (float): Wall time in seconds
+    """
+    account: str
+    user: str
+    projects: List[Tuple[str, str, str]] = field(default_factory=list)
+    results: List[DispatchResult] = field(default_factory=list)
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+    @property
+    def added(self) -> int:
+        return sum(res.ok for res in self.results)
+
+    @property
+    def failed(self) -> int:
+        return len(self.results) - self.added
+
+def add_project2annoeva(jobs: Optional[int] = None, conf: Optional[Config] = None) -> None:
+    """Add projects to annoeva monitoring system
+
+    Args:
+        jobs (int): Maximum number of concurrent annoeva processes,
+            defaults to annoeva_jobs in evapro.yaml
+        conf (Config): Configuration, load_config() when None
+    """
+    try:
+        if conf is None:
+            conf = load_config()
+        pro_tbj = SQLiteDB(dbpath=conf.syncproject, tuning=ConnectionTuning.from_conf(conf))
+        pro_tbj.migrate()
+        user = lims_user(getpass.getuser(), conf.ADuser)
+        
+        query = """
+            SELECT 
+                proid, 
+                ptype, 
+                workdir
+            FROM 
+                all_ana_projects 
+            WHERE 
+                `user` = ?
+                AND isadd2annoeva = 'N' 
+                AND workdir != ?
+        """
+        projects = [
+            (row['proid'], row['ptype'], row['workdir'])
+            for row in pro_tbj.iter_rows(query, (user, ''))
+        ]
+        # workdir 不存在或存储挂起的项目这次不添加
+        projects, not_ready = ready_projects(pro_tbj, conf, projects)
+        report_not_ready(not_ready)
+        # 其他 cron/daemon 已认领的项目由它们添加
+        projects = claim_projects(pro_tbj, conf, projects)
+        if not projects:
+            metrics.noop()
+        results: List[DispatchResult] = []
+        try:
+            with metrics.timer('cron.dispatch'):
+                dispatch_projects(
+                    conf.annoeva, projects,
+                    jobs=jobs or conf.annoeva_jobs,
+                    timeout=conf.annoeva_timeout,
+                    mode=conf.annoeva_mode,
+                    python=conf.annoeva_python,
+                    results=results
+                )
+        finally:
+            # 中途出错时, 已经添加成功的项目也要标记, 否则下次会重复添加
+            # webhook 提醒
+            with metrics.timer('cron.mark_added'):
+                finish_claims(pro_tbj, projects, results)
+        for res in results:
+            metrics.observe('annoeva.addproject', res.elapsed)
+            metrics.count('cron.added' if res.ok else 'cron.failed')
+            if not res.ok:
+                print(f"Error adding project {res.proid} (exit code {res.returncode}): {res.stderr}")
+            
+        pro_tbj.close_db()
+    except Exception as e:
+        print(f"Error in add_project2annoeva: {e}")
+        raise
+
+def pending_by_account(db: SQLiteDB, aduser: Optional[dict] = None) -> Dict[str, UserDispatch]:
+    """Group all pending projects by owner account with a single query."""
+    groups: Dict[str, UserDispatch] = {}
+    for row in db.iter_rows(PENDING_ALL_SQL):
+        account = owner_account(row['user'], aduser)
+        group = groups.setdefault(account, UserDispatch(account, row['user']))
+        group.projects.append((row['proid'], row['ptype'], row['workdir']))
+    return groups
+
+def claim_projects(db: SQLiteDB, conf: Config, projects: List[Tuple[str, str, str]]) -> List[Tuple[str, str, str]]:
+    """Claim projects for this run, see SQLiteDB.claim_projects().
+
+    Claims older than dispatch_claim_ttl are given back first.
+
+    Returns:
+        List[Tuple[str, str, str]]: The projects claimed by this run
+    """
+    released = db.release_stale_claims(conf.dispatch_claim_ttl)
+    if released:
+        print(f"{released} 个项目的认领已超过 {conf.dispatch_claim_ttl:g} 秒, 重新变为待添加")
+    claimed = set(db.claim_projects(proid for proid, _, _ in projects))
+    return [p for p in projects if p[0] in claimed]
+
+def finish_claims(db: SQLiteDB, projects: List[Tuple[str, str, str]], results: List[DispatchResult]) -> None:
+    """Mark the successful projects added and give the other claimed ones back."""
+    added = {res.proid for res in results if res.ok}
+    db.finish_claims(added, [proid for proid, _, _ in projects if proid not in added])
+
+def report_not_ready(not_ready: List[tuple]) -> None:
+    """Print the projects left out by ready_projects()."""
+    for (proid, _, workdir), status in not_ready:
+        print(f"跳过项目 {proid}: workdir 不可用 {workdir} ({status.error})")
+
+def ready_groups(db: SQLiteDB, conf: Config, groups: Dict[str, UserDispatch]) -> Tuple[Dict[str, UserDispatch], List[str]]:
+    """Drop the projects whose workdir is not ready, with one probe for all accounts.
+
+    Returns:
+        Tuple: Accounts that still have projects, and the proids left out
+    """
+    ready, not_ready = ready_projects(db, conf, [p for group in groups.values() for p in group.projects])
+    report_not_ready(not_ready)
+    ready_set = set(ready)
+    for group in groups.values():
+        group.projects = [p for p in group.projects if p in ready_set]
+    return ({account: group for account, group in groups.items() if group.projects},
+            [proid for (proid, _, _), _ in not_ready])
+
+def _dispatch_account(conf: Config, group: UserDispatch, jobs: int) -> UserDispatch:
+    start = time.monotonic()
+    annoeva = annoeva_command(conf, group.account)
+    if annoeva is None:
+        group.error = "dispatch_command_prefix is not set"
+        return group
+    # 以其他账户身份运行 annoeva 时只能逐个启动进程
+    mode = conf.annoeva_mode if annoeva == conf.annoeva else 'subprocess'
+    try:
+        # 出错时 group.results 保留已完成的项目, 由调用方标记
+        dispatch_projects(
+            annoeva, group.projects, jobs=jobs,
+            timeout=conf.annoeva_timeout, mode=mode,
+            python=conf.annoeva_python, results=group.results
+        )
+    except Exception as e:
+        group.error = str(e) or type(e).__name__
+    group.elapsed = time.monotonic() - start
+    return group
+
+def dispatch_accounts(conf: Config, db: SQLiteDB, groups: Dict[str, UserDispatch], jobs: int = 1,
+                      workers: int = 4, metric: str = 'cron') -> List[UserDispatch]:
+    """Register the pending projects of several accounts.
+
+    The projects are claimed in db first, projects another dispatcher has
+    claimed are left out. At most workers accounts are served at the same
+    time, each with up to jobs annoeva processes. Successful projects are
+    marked in db as soon as their account is done, and one dispatch_log row
+    is written per account.
+
+    Args:
+        conf (Config): Configuration
+        db (SQLiteDB): Opened syncproject.db
+        groups: Pending projects per account, see pending_by_account()
+        jobs (int): Maximum number of concurrent annoeva processes per account
+        workers (int): Maximum number of accounts served at the same time
+        metric (str): Prefix of the recorded metrics
+
+    Returns:
+        List[UserDispatch]: One outcome per account, sorted by account
+    """
+    outcomes: List[UserDispatch] = []
+    # 其他 cron/daemon 已认领的项目由它们添加
+    for group in groups.values():
+        group.projects = claim_projects(db, conf, group.projects)
+    groups = {account: group for account, group in groups.items() if group.projects}
+    if not groups:
+        metrics.noop()
+        return outcomes
+    unfinished = dict(groups)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(groups)))) as pool:
+            futures = [pool.submit(_dispatch_account, conf, group, jobs) for group in groups.values()]
+            # sqlite 连接只在当前线程使用
+            for future in as_completed(futures):
+                group = future.result()
+                for res in group.results:
+                    metrics.observe('annoeva.addproject', res.elapsed)
+                    if not res.ok:
+                        print(f"Error adding project {res.proid} for {group.account} (exit code {res.returncode}): {res.stderr}")
+                metrics.count(f'{metric}.added', group.added)
+                metrics.count(f'{metric}.failed', group.failed)
+                finish_claims(db, group.projects, group.results)
+                del unfinished[group.account]
+                outcomes.append(group)
+    finally:
+        # 中途出错时其余账户的认领也要交还
+        for group in unfinished.values():
+            finish_claims(db, group.projects, group.results)
+
+    outcomes.sort(key=lambda group: group.account)
+    record_dispatch(db, outcomes)
+    return outcomes
+
+def record_dispatch(db: SQLiteDB, outcomes: List[UserDispatch]) -> None:
+    """Write one dispatch_log row per account."""
+    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    host = socket.gethostname()
+    db.transaction(lambda cur: cur.executemany(
+        "INSERT INTO dispatch_log (run_at, host, account, user, pending, added, failed, elapsed, error) "
+        "VALUES (?,?,?,?,?,?,?,?,?)",
+        [(now, host, o.account, o.user, len(o.projects), o.added, o.failed, o.elapsed, o.error) for o in outcomes]
+    ))
+
+def add_projects_all_users(jobs: Optional[int] = None, workers: Optional[int] = None, conf: Optional[Config] = None) -> List[UserDispatch]:
+    """Add the pending projects of every user to their annoeva.
+
+    Meant for one admin crontab entry instead of one per user. Accounts other
+    than the current one need dispatch_command_prefix in evapro.yaml.
+
+    Args:
+        jobs (int): Maximum number of concurrent annoeva processes per account,
+            defaults to annoeva_jobs in evapro.yaml
+        workers (int): Maximum number of accounts served at the same time,
+            defaults to cron_user_workers in evapro.yaml
+        conf (Config): Configuration, load_config() when None
+
+    Returns:
+        List[UserDispatch]: One outcome per account with pending projects
+    """
+    if conf is None:
+        conf = load_config()
+    pro_tbj = SQLiteDB(dbpath=conf.syncproject, tuning=ConnectionTuning.from_conf(conf))
+    try:
+        pro_tbj.migrate()
+        with metrics.timer('cron.pending_query'):
+            groups = pending_by_account(pro_tbj, conf.ADuser)
+        groups, _ = ready_groups(pro_tbj, conf, groups)
+        with metrics.timer('cron.dispatch'):
+            return dispatch_accounts(
+                conf, pro_tbj, groups,
+                jobs=jobs or conf.annoeva_jobs,
+                workers=workers or conf.cron_user_workers
+            )
+    finally:
+        pro_tbj.close_db()
@@ -0,0 +1,172 @@
+"""
+`evapro daemon`: one long-running dispatcher per node instead of an
+`evapro cron` crontab entry for every user.
+
+The daemon polls ``PRAGMA data_version`` of syncproject.db, which changes
+whenever another connection (evapro lims2evapro, an admin fix ...) commits.
+Only then it looks for pending projects (isadd2annoeva = 'N' with a workdir)
+and registers them to the annoeva of their owner right away. Projects that
+annoeva refused are retried after daemon_retry_delay seconds.
+
+A lock file keeps one daemon per node and account. Daemons on other nodes
+and any `evapro cron` still installed claim projects in syncproject.db
+before registering them (see SQLiteDB.claim_projects()), so every project
+is registered once; the daemon is still meant to replace the per-user cron.
+"""
+
+import asyncio
+import fcntl
+import getpass
+import os
+import signal
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from evapro import metrics
+from evapro.config.settings import Config
+from evapro.db import SQLiteDB
+from evapro.db.connection import ConnectionTuning
+from .accounts import annoeva_command
+from .cron import UserDispatch, dispatch_accounts, pending_by_account, ready_groups
+
+def daemon_lock_path() -> str:
+    """Per node and account lock file, /tmp is local to every node."""
+    return os.path.join(tempfile.gettempdir(), f"evapro-daemon-{getpass.getuser()}.lock")
+
+@dataclass
+class DispatchDaemon:
+    """Register pending projects as soon as syncproject.db changes.
+
+    Attributes:
+        conf (Config): Configuration, reloaded when evapro.yaml changes
+        poll_interval (float): Seconds between two data_version checks
+        rescan_interval (float): Seconds after which pending projects are
+            looked up even if the database did not change
+        retry_delay (float): Seconds before a refused project is retried
+        jobs (int): Maximum number of concurrent annoeva processes per account
+        workers (int): Maximum number of accounts served at the same time
+    """
+    conf: Config
+    poll_interval: float = 2.0
+    rescan_interval: float = 600.0
+    retry_delay: float = 1800.0
+    jobs: Optional[int] = None
+    workers: Optional[int] = None
+    db: SQLiteDB = field(init=False)
+    _retry_after: Dict[str, float] = field(init=False, default_factory=dict)
+    _skipped_accounts: set = field(init=False, default_factory=set)
+
+    def __post_init__(self):
+        self.db = SQLiteDB(dbpath=self.conf.syncproject, tuning=ConnectionTuning.from_conf(self.conf))
+        self.db.migrate()
+
+    def data_version(self) -> int:
+        return self.db.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def pending(self) -> Dict[str, UserDispatch]:
+        """Pending projects with a ready workdir of the accounts this daemon can serve,
+        without those waiting for a retry."""
+        now = time.monotonic()
+        by_account = pending_by_account(self.db, self.conf.ADuser)
+        # 已添加、不再待添加或已到重试时间的项目不再记录, 常驻进程中不会无限增长
+        pending_proids = {p[0] for group in by_account.values() for p in group.projects}
+        self._retry_after = {proid: retry_at for proid, retry_at in self._retry_after.items()
+                             if retry_at > now and proid in pending_proids}
+        groups = {}
+        for account, group in by_account.items():
+            group.projects = [p for p in group.projects if p[0] not in self._retry_after]
+            if not group.projects:
+                continue
+            if annoeva_command(self.conf, account) is not None:
+                groups[account] = group
+            elif account not in self._skipped_accounts:
+                print(f"跳过 {account} 的 {len(group.projects)} 个项目: 需要在 evapro.yaml 中设置 dispatch_command_prefix")
+                self._skipped_accounts.add(account)
+        if groups:
+            # workdir 不可用的项目等 workdir_retry_interval 之后再检查
+            groups, not_ready = ready_groups(self.db, self.conf, groups)
+            retry_at = now + self.conf.workdir_retry_interval
+            self._retry_after.update((proid, retry_at) for proid in not_ready)
+        return groups
+
+    def dispatch_pending(self) -> List[UserDispatch]:
+        """Register all pending projects once and mark the successful ones."""
+        # 配置文件修改后(例如新增 ADuser 映射)无需重启
+        self.conf = self.conf.reload()
+        groups = self.pending()
+        if not groups:
+            return []
+
+        with metrics.run('daemon', self.conf):
+            with metrics.timer('daemon.dispatch'):
+                outcomes = dispatch_accounts(self.conf, self.db, groups, jobs=self.jobs or self.conf.annoeva_jobs,
+                                             workers=self.workers or self.conf.cron_user_workers, metric='daemon')
+        retry_at = time.monotonic() + self.retry_delay
+        for outcome in outcomes:
+            if outcome.error:
+                print(f"Error adding projects for {outcome.account}: {outcome.error}")
+                self._retry_after.update((proid, retry_at) for proid, _, _ in outcome.projects)
+            for res in outcome.results:
+                if not res.ok:
+                    self._retry_after[res.proid] = retry_at
+            if outcome.added:
+                print(f"{outcome.account}: 已添加 {outcome.added} 个项目到 annoeva")
+        return outcomes
+
+    async def run(self, stop: asyncio.Event) -> None:
+        """Watch the database until stop is set."""
+        loop = asyncio.get_event_loop()
+        last_version = None
+        last_scan = float('-inf')
+        while not stop.is_set():
+            version = self.data_version()
+            if version != last_version or time.monotonic() - last_scan >= self.rescan_interval:
+                last_version, last_scan = version, time.monotonic()
+                try:
+                    await loop.run_in_executor(None, self.dispatch_pending)
+                except Exception as e:
+                    print(f"Error in evapro daemon: {e}")
+            try:
+                await asyncio.wait_for(stop.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def close(self) -> None:
+        self.db.close_db()
+
+def serve(conf: Config, jobs: Optional[int] = None) -> bool:
+    """Run the daemon in the foreground until SIGINT or SIGTERM.
+
+    Returns:
+        bool: False if another daemon of this account already runs on this node
+    """
+    lock = open(daemon_lock_path(), 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+
+    daemon = DispatchDaemon(
+        conf,
+        poll_interval=conf.daemon_poll_interval,
+        rescan_interval=conf.daemon_rescan_interval,
+        retry_delay=conf.daemon_retry_delay,
+        jobs=jobs,
+    )
+
+    async def main():
+        stop = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await daemon.run(stop)
+
+    try:
+        asyncio.run(main())
+    finally:
+        daemon.close()
+        lock.close()
+    return True
@@ -0,0 +1,199 @@
+"""
+Workdir readiness probe run before projects are sent to annoeva.
+
+Every candidate workdir is stat'ed concurrently with its own timeout, so a
+hung Lustre/NFS mount costs at most a few seconds instead of one annoeva
+process per project. Results are kept in the workdir_status table of
+syncproject.db; a workdir that failed is not checked again before
+workdir_retry_interval seconds have passed. A workdir the running account
+may not stat (another user's private tree, seen by cron --all-users and the
+daemon) counts as ready and is not cached; the annoeva call run as its owner
+decides.
+"""
+
+import datetime
+import os
+import queue
+import stat
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from evapro import metrics
+from evapro.config.settings import Config
+from evapro.db import SQLiteDB
+from evapro.db.workdirstatus import WorkdirStatusStore
+
+@dataclass
+class WorkdirStatus:
+    """Result of checking one workdir.
+
+    Attributes:
+        path (str): Work directory
+        ready (bool): True if the path is a reachable directory
+        error (str): Why the workdir is not ready, None otherwise
+        checked_at (str): Local time of the check
+        elapsed (float): Seconds the stat took
+        cached (bool): True if taken from workdir_status instead of stat'ed now
+        checked (bool): False if the running account had no permission to stat it
+    """
+    path: str
+    ready: bool
+    error: Optional[str] = None
+    checked_at: str = ''
+    elapsed: float = 0.0
+    cached: bool = False
+    checked: bool = True
+
+def _now() -> str:
+    return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def stat_workdir(path: str) -> WorkdirStatus:
+    """stat one workdir, never raises."""
+    start = time.monotonic()
+    try:
+        if not stat.S_ISDIR(os.stat(path).st_mode):
+            error = "not a directory"
+        else:
+            error = None
+    except FileNotFoundError:
+        error = "no such directory"
+    except PermissionError:
+        # 其他账户的目录, 由以项目所属账户运行的 annoeva 判断
+        return WorkdirStatus(path, True, None, _now(), time.monotonic() - start, checked=False)
+    except OSError as e:
+        error = e.strerror or type(e).__name__
+    return WorkdirStatus(path, error is None, error, _now(), time.monotonic() - start)
+
+def probe_workdirs(paths: Iterable[str], timeout: float = 5.0, workers: int = 16) -> Dict[str, WorkdirStatus]:
+    """stat workdirs concurrently, each with its own timeout.
+
+    A stat stuck on a hung mount cannot be interrupted, so the probe runs in
+    daemon threads and simply stops waiting for it. Each stuck thread is
+    replaced to keep the others going; after workers stuck threads the
+    remaining paths are reported as not checked.
+
+    Args:
+        paths: Work directories to check
+        timeout (float): Seconds to wait for one stat
+        workers (int): Number of concurrent stat calls
+
+    Returns:
+        Dict[str, WorkdirStatus]: Status per path
+    """
+    paths = list(dict.fromkeys(paths))
+    results: Dict[str, WorkdirStatus] = {}
+    if not paths:
+        return results
+
+    todo: "queue.Queue[str]" = queue.Queue()
+    done: "queue.Queue[WorkdirStatus]" = queue.Queue()
+    for path in paths:
+        todo.put(path)
+    started: Dict[str, float] = {}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                path = todo.get_nowait()
+            except queue.Empty:
+                return
+            with lock:
+                started[path] = time.monotonic()
+            done.put(stat_workdir(path))
+
+    def spawn():
+        threading.Thread(target=worker, name='evapro-probe', daemon=True).start()
+
+    for _ in range(max(1, min(workers, len(paths)))):
+        spawn()
+
+    hung = 0
+    poll = min(timeout, 0.1)
+    last_check = time.monotonic()
+    while len(results) < len(paths):
+        try:
+            status = done.get(timeout=poll)
+            # 超时后才返回的结果不再采用
+            results.setdefault(status.path, status)
+        except queue.Empty:
+            pass
+        now = time.monotonic()
+        if now - last_check < poll:
+            continue
+        last_check = now
+        with lock:
+            expired = [p for p, t in started.items() if p not in results and now - t >= timeout]
+        for path in expired:
+            results[path] = WorkdirStatus(path, False, f"stat timed out after {timeout:g}s", _now(), now - started[path])
+            hung += 1
+            if hung <= workers:
+                spawn()
+        if hung > workers:
+            # 挂起的线程太多, 多半整个存储不可用, 剩下的路径不再检查
+            while True:
+                try:
+                    path = todo.get_nowait()
+                except queue.Empty:
+                    break
+                results[path] = WorkdirStatus(path, False, "not checked, too many hung stat calls", _now())
+            with lock:
+                pending = [p for p in started if p not in results]
+            if not pending:
+                break
+    return results
+
+def check_workdirs(db: SQLiteDB, conf: Config, paths: Iterable[str]) -> Dict[str, WorkdirStatus]:
+    """Status of workdirs, skipping the ones that failed recently.
+
+    Args:
+        db (SQLiteDB): Opened syncproject.db, migrated to schema v7 or later
+        conf (Config): Configuration with the workdir_probe_* settings
+        paths: Work directories to check
+
+    Returns:
+        Dict[str, WorkdirStatus]: Status per path
+    """
+    paths = list(dict.fromkeys(paths))
+    store = WorkdirStatusStore(db)
+    cutoff = (datetime.datetime.now() - datetime.timedelta(seconds=conf.workdir_retry_interval)).strftime('%Y-%m-%d %H:%M:%S')
+    failed = store.recent_failures(cutoff)
+
+    statuses = {}
+    for path in paths:
+        if path in failed:
+            error, checked_at = failed[path]
+            statuses[path] = WorkdirStatus(path, False, error, checked_at, cached=True)
+    with metrics.timer('probe.workdirs'):
+        probed = probe_workdirs([p for p in paths if p not in statuses],
+                                timeout=conf.workdir_probe_timeout, workers=conf.workdir_probe_workers)
+    for status in probed.values():
+        metrics.observe('probe.stat', status.elapsed)
+    unchecked = [status for status in probed.values() if not status.checked]
+    metrics.count('probe.checked', len(probed) - len(unchecked))
+    metrics.count('probe.unchecked', len(unchecked))
+    metrics.count('probe.cached', len(statuses))
+    store.save(status for status in probed.values() if status.checked)
+    statuses.update(probed)
+    return statuses
+
+def ready_projects(db: SQLiteDB, conf: Config, projects: Iterable[Tuple[str, str, str]]
+                   ) -> Tuple[List[Tuple[str, str, str]], List[Tuple[Tuple[str, str, str], WorkdirStatus]]]:
+    """Split (proid, ptype, workdir) tuples by whether their workdir is ready.
+
+    Returns:
+        Tuple: Ready projects, and (project, status) of the others
+    """
+    projects = list(projects)
+    statuses = check_workdirs(db, conf, [workdir for _, _, workdir in projects])
+    ready, not_ready = [], []
+    for project in projects:
+        status = statuses[project[2]]
+        if status.ready:
+            ready.append(project)
+        else:
+            not_ready.append((project, status))
+    metrics.count('probe.not_ready', len(not_ready))
+    return ready, not_ready
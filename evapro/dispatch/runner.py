@@ -0,0 +1,104 @@
+import shlex
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+@dataclass
+class DispatchResult:
+    """Outcome of one `annoeva addproject` call.
+
+    Attributes:
+        proid (str): Project ID
+        ok (bool): True if annoeva exited with code 0
+        returncode (int): annoeva exit code, None if it did not finish
+        stderr (str): annoeva stderr or the reason of the failure
+        elapsed (float): Wall time in seconds
+    """
+    proid: str
+    ok: bool
+    returncode: Optional[int] = None
+    stderr: str = ''
+    elapsed: float = 0.0
+
+def addproject_cmd(annoeva: str, proid: str, ptype: str, workdir: str) -> List[str]:
+    """Build the `annoeva addproject` argument list for one project."""
+    return shlex.split(annoeva) + ['addproject', '-p', proid, '-t', ptype, '-d', workdir]
+
+def run_addproject(annoeva: str, proid: str, ptype: str, workdir: str, timeout: Optional[float] = None) -> DispatchResult:
+    """Register one project to annoeva and check its exit code.
+
+    Args:
+        annoeva (str): annoeva program path
+        proid (str): Project ID
+        ptype (str): Project type
+        workdir (str): Work directory path
+        timeout (float): Seconds to wait before killing annoeva, None waits forever
+
+    Returns:
+        DispatchResult: Result of the call, never raises
+    """
+    start = time.monotonic()
+    try:
+        p = subprocess.run(
+            addproject_cmd(annoeva, proid, ptype, workdir),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        return DispatchResult(proid, False, None, f"timeout after {timeout}s", time.monotonic() - start)
+    except OSError as e:
+        return DispatchResult(proid, False, None, str(e), time.monotonic() - start)
+
+    return DispatchResult(
+        proid, p.returncode == 0, p.returncode,
+        str(p.stderr, 'utf-8', errors='replace').strip(), time.monotonic() - start
+    )
+
+def dispatch_projects(annoeva: str, projects: Iterable[Tuple[str, str, str]], jobs: int = 1,
+                      timeout: Optional[float] = None, mode: str = 'subprocess', python: Optional[str] = None,
+                      results: Optional[List[DispatchResult]] = None) -> List[DispatchResult]:
+    """Register projects to annoeva.
+
+    In subprocess mode every project gets its own `annoeva addproject`
+    process, at most jobs at a time. The inprocess, helper and auto modes
+    load annoeva once and register the whole batch through it; projects it
+    could not handle fall back to the subprocess path.
+
+    Args:
+        annoeva (str): annoeva program path
+        projects: Iterable of (proid, ptype, workdir) tuples
+        jobs (int): Maximum number of concurrent annoeva processes
+        timeout (float): Per project timeout in seconds
+        mode (str): subprocess, inprocess, helper or auto
+        python (str): Interpreter of annoeva's environment for the helper mode
+        results (list): Results are appended here as the projects finish, so
+            the caller still has those of the finished projects when an
+            error interrupts the batch
+
+    Returns:
+        List[DispatchResult]: One result per project, in input order
+    """
+    results = [] if results is None else results
+    projects = list(projects)
+    if not projects:
+        return results
+
+    if mode != 'subprocess':
+        from .bridge import open_bridge
+        bridge = open_bridge(annoeva, mode, python)
+        if bridge is not None:
+            try:
+                _, projects = bridge.register_batch(projects, timeout, results)
+            finally:
+                bridge.close()
+            return dispatch_projects(annoeva, projects, jobs, timeout, results=results)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(projects)))) as pool:
+        futures = [
+            pool.submit(run_addproject, annoeva, proid, ptype, workdir, timeout)
+            for proid, ptype, workdir in projects
+        ]
+        for f in futures:
+            results.append(f.result())
+    return results
@@ -0,0 +1,298 @@
+"""
+Lightweight run instrumentation: stage timers, row counters and latency histograms.
+
+Code under measurement records into the active RunMetrics through the
+module-level helpers::
+
+    with metrics.timer('sync.transform'):
+        ...
+    metrics.count('sync.bills', len(df))
+    metrics.observe('lims.bill_fetch', seconds)
+
+`evapro lims2evapro` and `evapro cron` wrap their work in `metrics.run()`,
+which stores the collected numbers in the run_metrics table of
+syncproject.db and, when metrics_textfile_dir is set in evapro.yaml, in a
+Prometheus textfile-collector file. Outside of a run the helpers record into
+a throwaway collector, so library callers only pay for a dict update.
+"""
+
+import bisect
+import contextlib
+import datetime
+import os
+import socket
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    from evapro.config.settings import Config
+
+# 延迟直方图的桶上界(秒), 最后还有一个 +Inf 桶
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 每保存这么多次运行清理一次 run_metrics 中的旧记录
+PRUNE_EVERY = 50
+
+@dataclass
+class Histogram:
+    """Latency histogram with fixed buckets.
+
+    Attributes:
+        counts (List[int]): Observations per bucket, the last one is +Inf
+        total (float): Sum of all observations in seconds
+        max (float): Largest observation in seconds
+    """
+    counts: List[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+    total: float = 0.0
+    max: float = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: "Histogram") -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q quantile, max for the +Inf bucket."""
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS, self.counts):
+            seen += n
+            if n and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+@dataclass
+class RunMetrics:
+    """Numbers collected during one evapro command.
+
+    Attributes:
+        command (str): Subcommand name, e.g. lims2evapro or cron
+        started_at (str): Local start time
+        finished_at (str): Local end time, None while running
+        duration (float): Wall time in seconds
+        status (str): running, done or failed
+        error (str): Error message of a failed run
+        host (str): Host the command ran on
+        timers (Dict[str, float]): Seconds spent per stage
+        calls (Dict[str, int]): Number of times each stage ran
+        counters (Dict[str, int]): Row and item counts
+        histograms (Dict[str, Histogram]): Latency per query or call type
+        noop (bool): The run found nothing to do, it is not stored in run_metrics
+    """
+    command: str = ''
+    started_at: str = field(default_factory=lambda: datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    finished_at: Optional[str] = None
+    duration: float = 0.0
+    status: str = 'running'
+    error: Optional[str] = None
+    host: str = field(default_factory=socket.gethostname)
+    timers: Dict[str, float] = field(default_factory=dict)
+    calls: Dict[str, int] = field(default_factory=dict)
+    counters: Dict[str, int] = field(default_factory=dict)
+    histograms: Dict[str, Histogram] = field(default_factory=dict)
+    noop: bool = False
+    _start: float = field(default_factory=time.monotonic, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.timers[name] = self.timers.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.histograms.setdefault(name, Histogram()).observe(seconds)
+
+    def finish(self, status: str = 'done', error: Optional[str] = None) -> None:
+        self.duration = time.monotonic() - self._start
+        self.finished_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.status = status
+        self.error = error
+
+    def to_dict(self) -> dict:
+        return {
+            'timers': self.timers, 'calls': self.calls, 'counters': self.counters,
+            'histograms': {name: {'counts': h.counts, 'total': h.total, 'max': h.max}
+                           for name, h in self.histograms.items()},
+        }
+
+    def load_dict(self, data: dict) -> "RunMetrics":
+        self.timers = dict(data.get('timers', {}))
+        self.calls = dict(data.get('calls', {}))
+        self.counters = dict(data.get('counters', {}))
+        self.histograms = {name: Histogram(list(h['counts']), h['total'], h['max'])
+                           for name, h in data.get('histograms', {}).items()
+                           if len(h['counts']) == len(LATENCY_BUCKETS) + 1}
+        return self
+
+def summarize(runs: List[RunMetrics]) -> dict:
+    """Aggregate several runs of the same command.
+
+    Returns:
+        dict: timers -> {stage: (mean, max) seconds}, counters -> {name: total},
+        histograms -> {name: merged Histogram}
+    """
+    timers: Dict[str, List[float]] = {}
+    counters: Dict[str, int] = {}
+    histograms: Dict[str, Histogram] = {}
+    for m in runs:
+        for name, seconds in m.timers.items():
+            timers.setdefault(name, []).append(seconds)
+        for name, n in m.counters.items():
+            counters[name] = counters.get(name, 0) + n
+        for name, h in m.histograms.items():
+            histograms.setdefault(name, Histogram()).merge(h)
+    return {
+        'timers': {name: (sum(v) / len(v), max(v)) for name, v in timers.items()},
+        'counters': counters,
+        'histograms': histograms,
+    }
+
+_current = RunMetrics()
+
+def current() -> RunMetrics:
+    """Return the RunMetrics the helpers record into."""
+    return _current
+
+@contextlib.contextmanager
+def timer(name: str) -> Iterator[None]:
+    """Add the wall time of the with block to the stage name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current.add_time(name, time.perf_counter() - start)
+
+def count(name: str, n: int = 1) -> None:
+    _current.count(name, n)
+
+def observe(name: str, seconds: float) -> None:
+    _current.observe(name, seconds)
+
+def noop() -> None:
+    """Mark the current run as having found nothing to do."""
+    _current.noop = True
+
+def _labels(**labels) -> str:
+    def escape(v) -> str:
+        return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{k}="{escape(v)}"' for k, v in labels.items())
+
+def prometheus_text(m: RunMetrics) -> str:
+    """Render a finished run in the Prometheus text exposition format."""
+    cmd = _labels(command=m.command)
+    lines = [
+        '# HELP evapro_run_duration_seconds Wall time of the last run',
+        '# TYPE evapro_run_duration_seconds gauge',
+        f'evapro_run_duration_seconds{{{cmd}}} {m.duration:.6f}',
+        '# HELP evapro_run_success Whether the last run succeeded',
+        '# TYPE evapro_run_success gauge',
+        f'evapro_run_success{{{cmd}}} {int(m.status == "done")}',
+        '# HELP evapro_run_timestamp_seconds Unix time the last run finished',
+        '# TYPE evapro_run_timestamp_seconds gauge',
+        f'evapro_run_timestamp_seconds{{{cmd}}} {time.time():.0f}',
+        '# HELP evapro_stage_seconds Seconds spent per stage in the last run',
+        '# TYPE evapro_stage_seconds gauge',
+    ]
+    lines += [f'evapro_stage_seconds{{{_labels(command=m.command, stage=k)}}} {v:.6f}' for k, v in sorted(m.timers.items())]
+    lines += [
+        '# HELP evapro_items Rows and items processed in the last run',
+        '# TYPE evapro_items gauge',
+    ]
+    lines += [f'evapro_items{{{_labels(command=m.command, name=k)}}} {v}' for k, v in sorted(m.counters.items())]
+    lines += [
+        '# HELP evapro_latency_seconds Query and call latency in the last run',
+        '# TYPE evapro_latency_seconds histogram',
+    ]
+    for name, h in sorted(m.histograms.items()):
+        cumulative = 0
+        for bound, n in zip(LATENCY_BUCKETS + ('+Inf',), h.counts):
+            cumulative += n
+            lines.append(f'evapro_latency_seconds_bucket{{{_labels(command=m.command, name=name, le=bound)}}} {cumulative}')
+        lines.append(f'evapro_latency_seconds_sum{{{_labels(command=m.command, name=name)}}} {h.total:.6f}')
+        lines.append(f'evapro_latency_seconds_count{{{_labels(command=m.command, name=name)}}} {h.count}')
+    return '\n'.join(lines) + '\n'
+
+def write_textfile(m: RunMetrics, directory: str) -> str:
+    """Atomically write evapro_<command>.prom under directory for node_exporter.
+
+    Returns:
+        str: Path of the written file
+    """
+    directory = os.path.expanduser(directory)
+    path = os.path.join(directory, f"evapro_{m.command.replace('-', '_')}.prom")
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.evapro_', suffix='.prom.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(prometheus_text(m))
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
+    return path
+
+def record(m: RunMetrics, conf: "Config") -> None:
+    """Store a finished run in syncproject.db and the textfile collector directory.
+
+    Successful runs that found nothing to do (e.g. most evapro cron ticks)
+    only go to the textfile, so they add no writes to syncproject.db. Old
+    rows are pruned every PRUNE_EVERY runs. Failures are reported and
+    swallowed, metrics never break a run.
+    """
+    if not (m.noop and m.status == 'done'):
+        try:
+            from evapro.db.connection import ConnectionTuning
+            from evapro.db.database import SQLiteDB
+            from evapro.db.runmetrics import RunMetricsStore
+
+            tbj = SQLiteDB(dbpath=conf.syncproject, tuning=ConnectionTuning.from_conf(conf))
+            try:
+                tbj.migrate()
+                store = RunMetricsStore(tbj)
+                if store.save(m) % PRUNE_EVERY == 0:
+                    store.prune(conf.metrics_keep_runs)
+            finally:
+                tbj.close_db()
+        except Exception as e:
+            print(f"保存运行统计到 run_metrics 失败: {e}")
+
+    if conf.metrics_textfile_dir:
+        try:
+            write_textfile(m, conf.metrics_textfile_dir)
+        except Exception as e:
+            print(f"写入 Prometheus textfile 失败: {e}")
+
+@contextlib.contextmanager
+def run(command: str, conf: "Config") -> Iterator[RunMetrics]:
+    """Collect metrics of one command and record them when it ends."""
+    global _current
+    previous, _current = _current, RunMetrics(command=command)
+    m = _current
+    try:
+        yield m
+    except BaseException as e:
+        m.finish('failed', str(e) or type(e).__name__)
+        raise
+    else:
+        m.finish('done')
+    finally:
+        _current = previous
+        record(m, conf)
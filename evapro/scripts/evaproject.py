@@ -8,25 +8,26 @@ import os
 import warnings
 from typing import Optional
 from pathlib import Path
-import importlib.resources
 import click
-from evapro.db.database import SQLiteDB 
-    
-from evapro.db.update_db import lims2evaproDB, update_project_workdir, update_project_user, add_project2annoeva
-from evapro.config import (
-    cronlist,
-    set_dbpath
-)
+
+# pandas/pymysql 等较重的依赖只在需要它们的子命令中导入, 保证 evapro conf/cron 启动足够快
 
 warnings.filterwarnings("ignore")
 
+def _load_config():
+    """Load evapro.yaml, report an invalid configuration without a traceback."""
+    from evapro.config.settings import ConfigError, load_config
+
+    try:
+        return load_config()
+    except ConfigError as e:
+        raise click.ClickException(f"配置文件有误: {e}")
+
 @click.group()
 def main() -> None:
     """Main command group for evapro CLI.
     This serves as the entry point for all subcommands.
     """
-    crnlist = cronlist()
-    crnlist.add_cron()
 
 # ------------------------------------------------------------------------------------
 @main.command(name="init")
@@ -36,11 +37,15 @@ def init_cli(syncdbdir: str) -> None:
     """
     Initialize the database and add projects to the monitoring system.
     """
+    from evapro.db.database import SQLiteDB
+    from evapro.config import cronlist, set_dbpath
+
     set_dbpath(syncdbdir)
 
     tbj = SQLiteDB(dbpath=f'{syncdbdir}/syncproject.db')
     tbj.crt_tb_sql()
     tbj.crt_allpro_tb_sql()
+    tbj.migrate()
     tbj.close_db()
 
     try:
@@ -59,33 +64,337 @@ def init_cli(syncdbdir: str) -> None:
         click.echo(f"错误: 没有权限修改 {syncdbdir} 或 {db_file} 的权限，请手动修改为777权限")
     except Exception as e:
         click.echo(f"设置权限时发生错误: {str(e)}")
-    
-    
+
+    cronlist().add_cron()
+
+# ------------------------------------------------------------------------------------
+@main.command(name="install-cron")
+@click.option('--daemon', is_flag=True, default=False,
+              help="schedule `evapro daemon` every 10 minutes, it only starts when no daemon runs; "
+                   "it replaces the `evapro cron` entries of the users")
+@click.option('--sync', is_flag=True, default=False,
+              help="schedule `evapro lims2evapro` every 4 hours, safe on several nodes, only one of them syncs at a time")
+def install_cron_cli(daemon: bool, sync: bool) -> None:
+    """把 evapro cron 加入当前账户的 crontab 计划任务(已存在时不重复添加)
+    """
+    from evapro.config import cronlist
+
+    if sync:
+        cronlist().add_cron('lims2evapro', '0 */4 * * *')
+    elif daemon:
+        cronlist().add_cron('daemon', '*/10 * * * *')
+        click.echo("daemon 会为所有用户添加项目, 请删除各用户 crontab 中的 evapro cron 计划任务")
+    else:
+        cronlist().add_cron()
 
 # ------------------------------------------------------------------------------------
 @main.command(name="lims2evapro")
-def lims2eva_cli() -> None:
+@click.option('--plan', 'dry_run', is_flag=True, default=False,
+              help="only print the new and changed projects the sync would write, nothing is written")
+def lims2eva_cli(dry_run: bool) -> None:
     """Sync lims analysis projects to syncproject.db  all_ana_projects table
     需要加入管理账户的计划任务，每4h执行一次
     """
-    lims2evaproDB()
-    update_project_workdir()
-    update_project_user()
+    import datetime
+    import sqlite3
+    from evapro import metrics
+    from evapro.db.connection import ConnectionTuning
+    from evapro.db.lease import Lease
+    from evapro.db.lims import LimsSession
+    from evapro.db.update_db import lims2evaproDB, plan_lims2evaproDB, update_project_workdir, update_project_user
+
+    conf = _load_config()
+    if dry_run:
+        try:
+            plan = plan_lims2evaproDB(conf=conf)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        except sqlite3.Error as e:
+            raise click.ClickException(f"无法读取 syncproject.db {conf.syncproject}: {e}")
+        for mark, records in (('+', plan.new), ('~', plan.changed)):
+            for rec in records.itertuples(index=False):
+                click.echo(f"{mark} {rec.proid}\t{rec.user}\t{rec.ptype}\t{rec.isautoflow}\t{rec.info_date}\t{rec.workdir}")
+        click.echo(f"新增 {plan.new.shape[0]} 个项目, 更新 {plan.changed.shape[0]} 个项目, "
+                   f"{plan.unchanged} 个未变化, {plan.locked} 个已加入 annoeva, {plan.duplicates} 个重复任务单")
+        return
+
+    # 整个集群同一时间只有一个同步, 其他节点的 lims2evapro 直接退出
+    lease = Lease(conf.syncproject, 'lims2evapro', ttl=conf.sync_lease_ttl, tuning=ConnectionTuning.from_conf(conf))
+    if not lease.acquire():
+        info = lease.current()
+        lease.close()
+        if info:
+            expires = datetime.datetime.fromtimestamp(info.expires_at).strftime('%Y-%m-%d %H:%M:%S')
+            click.echo(f"{info.host} (pid {info.pid}) 正在同步, 租约到期时间 {expires}, 本次不再同步")
+        else:
+            click.echo("其他进程正在同步, 本次不再同步")
+        return
+
+    # 三个同步阶段共用同一组 lims 数据库连接
+    with lease, metrics.run('lims2evapro', conf), LimsSession(conf) as session:
+        lims2evaproDB(session, conf, lease=lease)
+        lease.ensure()
+        update_project_workdir(session, conf)
+        lease.ensure()
+        update_project_user(session, conf)
 
 # ------------------------------------------------------------------------------------
 @main.command(name="cron")
-def cron_cli() -> None:
+@click.option('--jobs', '-j', default=None, type=click.IntRange(min=1),
+              help="max number of concurrent annoeva addproject processes, default: annoeva_jobs in evapro.yaml")
+@click.option('--all-users', is_flag=True, default=False,
+              help="add the pending projects of every user, other accounts need dispatch_command_prefix in evapro.yaml")
+@click.option('--workers', '-w', default=None, type=click.IntRange(min=1),
+              help="with --all-users, max number of users served at the same time, default: cron_user_workers in evapro.yaml")
+def cron_cli(jobs: Optional[int], all_users: bool, workers: Optional[int]) -> None:
     """遍历evapro数据库所有项目，检查是否有新的项目需要添加到annoEva
     """
-    add_project2annoeva() 
+    from evapro import metrics
+    from evapro.dispatch.cron import add_project2annoeva, add_projects_all_users
+
+    conf = _load_config()
+    if not all_users:
+        with metrics.run('cron', conf):
+            add_project2annoeva(jobs=jobs, conf=conf)
+        return
+
+    with metrics.run('cron', conf):
+        outcomes = add_projects_all_users(jobs=jobs, workers=workers, conf=conf)
+    if not outcomes:
+        click.echo("没有待添加的项目")
+        return
+    click.echo(f"{'account':<16}{'user':<16}{'pending':>8}{'added':>8}{'failed':>8}{'seconds':>9}")
+    for o in outcomes:
+        click.echo(f"{o.account:<16}{o.user:<16}{len(o.projects):>8}{o.added:>8}{o.failed:>8}{o.elapsed:>9.1f}"
+                   + (f"  {o.error}" if o.error else ""))
     
+# ------------------------------------------------------------------------------------
+@main.command(name="daemon")
+@click.option('--jobs', '-j', default=None, type=click.IntRange(min=1),
+              help="max number of concurrent annoeva addproject processes per account, default: annoeva_jobs in evapro.yaml")
+def daemon_cli(jobs: Optional[int]) -> None:
+    """常驻进程: syncproject.db 有新项目时立即添加到对应账户的 annoeva, 代替每个用户的 evapro cron
+    """
+    from evapro.dispatch.daemon import daemon_lock_path, serve
+
+    conf = _load_config()
+    if not serve(conf, jobs=jobs):
+        click.echo(f"本节点已有 evapro daemon 在运行 ({daemon_lock_path()})")
+
+# ------------------------------------------------------------------------------------
+LS_COLUMNS = {
+    'all_ana_projects': ('id', 'proid', 'user', 'ptype', 'info_date', 'isautoflow', 'isadd2annoeva', 'workdir'),
+    'projects': ('id', 'proid', 'user', 'ptype', 'pstat', 'run_num', 'workdir'),
+}
+
+@main.command(name="ls")
+@click.option('--user', '-u', default=None,
+              help="LIMS user of the projects, default: the user of the current account")
+@click.option('--all-users', is_flag=True, default=False, help="list the projects of every user")
+@click.option('--ptype', '-t', default=None, help="only projects of this product type")
+@click.option('--proid', '-p', default=None, help="only projects whose id starts with this prefix")
+@click.option('--pending', is_flag=True, default=False, help="only projects not added to annoeva yet")
+@click.option('--since', '-s', default=None, help="only projects with info_date at or after YYYY-MM-DD[ HH:MM:SS]")
+@click.option('--table', default='all_ana_projects', type=click.Choice(['all_ana_projects', 'projects']),
+              help="all_ana_projects (synced from lims) or projects")
+@click.option('--limit', '-n', default=None, type=click.IntRange(min=1), help="print at most this many projects")
+@click.option('--newest', is_flag=True, default=False, help="newest projects first")
+def ls_cli(user: Optional[str], all_users: bool, ptype: Optional[str], proid: Optional[str], pending: bool,
+           since: Optional[str], table: str, limit: Optional[int], newest: bool) -> None:
+    """列出 syncproject.db 中的项目(只读, 不影响同步和 cron 写入)
+    """
+    import getpass
+    import sqlite3
+    from evapro.db.connection import ConnectionTuning, connect_readonly
+    from evapro.db.query import ProjectFilter, iter_projects
+    from evapro.dispatch.accounts import lims_user
+
+    conf = _load_config()
+    if all_users:
+        user = None
+    elif user is None:
+        # projects 表记录的是服务器账户, all_ana_projects 记录的是 lims 用户
+        user = getpass.getuser() if table == 'projects' else lims_user(getpass.getuser(), conf.ADuser)
+    try:
+        flt = ProjectFilter(table=table, user=user, ptype=ptype, proid=proid, pending=pending, since=since)
+        conn = connect_readonly(conf.syncproject, ConnectionTuning.from_conf(conf))
+    except (ValueError, sqlite3.Error) as e:
+        raise click.ClickException(str(e))
+
+    columns = LS_COLUMNS[table]
+    try:
+        click.echo('\t'.join(columns))
+        for row in iter_projects(conn, flt, columns, limit=limit, newest_first=newest):
+            click.echo('\t'.join('' if v is None else str(v) for v in row))
+    except sqlite3.Error as e:
+        raise click.ClickException(f"查询失败: {e}")
+    finally:
+        conn.close()
+
+# ------------------------------------------------------------------------------------
+@main.command(name="export")
+@click.option('--outdir', '-o', required=True, help="output directory, also holds the watermark file")
+@click.option('--format', '-f', 'fmt', default='ndjson', type=click.Choice(['ndjson', 'csv', 'parquet']),
+              help="output format, parquet requires pyarrow")
+@click.option('--table', 'tables', multiple=True, type=click.Choice(['all_ana_projects', 'projects']),
+              help="table to export, repeatable, default: both")
+@click.option('--incremental', is_flag=True, default=False,
+              help="only export rows after the watermark of the previous export")
+@click.option('--chunk-size', default=5000, type=click.IntRange(min=1), help="rows read and written per batch")
+@click.option('--snapshot', 'method', default='auto', type=click.Choice(['auto', 'transaction', 'backup']),
+              help="read transaction (WAL databases) or a backup copy, auto chooses by journal mode")
+def export_cli(outdir: str, fmt: str, tables: tuple, incremental: bool, chunk_size: int, method: str) -> None:
+    """从 syncproject.db 的一致快照导出项目表, 报表和看板读取导出文件而不是数据库
+    """
+    import sqlite3
+    from evapro.db.connection import ConnectionTuning
+    from evapro.db.export import EXPORT_TABLES, export_snapshot
+
+    conf = _load_config()
+    try:
+        marks = export_snapshot(conf.syncproject, outdir, tables or EXPORT_TABLES, fmt, incremental=incremental,
+                                chunk_size=chunk_size, method=method, tuning=ConnectionTuning.from_conf(conf))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    except sqlite3.Error as e:
+        raise click.ClickException(f"导出失败: {e}")
+
+    for table, mark in marks.items():
+        if mark.path:
+            click.echo(f"{table}: 导出 {mark.rows} 行到 {mark.path}")
+        else:
+            click.echo(f"{table}: 没有新的项目")
+        click.echo(f"  水位 id={mark.id}" + (f" info_date={mark.info_date}" if mark.info_date else ""))
+
+# ------------------------------------------------------------------------------------
+@main.command(name="stats")
+@click.option('--last', '-n', default=10, type=click.IntRange(min=1),
+              help="number of recent runs to summarize")
+@click.option('--command', '-c', default=None, type=click.Choice(['lims2evapro', 'cron', 'daemon']),
+              help="only show runs of this command")
+def stats_cli(last: int, command: Optional[str]) -> None:
+    """汇总最近 N 次 lims2evapro/cron 运行的各阶段耗时、行数和查询延迟
+    """
+    from evapro import metrics
+    from evapro.db.connection import ConnectionTuning
+    from evapro.db.database import SQLiteDB
+    from evapro.db.runmetrics import RunMetricsStore
+
+    conf = _load_config()
+    tbj = SQLiteDB(dbpath=conf.syncproject, tuning=ConnectionTuning.from_conf(conf))
+    tbj.migrate()
+    runs = RunMetricsStore(tbj).recent(last, command)
+    tbj.close_db()
+    if not runs:
+        click.echo("还没有运行记录")
+        return
+
+    click.echo(f"{'started_at':<20} {'command':<12} {'host':<16} {'status':<7} {'seconds':>9}")
+    for m in runs:
+        click.echo(f"{m.started_at:<20} {m.command:<12} {m.host or '':<16.16} {m.status:<7} {m.duration:>9.2f}"
+                   + (f"  {m.error}" if m.error else ""))
+
+    for name in sorted(set(m.command for m in runs)):
+        group = [m for m in runs if m.command == name]
+        summary = metrics.summarize(group)
+        click.echo(f"\n{name}: 最近 {len(group)} 次运行")
+        if summary['timers']:
+            click.echo(f"  {'stage':<32}{'mean s':>10}{'max s':>10}")
+            for stage, (mean, peak) in sorted(summary['timers'].items()):
+                click.echo(f"  {stage:<32}{mean:>10.3f}{peak:>10.3f}")
+        if summary['counters']:
+            click.echo(f"  {'counter':<32}{'total':>10}{'per run':>10}")
+            for counter, total in sorted(summary['counters'].items()):
+                click.echo(f"  {counter:<32}{total:>10}{total / len(group):>10.1f}")
+        if summary['histograms']:
+            click.echo(f"  {'latency':<32}{'count':>10}{'p50 s':>10}{'p95 s':>10}{'max s':>10}")
+            for hist, h in sorted(summary['histograms'].items()):
+                click.echo(f"  {hist:<32}{h.count:>10}{h.quantile(0.5):>10.3f}{h.quantile(0.95):>10.3f}{h.max:>10.3f}")
+
+# ------------------------------------------------------------------------------------
+@main.group(name="db")
+def db_cli() -> None:
+    """syncproject.db 数据库维护
+    """
+
+@db_cli.command(name="migrate")
+@click.option('--dbpath', default=None,
+              help="path of syncproject.db, default: syncproject in evapro.yaml")
+def db_migrate_cli(dbpath: Optional[str]) -> None:
+    """升级 syncproject.db 表结构和索引到最新版本
+    """
+    from evapro.config.conf import get_dbpath
+    from evapro.db.database import SQLiteDB
+    from evapro.db.migrations import LATEST_VERSION, schema_version
+
+    dbpath = dbpath or get_dbpath()
+    if not dbpath:
+        raise click.UsageError("未找到 syncproject.db, 请用 --dbpath 指定")
+    tbj = SQLiteDB(dbpath=dbpath)
+    applied = tbj.migrate()
+    version = schema_version(tbj.conn)
+    tbj.close_db()
+    if applied:
+        click.echo(f"已升级 {dbpath}: v{applied[0]} -> v{version}")
+    else:
+        click.echo(f"{dbpath} 已是最新版本 v{version} (最新 v{LATEST_VERSION})")
+
+# ------------------------------------------------------------------------------------
+@main.group(name="cache")
+def cache_cli() -> None:
+    """lims 产品类型和 annoeva 自动化产品的本地缓存
+    """
+
+@cache_cli.command(name="refresh")
+def cache_refresh_cli() -> None:
+    """重新从 lims 和 evaconf.yaml 加载缓存
+    """
+    from evapro.db.cache import LimsCache
+    from evapro.db.connection import ConnectionTuning
+    from evapro.db.database import SQLiteDB
+    from evapro.db.lims import LimsSession
+    from evapro.db.update_db import cached_autoflow_products, cached_product_type
+
+    conf = _load_config()
+    tbj = SQLiteDB(dbpath=conf.syncproject, tuning=ConnectionTuning.from_conf(conf))
+    tbj.migrate()
+    cache = LimsCache(tbj)
+    with LimsSession(conf) as session:
+        products = cached_product_type(cache, session, refresh=True)
+    autoflow = cached_autoflow_products(cache, conf.annoevaconf, refresh=True)
+    tbj.close_db()
+    click.echo(f"已刷新缓存: {products.shape[0]} 个 lims 产品编号, {len(autoflow)} 个自动化产品类型")
+
+@cache_cli.command(name="clear")
+def cache_clear_cli() -> None:
+    """清空缓存, 下次同步时重新加载
+    """
+    from evapro.db.cache import LimsCache
+    from evapro.db.connection import ConnectionTuning
+    from evapro.db.database import SQLiteDB
+
+    conf = _load_config()
+    tbj = SQLiteDB(dbpath=conf.syncproject, tuning=ConnectionTuning.from_conf(conf))
+    tbj.migrate()
+    n = LimsCache(tbj).clear()
+    tbj.close_db()
+    click.echo(f"已清空 {n} 个缓存项")
+
 # ------------------------------------------------------------------------------------
 @main.command(name="conf")
 def conf_cli() -> None:
     """check config file
     """
-    with importlib.resources.path("evapro.config", "evapro.yaml") as confpath:
-        print(f"配置文件路径: {str(confpath)}")
+    from evapro.config.settings import ConfigError, load_config, package_config_path, user_config_path
+
+    print(f"配置文件路径: {package_config_path()}")
+    print(f"用户配置文件: {user_config_path()}" + ("" if os.path.isfile(user_config_path()) else " (不存在)"))
+    try:
+        conf = load_config()
+    except ConfigError as e:
+        raise click.ClickException(f"配置文件有误: {e}")
+    for name in conf.overrides:
+        print(f"环境变量覆盖: {name}")
 
 
 # ------------------------------------------------------------------------------------
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+from evapro.db.database import SQLiteDB
+
+# benchmarks/fakelims.py 作为 LIMS 的替身
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+@pytest.fixture
+def db(tmp_path):
+    tbj = SQLiteDB(dbpath=str(tmp_path / "syncproject.db"))
+    tbj.migrate()
+    yield tbj
+    tbj.close_db()
@@ -0,0 +1,103 @@
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from evapro.db.connection import WriterLock, retry_locked
+
+def test_retry_locked_retries_until_success():
+    calls = []
+
+    def func():
+        calls.append(1)
+        if len(calls) < 3:
+            raise sqlite3.OperationalError("database is locked")
+        return "ok"
+
+    assert retry_locked(func, retries=5, base_delay=0.001) == "ok"
+    assert len(calls) == 3
+
+def test_retry_locked_gives_up_after_retries():
+    calls = []
+
+    def func():
+        calls.append(1)
+        raise sqlite3.OperationalError("database is busy")
+
+    with pytest.raises(sqlite3.OperationalError):
+        retry_locked(func, retries=2, base_delay=0.001)
+    assert len(calls) == 3
+
+def test_retry_locked_does_not_retry_other_errors():
+    calls = []
+
+    def func():
+        calls.append(1)
+        raise sqlite3.OperationalError("no such table: x")
+
+    with pytest.raises(sqlite3.OperationalError, match="no such table"):
+        retry_locked(func, retries=5, base_delay=0.001)
+    assert len(calls) == 1
+
+LOCKED_BY_OTHER = """
+import fcntl, os, sys
+fd = os.open(sys.argv[1], os.O_RDWR | os.O_CREAT)
+try:
+    fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+except OSError:
+    sys.exit(1)
+sys.exit(0)
+"""
+
+def locked_by_other_process(path) -> bool:
+    return subprocess.run([sys.executable, "-c", LOCKED_BY_OTHER, str(path)]).returncode == 1
+
+def test_writer_lock_is_reentrant(tmp_path):
+    path = tmp_path / "db.lock"
+    with WriterLock(str(path)):
+        with WriterLock(str(path)):
+            assert locked_by_other_process(path)
+        # 内层释放后外层仍然持有文件锁
+        assert locked_by_other_process(path)
+    assert not locked_by_other_process(path)
+
+def test_writer_lock_serializes_threads(tmp_path):
+    path = str(tmp_path / "db.lock")
+    inside = []
+    overlap = []
+
+    def work():
+        for _ in range(20):
+            with WriterLock(path):
+                with WriterLock(path):
+                    inside.append(1)
+                    if len(inside) > 1:
+                        overlap.append(1)
+                    time.sleep(0.001)
+                    inside.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not overlap
+    assert not locked_by_other_process(path)
+
+def test_writer_lock_blocks_other_thread_until_released(tmp_path):
+    path = str(tmp_path / "db.lock")
+    acquired = threading.Event()
+
+    def other():
+        with WriterLock(path):
+            acquired.set()
+
+    with WriterLock(path):
+        t = threading.Thread(target=other)
+        t.start()
+        assert not acquired.wait(0.2)
+    assert acquired.wait(5)
+    t.join()
@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+
+from evapro.db.database import SQLiteDB
+
+def record(proid, user="alice", info_date="2025-01-01 00:00:00", workdir="/w", ptype="prod1"):
+    return (user, proid, "2025-01-01 00:00:00", info_date, ptype, "Y", workdir)
+
+def rows(db):
+    return {row["proid"]: dict(row) for row in db.iter_rows("SELECT * FROM all_ana_projects")}
+
+def test_insert_ignore_counts(db):
+    assert db.insert_allpro_many([record("P1"), record("P2")]) == {"inserted": 2, "updated": 0, "skipped": 0}
+    assert db.insert_allpro_many([record("P2", info_date="2025-02-01"), record("P3")]) == {
+        "inserted": 1, "updated": 0, "skipped": 1}
+    assert rows(db)["P2"]["info_date"] == "2025-01-01 00:00:00"
+    assert db.insert_allpro_many([]) == {"inserted": 0, "updated": 0, "skipped": 0}
+
+def test_upsert_counts(db):
+    db.insert_allpro_many([record("P1"), record("P2"), record("P3")])
+    db.update_many({"P3": {"isadd2annoeva": "Y"}})
+    counts = db.insert_allpro_many([
+        record("P1"),                        # unchanged
+        record("P2", info_date="2025-02-01"),  # updated
+        record("P3", info_date="2025-02-01"),  # already added to annoeva
+        record("P4"),                        # new
+    ], on_conflict="update")
+    assert counts == {"inserted": 1, "updated": 1, "skipped": 2}
+    stored = rows(db)
+    assert stored["P2"]["info_date"] == "2025-02-01"
+    assert stored["P3"]["info_date"] == "2025-01-01 00:00:00"
+
+def test_upsert_duplicate_proids_in_one_batch(db):
+    db.insert_allpro_many([record("P1")])
+    counts = db.insert_allpro_many([
+        record("P1", info_date="2025-02-01"),
+        record("P1", info_date="2025-03-01"),
+        record("P2", info_date="2025-02-01"),
+        record("P2", info_date="2025-03-01"),
+    ], on_conflict="update")
+    assert counts == {"inserted": 1, "updated": 1, "skipped": 2}
+    stored = rows(db)
+    assert stored["P1"]["info_date"] == "2025-03-01"
+    assert stored["P2"]["info_date"] == "2025-03-01"
+
+def test_upsert_keeps_stored_user_and_workdir(db):
+    db.insert_allpro_many([record("P1"), record("P2")])
+    counts = db.insert_allpro_many([record("P1", user="", workdir=""), record("P2", user=None, workdir="")],
+                                   on_conflict="update")
+    assert counts == {"inserted": 0, "updated": 0, "skipped": 2}
+    stored = rows(db)
+    assert (stored["P1"]["user"], stored["P1"]["workdir"]) == ("alice", "/w")
+    assert (stored["P2"]["user"], stored["P2"]["workdir"]) == ("alice", "/w")
+
+def test_upsert_accepts_dicts(db):
+    keys = ("user", "proid", "create_date", "info_date", "ptype", "isautoflow", "workdir")
+    assert db.insert_allpro_many([dict(zip(keys, record("P1")))], on_conflict="update")["inserted"] == 1
+
+def test_invalid_arguments(db):
+    with pytest.raises(ValueError):
+        db.insert_allpro_many([record("P1")], on_conflict="replace")
+    with pytest.raises(ValueError):
+        db.update_many({"P1": {"proid": "P2"}})
+    with pytest.raises(ValueError):
+        db.update_many({"P1": {"user": "bob"}}, table="sqlite_master")
+
+def test_claims(db):
+    db.insert_allpro_many([record(f"P{i}") for i in range(4)])
+    db.update_many({"P3": {"isadd2annoeva": "Y"}})
+    assert db.claim_projects(["P0", "P1", "P2", "P3"]) == ["P0", "P1", "P2"]
+    assert db.claim_projects(["P0", "P1"]) == []
+    assert db.finish_claims(["P0"], ["P1"]) == 2
+    assert {proid: row["isadd2annoeva"] for proid, row in rows(db).items()} == {
+        "P0": "Y", "P1": "N", "P2": "P", "P3": "Y"}
+    assert db.release_stale_claims(3600) == 0
+    assert db.release_stale_claims(-1) == 1
+    assert rows(db)["P2"]["isadd2annoeva"] == "N"
+
+def test_concurrent_claims_are_disjoint(db):
+    proids = [f"P{i}" for i in range(300)]
+    db.insert_allpro_many([record(proid) for proid in proids])
+    claimed = {}
+
+    def claim(n):
+        other = SQLiteDB(dbpath=db.dbpath)
+        try:
+            claimed[n] = other.claim_projects(proids)
+        finally:
+            other.close_db()
+
+    threads = [threading.Thread(target=claim, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    everything = [proid for part in claimed.values() for proid in part]
+    assert sorted(everything) == sorted(proids)
@@ -0,0 +1,59 @@
+from pandas import DataFrame
+
+from evapro.db.database import ALLPRO_COLUMNS
+from evapro.db.delta import KnownProjects
+
+def records(*rows):
+    return DataFrame(list(rows), columns=list(ALLPRO_COLUMNS))
+
+def record(proid, user="alice", info_date="2025-01-01 00:00:00", workdir="/w"):
+    return (user, proid, "2025-01-01 00:00:00", info_date, "prod1", "Y", workdir)
+
+def test_plan_classifies_records(db):
+    db.insert_allpro_many([record("P1"), record("P2"), record("P3")])
+    db.update_many({"P3": {"isadd2annoeva": "Y"}})
+    known = KnownProjects.load(db.conn)
+    assert len(known) == 3
+    assert list(known.is_locked(["P3", "P1", "P9"])) == [True, False, False]
+
+    plan = known.plan(records(
+        record("P1"),
+        record("P2", info_date="2025-02-01"),
+        record("P3", info_date="2025-02-01"),
+        record("P4"),
+        record("P4", info_date="2025-02-01"),
+    ))
+    assert list(plan.new["proid"]) == ["P4"]
+    assert list(plan.new["info_date"]) == ["2025-02-01"]
+    assert list(plan.changed["proid"]) == ["P2"]
+    assert (plan.unchanged, plan.locked, plan.duplicates) == (1, 1, 1)
+    assert plan.skipped == 3
+    assert list(plan.writes["proid"]) == ["P4", "P2"]
+
+def test_plan_keeps_stored_user_and_workdir(db):
+    db.insert_allpro_many([record("P1"), record("P2"), record("P3")])
+    plan = KnownProjects.load(db.conn).plan(records(
+        record("P1", user=None),
+        record("P2", user="", workdir=""),
+        record("P3", workdir="/other"),
+    ))
+    assert plan.unchanged == 2
+    assert list(plan.changed["proid"]) == ["P3"]
+
+def test_plan_matches_upsert(db):
+    db.insert_allpro_many([record("P1"), record("P2")])
+    known = KnownProjects.load(db.conn)
+    batch = records(record("P1"), record("P2", info_date="2025-02-01"), record("P3"))
+    plan = known.plan(batch)
+    counts = db.insert_allpro_many(plan.writes, on_conflict="update")
+    assert counts == {"inserted": len(plan.new), "updated": len(plan.changed), "skipped": 0}
+
+def test_remember(db):
+    known = KnownProjects.load(db.conn)
+    assert len(known) == 0
+    plan = known.plan(records(record("P1")))
+    known.remember(plan)
+    again = known.plan(records(record("P1"), record("P1", info_date="2025-02-01")))
+    assert again.new.empty
+    assert list(again.changed["info_date"]) == ["2025-02-01"]
+    assert again.duplicates == 1
@@ -0,0 +1,54 @@
+import sqlite3
+
+import pytest
+
+from evapro.db.database import CRT_ALLPRO_SQL, CRT_PROJECTS_SQL
+from evapro.db.migrations import LATEST_VERSION, MIGRATIONS, migrate, schema_version
+
+def schema(conn):
+    return sorted(conn.execute("SELECT type, name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'").fetchall())
+
+@pytest.fixture
+def fresh_schema(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "fresh.db"))
+    migrate(conn)
+    yield schema(conn)
+    conn.close()
+
+def test_migrate_from_empty(tmp_path, fresh_schema):
+    conn = sqlite3.connect(str(tmp_path / "syncproject.db"))
+    assert migrate(conn) == [version for version, _, _ in MIGRATIONS]
+    assert schema_version(conn) == LATEST_VERSION
+    assert migrate(conn) == []
+    assert schema(conn) == fresh_schema
+
+@pytest.mark.parametrize("start", [version for version, _, _ in MIGRATIONS])
+def test_migrate_from_each_version(tmp_path, fresh_schema, start):
+    conn = sqlite3.connect(str(tmp_path / "syncproject.db"))
+    assert migrate(conn, target=start) == [version for version, _, _ in MIGRATIONS if version <= start]
+    assert schema_version(conn) == start
+    assert migrate(conn) == [version for version, _, _ in MIGRATIONS if version > start]
+    assert migrate(conn) == []
+    assert schema(conn) == fresh_schema
+
+def test_migrate_legacy_database(tmp_path):
+    # evapro init 之前的版本直接建表, user_version 为 0
+    conn = sqlite3.connect(str(tmp_path / "syncproject.db"))
+    conn.execute(CRT_PROJECTS_SQL)
+    conn.execute(CRT_ALLPRO_SQL)
+    conn.execute("INSERT INTO all_ana_projects (user, proid, isadd2annoeva) VALUES ('u', 'P1', 'Y')")
+    conn.commit()
+    migrate(conn)
+    assert schema_version(conn) == LATEST_VERSION
+    assert conn.execute("SELECT proid, isadd2annoeva, claimed_at FROM all_ana_projects").fetchall() == [("P1", "Y", None)]
+
+def test_failed_migration_is_rolled_back(tmp_path, monkeypatch):
+    conn = sqlite3.connect(str(tmp_path / "syncproject.db"))
+    migrate(conn, target=1)
+    broken = list(MIGRATIONS)
+    broken[1] = (2, "broken", ["create index idx_x on all_ana_projects(user)", "not sql"])
+    monkeypatch.setattr("evapro.db.migrations.MIGRATIONS", broken)
+    with pytest.raises(sqlite3.Error):
+        migrate(conn)
+    assert schema_version(conn) == 1
+    assert conn.execute("SELECT count(*) FROM sqlite_master WHERE name = 'idx_x'").fetchone()[0] == 0
@@ -0,0 +1,75 @@
+import pytest
+
+from evapro.config.settings import Config, ConfigError, _env_overrides, load_config
+
+BASE = {
+    "syncproject": "/tmp/syncproject.db",
+    "annoeva": "/usr/bin/annoeva",
+    "annoevaconf": "/tmp/evaconf.yaml",
+    "lims3": {"host": "lims", "port": 3306, "user": None, "passwd": None},
+    "ADuser": {"yuanzan": "zanyuan"},
+}
+
+@pytest.mark.parametrize("passwd", ["0123", "123456", "yes", "null", "1e3", "{a: 1}", ""])
+def test_section_values_stay_strings(passwd):
+    data, applied = _env_overrides(dict(BASE), {"EVAPRO_LIMS3__PASSWD": passwd})
+    assert applied == ["EVAPRO_LIMS3__PASSWD"]
+    assert data["lims3"]["passwd"] == passwd
+    assert data["lims3"]["host"] == "lims"
+    assert BASE["lims3"]["passwd"] is None
+
+def test_section_keys_are_case_insensitive():
+    data, _ = _env_overrides(dict(BASE), {"EVAPRO_LIMS3__USER": "yes", "EVAPRO_ADUSER__ZHANGSAN": "sanzhang"})
+    assert data["lims3"]["user"] == "yes"
+    assert data["ADuser"] == {"yuanzan": "zanyuan", "zhangsan": "sanzhang"}
+
+def test_typed_fields_are_converted():
+    env = {
+        "EVAPRO_ANNOEVA_JOBS": "8",
+        "EVAPRO_ANNOEVA_TIMEOUT": "1e3",
+        "EVAPRO_ANNOEVA_PYTHON": "0123",
+        "EVAPRO_SYN_LIMS_TIME": "2025-05-21 13:56:35",
+        "EVAPRO_SQLITE": "{busy_timeout: 1000}",
+    }
+    data, applied = _env_overrides(dict(BASE), env)
+    assert sorted(applied) == sorted(env)
+    assert data["annoeva_jobs"] == 8
+    assert data["annoeva_timeout"] == 1000.0
+    assert data["annoeva_python"] == "0123"
+    assert data["syn_lims_time"] == "2025-05-21 13:56:35"
+    assert data["sqlite"] == {"busy_timeout": 1000}
+
+def test_empty_typed_field_falls_back_to_default():
+    data, _ = _env_overrides(dict(BASE), {"EVAPRO_ANNOEVA_TIMEOUT": ""})
+    assert Config.from_dict(data).annoeva_timeout is None
+
+@pytest.mark.parametrize("name,text", [
+    ("EVAPRO_ANNOEVA_JOBS", "many"),
+    ("EVAPRO_ANNOEVA_JOBS", "[1"),
+    ("EVAPRO_LIMS3", "passwd"),
+])
+def test_invalid_typed_field(name, text):
+    with pytest.raises(ConfigError, match=name):
+        _env_overrides(dict(BASE), {name: text})
+
+def test_unknown_variables_are_ignored():
+    env = {"EVAPRO_NOT_A_KEY": "[1", "EVAPRO_ANNOEVA_JOBS__X": "1", "EVAPRO_LIMS3__": "1"}
+    data, applied = _env_overrides(dict(BASE), env)
+    assert applied == []
+    assert data == BASE
+
+def test_load_config(tmp_path):
+    main = tmp_path / "evapro.yaml"
+    main.write_text("syncproject: /tmp/sync.db\nannoeva: annoeva\nannoevaconf: evaconf.yaml\n"
+                    "annoeva_jobs: 2\nlims3:\n  host: lims\n  passwd:\n", encoding="utf-8")
+    environ = {
+        "EVAPRO_CONFIG": str(main),
+        "EVAPRO_USER_CONFIG": str(tmp_path / "missing.yaml"),
+        "EVAPRO_ANNOEVA_JOBS": "6",
+        "EVAPRO_LIMS3__PASSWD": "0123",
+    }
+    conf = load_config(environ)
+    assert conf.annoeva_jobs == 6
+    assert conf.lims3 == {"host": "lims", "passwd": "0123"}
+    assert conf.sources == (str(main),)
+    assert set(conf.overrides) == {"EVAPRO_ANNOEVA_JOBS", "EVAPRO_LIMS3__PASSWD"}
@@ -0,0 +1,60 @@
+import getpass
+import warnings
+
+import pytest
+
+from bench_sync import bench_conf, count_rows
+from fakelims import FakeLims
+
+from evapro.db.database import SQLiteDB
+from evapro.db.lims import LimsSession
+from evapro.db.update_db import lims2evaproDB, plan_lims2evaproDB, update_project_workdir
+
+@pytest.fixture
+def lims(tmp_path):
+    fake = FakeLims(str(tmp_path / "lims"))
+    fake.build(500, [getpass.getuser(), "user1", "user2"])
+    conf = bench_conf(str(tmp_path), fake, latency=0, fail_rate=0, jobs=1, mode="subprocess")
+    with warnings.catch_warnings():
+        # pandas 对非 SQLAlchemy 连接的提示
+        warnings.simplefilter("ignore", UserWarning)
+        yield fake, conf
+
+def sync_runs(conf):
+    db = SQLiteDB(dbpath=conf.syncproject)
+    try:
+        return [tuple(row) for row in db.cur.execute(
+            "SELECT status, inserted, updated FROM sync_runs ORDER BY id").fetchall()]
+    finally:
+        db.close_db()
+
+def test_sync_is_incremental(lims):
+    fake, conf = lims
+    with LimsSession(conf, connect=fake.connect) as session:
+        lims2evaproDB(session, conf)
+        first = count_rows(conf.syncproject)
+        assert first["projects"] > 0
+
+        # 同步之后没有新的任务单, 计划为空
+        plan = plan_lims2evaproDB(session, conf)
+        assert plan.new.empty and plan.changed.empty
+
+        lims2evaproDB(session, conf)
+        update_project_workdir(session, conf)
+    assert count_rows(conf.syncproject)["projects"] == first["projects"]
+    runs = sync_runs(conf)
+    assert [status for status, _, _ in runs] == ["done", "done"]
+    assert runs[0][1] == first["projects"]
+    assert runs[1][1:] == (0, 0)
+
+def test_plan_writes_nothing(lims):
+    fake, conf = lims
+    db = SQLiteDB(dbpath=conf.syncproject)
+    db.migrate()
+    db.close_db()
+    with LimsSession(conf, connect=fake.connect) as session:
+        plan = plan_lims2evaproDB(session, conf)
+        assert not plan.new.empty
+        assert count_rows(conf.syncproject)["projects"] == 0
+        lims2evaproDB(session, conf)
+    assert count_rows(conf.syncproject)["projects"] == len(plan.new)